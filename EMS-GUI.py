@@ -1,53 +1,32 @@
+import time
+STARTUP_BEGAN = time.perf_counter()  # before any other import, so the startup timing covers them
+
 import tkinter as tk
-from tkinter import messagebox, ttk
-import json
-from typing import Any, Dict
-import matplotlib.pyplot as plt
-from matplotlib.backends.backend_tkagg import FigureCanvasTkAgg
+from tkinter import filedialog, messagebox, ttk
 #import calendar
 from datetime import datetime
 import os
-import random
-import re
-from reportlab.lib.pagesizes import letter
-from reportlab.pdfgen import canvas as pdf_canvas
-from tkcalendar import DateEntry
+from bisect import bisect_right
+# matplotlib and tkcalendar are imported where they are first used; they dominate startup time
+
+from ems_jobs import BackgroundSaver, JobExecutor
+from ems_metrics import METRICS_LOG, OPERATIONS, metrics, timer
+from ems_payroll import GROUPINGS, PAY_PERIODS, top_slices
+from ems_services import NUMBER_FIELDS, ClientService, EmployeeService, PayrollService, TaskService, ValidationError
+from ems_store import REFERENCES, DataStore
+from ems_transfer import export_payroll, prepare_export, prepare_import_rows, read_rows
 
 
 # Constants
-DATA_FILE = 'management_data.json'
-
-# Initialize data storage
-if not os.path.exists(DATA_FILE):
-    with open(DATA_FILE, 'w') as file:
-        json.dump({'employees': {}, 'clients': {}, 'tasks': {}}, file)
-
-
-# Helper functions
-def load_data() -> Dict[str, Any]:
-    try:
-        with open(DATA_FILE, 'r') as my_file:
-            return json.load(my_file)
-    except FileNotFoundError:
-        return {}  # to handle the error
-
-
-def save_data(data: Dict[str, Any]) -> None:
-    try:
-        with open(DATA_FILE, 'w') as my_file:
-            json.dump(data, my_file)
-    except IOError as e:
-        print("An error occurred while writing to the file:", e)
-
-def generate_id(prefix, data, length=6):
-    existing_ids = set(data.keys())
-    while True:
-        # Generate a random number with the specified length
-        random_number = ''.join([str(random.randint(0, 9)) for _ in range(length)])
-        new_id = f"{prefix}{random_number}"
-        # Check if the generated ID is unique
-        if new_id not in existing_ids:
-            return new_id
+VIRTUAL_THRESHOLD = 1000  # above this many rows a list only materializes the visible window
+VIRTUAL_BUFFER = 20  # rows rendered below the visible window
+CHART_SLICES = 10  # employees drawn individually in the payroll pie; the rest share one "Other" slice
+CONFLICTS_SHOWN = 10  # records listed when a save finds another user changed the same ones
+COMBO_LIMIT = 200  # names offered in a task form combobox; typing narrows them down
+IMPORT_ERRORS_SHOWN = 10  # rejected rows listed after an import
+ARCHIVE_MATCHES_SHOWN = 20  # archived tasks listed by Search Archive
+TRANSFER_FILETYPES = [('CSV files', '*.csv'), ('Excel workbooks', '*.xlsx')]
+
 
 # Classes
 class ManagementApp:
@@ -65,45 +44,137 @@ class ManagementApp:
         self.tab_control.add(self.client_tab, text='Clients')
         self.tab_control.add(self.task_tab, text='Tasks')
         self.tab_control.add(self.payroll_tab, text='Payroll')
+        # Timings of the hot paths for support; Ctrl+Shift+D (or EMS_DIAGNOSTICS=1) reveals the tab
+        self.diagnostics_tab = ttk.Frame(self.tab_control)
+        self.tab_control.add(self.diagnostics_tab, text='Diagnostics',
+                             state='normal' if os.environ.get('EMS_DIAGNOSTICS') else 'hidden')
+        self.master.bind('<Control-D>', self.show_diagnostics)
+        self.setup_status_bar()
         self.tab_control.pack(expand=1, fill='both')
 
-        self.setup_employee_tab()
-        self.setup_client_tab()
-        self.setup_task_tab()
-        self.setup_payroll_tab()
+        # One shared copy of the data; every manager reads and mutates it through the store
+        self.store = DataStore()
+        self.store.conflict_handler = self.show_conflicts
+
+        # Saves, payroll runs and PDFs run on worker threads and report back through the status bar
+        self.jobs = JobExecutor(master, on_update=self.show_job)
+        self.store.saver = BackgroundSaver(self.store, self.jobs)
+        # Old, closed months of tasks move to the archive before any list or index is built
+        if self.store.archive_old_tasks():
+            self.store.request_save()
 
         #hhm3
         self.task_manager = None
         self.payroll_manager = None
         self.employee_manager = None
         self.client_manager = None
+        self.diagnostics_panel = None
+
+        # Each tab is built the first time it is selected
+        self.tab_builders = {
+            str(self.employee_tab): self.setup_employee_tab,
+            str(self.client_tab): self.setup_client_tab,
+            str(self.task_tab): self.setup_task_tab,
+            str(self.payroll_tab): self.setup_payroll_tab,
+            str(self.diagnostics_tab): self.setup_diagnostics_tab,
+        }
+        self.tab_control.bind('<<NotebookTabChanged>>', self.on_tab_changed)
+        self.on_tab_changed()
+
+        self.master.protocol('WM_DELETE_WINDOW', self.on_close)
+
+    def on_tab_changed(self, _event=None):
+        builder = self.tab_builders.pop(self.tab_control.select(), None)
+        if builder is not None:
+            builder()
+
+    def on_close(self):
+        # Let any background write finish before the process exits
+        self.store.saver.flush()
+        self.jobs.shutdown()
+        self.store.close()
+        metrics.dump()  # only when EMS_METRICS_LOG names a file
+        self.master.destroy()
+
+    def show_conflicts(self, conflicts):
+        # Another copy of the app saved these records first; the lists already show its version
+        lines = [f"{conflict.category[:-1].capitalize()} {conflict.record_id}" for conflict in conflicts[:CONFLICTS_SHOWN]]
+        if len(conflicts) > CONFLICTS_SHOWN:
+            lines.append(f"... and {len(conflicts) - CONFLICTS_SHOWN} more")
+        messagebox.showwarning("Changed by another user",
+                               "These records clashed with changes another user saved first (the same record, "
+                               "or the same name or phone number); their version was kept:\n\n"
+                               + "\n".join(lines))
+
+    def show_diagnostics(self, _event=None):
+        self.tab_control.tab(self.diagnostics_tab, state='normal')
+        self.tab_control.select(self.diagnostics_tab)
+
+    def setup_status_bar(self):
+        self.status_bar = ttk.Frame(self.master)
+        self.status_bar.pack(side='bottom', fill='x', padx=10, pady=(0, 5))
+        self.status_label = ttk.Label(self.status_bar, text='')
+        self.status_label.pack(side='left')
+        self.cancel_button = ttk.Button(self.status_bar, text='Cancel', command=self.cancel_job)
+        self.progress_bar = ttk.Progressbar(self.status_bar, length=200, maximum=1.0)
+
+    def show_job(self, _job):
+        # Show the oldest running job, or hide the progress widgets when none is left
+        job = self.jobs.active[0] if self.jobs.active else None
+        if job is None:
+            self.status_label.config(text='')
+            self.progress_bar.stop()
+            self.progress_bar.pack_forget()
+            self.cancel_button.pack_forget()
+            return
+        self.status_label.config(text=f"{job.name}...")
+        if not self.progress_bar.winfo_ismapped():
+            self.progress_bar.pack(side='left', padx=10)
+        if job.progress is None:
+            if str(self.progress_bar.cget('mode')) != 'indeterminate':
+                self.progress_bar.config(mode='indeterminate', maximum=100)
+                self.progress_bar.start()
+        else:
+            self.progress_bar.stop()
+            self.progress_bar.config(mode='determinate', maximum=1.0, value=job.progress)
+        if job.cancellable:
+            if not self.cancel_button.winfo_ismapped():
+                self.cancel_button.pack(side='left')
+        else:
+            self.cancel_button.pack_forget()
+
+    def cancel_job(self):
+        if self.jobs.active:
+            self.jobs.active[0].cancel()
 
     def setup_employee_tab(self):
-        self.employee_manager = RecordManager(self.employee_tab, 'employees',
-                                              fields=['name', 'phone_number', 'position', 'hourly_rate'],
-                                              id_prefix='E')
+        self.employee_manager = RecordManager(self.employee_tab, EmployeeService(self.store),
+                                              fields=['name', 'phone_number', 'position', 'hourly_rate'], jobs=self.jobs)
 
     def setup_client_tab(self):
-        self.client_manager = RecordManager(self.client_tab, 'clients',
-                                            fields=['name', 'phone_number', 'location'],
-                                            id_prefix='C')
+        self.client_manager = RecordManager(self.client_tab, ClientService(self.store),
+                                            fields=['name', 'phone_number', 'location'], jobs=self.jobs)
 
     def setup_task_tab(self):
-        self.task_manager = TaskManager(self.task_tab, 'tasks',
-                                        fields=['task_name', 'employee_id', 'client_id', 'hours_worked'],
-                                        id_prefix='T')
+        self.task_manager = TaskManager(self.task_tab, TaskService(self.store),
+                                        fields=['task_name', 'employee_id', 'client_id', 'hours_worked'], jobs=self.jobs)
 
     def setup_payroll_tab(self):
-        self.payroll_manager = PayrollManager(self.payroll_tab, 'payroll')
+        self.payroll_manager = PayrollManager(self.payroll_tab, PayrollService(self.store), jobs=self.jobs)
+
+    def setup_diagnostics_tab(self):
+        self.diagnostics_panel = DiagnosticsPanel(self.diagnostics_tab, metrics)
 
 
 class RecordManager:
-    def __init__(self, master, category, fields, id_prefix):
+    def __init__(self, master, service, fields, jobs=None):
         self.master = master
-        self.category = category
+        self.service = service  # validates and saves; the manager only handles the widgets
+        self.jobs = jobs  # JobExecutor for exports and reading imports; None runs them in the caller
+        self.store = service.store
+        self.category = service.category
         self.fields = fields
-        self.id_prefix = id_prefix
-        self.data = load_data()
+        self.data = self.store.data  # shared with every other manager, mutate it through self.store
         self.selected_id = None
         self.entries = {}
         self.search_var = tk.StringVar()
@@ -115,12 +186,33 @@ class RecordManager:
         self.button_frame = None
         self.list_frame = None
         self.tree = None
+        self.scrollbar = None
         self.search_row = None
         # self.search_var = None
 
+        # The list is a view over row_ids (all_ids narrowed by the search box); only rows in
+        # the rendered window exist in the Treeview
+        self.all_ids = []
+        self.row_ids = []
+        # Clicking a heading sorts by it; the ascending order of every column sorted so far is
+        # cached and kept up to date, so switching back or flipping the direction is cheap
+        self.sort_column = None
+        self.sort_reverse = False
+        self.sort_orders = {}  # column -> record IDs in ascending order
+        self.sort_keys = {}  # column -> key function used for that order
+        self.search_job = None
+        self.render_job = None
+        self.rendered = {}  # iid -> values currently shown
+        self.virtual = False
+        self.offset = 0  # index in row_ids of the first rendered row
+        self.visible_rows = 20
+
         # Call the unified UI setup
         self.setup_ui()
         self.refresh_list()
+
+        # Keep the list in step with changes made by any manager
+        self.store.subscribe(self.on_store_change, [self.category])
         
 
     '''def setup_ui(self):
@@ -132,6 +224,18 @@ class RecordManager:
 
     def setup_ui(self):
         # Set up form
+        self.setup_form()
+
+        # Set up buttons
+        self.setup_buttons()
+
+        # search functionality under buttons
+        self.setup_search()
+
+        # Setting up list/tree view
+        self.setup_list()
+
+    def setup_form(self):
         self.form_frame = ttk.LabelFrame(self.master, text=f"{self.category.capitalize()} Form")
         self.form_frame.pack(fill='x', expand=True, padx=10, pady=10)
 
@@ -145,15 +249,6 @@ class RecordManager:
             entry.pack(side='right', expand=True, fill='x')
             self.entries[field] = entry
 
-        # Set up buttons
-        self.setup_buttons()
-
-        # search functionality under buttons
-        self.setup_search()
-
-        # Setting up list/tree view
-        self.setup_list()
-
     def setup_buttons(self):
         self.button_frame = ttk.Frame(self.master)
         self.button_frame.pack(fill='x', expand=True, padx=10, pady=10)
@@ -162,6 +257,8 @@ class RecordManager:
         ttk.Button(self.button_frame, text='Update', command=self.update_record).pack(side='left')
         ttk.Button(self.button_frame, text='Delete', command=self.delete_record).pack(side='left')
         ttk.Button(self.button_frame, text='Clear', command=self.clear_form).pack(side='left')
+        ttk.Button(self.button_frame, text='Export', command=self.export_records).pack(side='right')
+        ttk.Button(self.button_frame, text='Import', command=self.import_records).pack(side='right')
 
     def setup_list(self):
         self.list_frame = ttk.LabelFrame(self.master, text=f"{self.category.capitalize()} List")
@@ -173,10 +270,14 @@ class RecordManager:
                               command=lambda _col=field: self.treeview_sort_column(self.tree, _col, False))
         self.tree.pack(side='left', fill='both', expand=True)
 
-        scrollbar = ttk.Scrollbar(self.list_frame, orient='vertical', command=self.tree.yview)
-        scrollbar.pack(side='right', fill='y')
-        self.tree.config(yscrollcommand=scrollbar.set)
+        self.scrollbar = ttk.Scrollbar(self.list_frame, orient='vertical', command=self.on_scroll)
+        self.scrollbar.pack(side='right', fill='y')
+        self.tree.config(yscrollcommand=self.on_tree_scrolled)
         self.tree.bind('<<TreeviewSelect>>', self.on_tree_select)
+        self.tree.bind('<Configure>', self.on_tree_resize)
+        for sequence in ('<MouseWheel>', '<Button-4>', '<Button-5>'):
+            self.tree.bind(sequence, self.on_mouse_wheel)
+        self.rendered = {}
 
 
     def setup_search(self):
@@ -188,81 +289,38 @@ class RecordManager:
         search_entry = ttk.Entry(self.search_row, textvariable=self.search_var)
         search_entry.pack(side='left', expand=True, fill='x')
         ttk.Button(self.search_row, text='Search', command=self.search_records).pack(side='right')
+        # Filter the list as the user types
+        self.search_var.trace_add('write', lambda *_args: self.schedule_search())
 
     def add_record(self):
-        # Use the helper to prepare and validate the data
-        success, new_data = self._validate_and_prepare_data()
-        if not success:
-            return
-
+        new_data = {field: self.entries[field].get() for field in self.fields}
         try:
-            new_id = generate_id(self.id_prefix, self.data[self.category])
-            self.data[self.category][new_id] = new_data
-            save_data(self.data)
-            self.refresh_list()
-            self.clear_form()
-            messagebox.showinfo("Success", "Record added successfully.")
+            self.service.add(new_data)
+        except ValidationError as e:
+            messagebox.showerror('Error', str(e))
+            return
         except Exception as e:
             messagebox.showerror("Error", f"Failed to add record: {str(e)}")
-
-    def _validate_and_prepare_data(self):
-        """
-        Helper method to validate fields and prepare data for adding or updating a record.
-        Returns a tuple (success: bool, new_data: dict).
-        """
-        new_data = {field: self.entries[field].get() for field in self.fields}
-
-        # Check if all fields are filled
-        if any(v == "" for v in new_data.values()):
-            messagebox.showerror('Error', 'All fields must be filled.')
-            return False, {}
-
-        # Validate phone number if 'phone_number' is a field
-        if 'phone_number' in new_data:
-            phone_number = new_data['phone_number']
-            # Check if the phone number contains only digits and has 10 digits
-            if not re.fullmatch(r"\d{10}", phone_number):
-                messagebox.showerror('Error', 'Phone number must contain exactly 10 digits.')
-                return False, {}
-
-        # Check for duplicate fields dynamically based on available fields
-        for field in self.fields:
-            # Check for duplicates only if the field should be unique
-            if field == 'name':
-                if any(record.get('name', '').lower() == new_data['name'].lower() for record in
-                       self.data[self.category].values()):
-                    messagebox.showerror('Error', f"A record with the same {field} already exists.")
-                    return False, {}
-            elif field == 'phone_number':
-                if any(record.get('phone_number', '') == new_data['phone_number'] for record in
-                       self.data[self.category].values()):
-                    messagebox.showerror('Error', 'An item with the same phone number already exists.')
-                    return False, {}
-
-        return True, new_data
+            return
+        self.clear_form()
+        messagebox.showinfo("Success", "Record added successfully.")
 
     def update_record(self):
         if not self.selected_id:
             messagebox.showerror('Error', 'No record selected for update.')
             return
 
+        # Same checks as adding, except the record may keep its own name and phone number
         updated_data = {field: self.entries[field].get() for field in self.fields}
-        if any(v == "" for v in updated_data.values()):
-            messagebox.showerror('Error', 'All fields must be filled.')
-            return
-
-        # Validate phone number
-        if 'phone_number' in updated_data and not self.is_valid_phone(updated_data['phone_number']):
-            messagebox.showerror('Error', 'Invalid phone number format.')
-            return
-
         try:
-            self.data[self.category][self.selected_id] = updated_data
-            save_data(self.data)  # Assuming save_data is correctly defined to not require parameters
-            self.refresh_list()
-            messagebox.showinfo("Success", "Record updated successfully.")  # Inform the user of success
+            self.service.update(self.selected_id, updated_data)
+        except ValidationError as e:
+            messagebox.showerror('Error', str(e))
+            return
         except Exception as e:
             messagebox.showerror("Error", f"Failed to update Employee/Client: {str(e)}")
+            return
+        messagebox.showinfo("Success", "Record updated successfully.")  # Inform the user of success
 
     def delete_record(self):
         if not self.selected_id:
@@ -271,63 +329,284 @@ class RecordManager:
 
         try:
             # Deletes the selected record
-            del self.data[self.category][self.selected_id]
-            save_data(self.data)
-            self.refresh_list()
+            self.service.delete(self.selected_id)
             self.clear_form()
             messagebox.showinfo("Success", "Record deleted successfully.")  # Inform the user of success
+        except ValidationError as e:
+            messagebox.showerror('Error', str(e))  # e.g. a task in a closed pay period
         except KeyError:
             messagebox.showerror("Error", "Failed to delete Employee/Client: Record does not exist.")
         except Exception as e:
             messagebox.showerror("Error", f"An unexpected error occurred: {str(e)}")
 
-    @staticmethod
-    def is_valid_phone(phone):
-        # Pattern to match US phone numbers that may include country code
-        pattern = re.compile(r"^\+?1?\s?(\([0-9]{3}\)|[0-9]{3})[\s.-]?[0-9]{3}[\s.-]?[0-9]{4}$")
-        return pattern.match(phone) is not None
+    def export_records(self):
+        path = filedialog.asksaveasfilename(parent=self.master, defaultextension='.csv', filetypes=TRANSFER_FILETYPES,
+                                            initialfile=f"{self.category}.csv")
+        if not path:
+            return
 
-    def treeview_sort_column(self, tv, col, reverse):
-        l = [(tv.set(k, col), k) for k in tv.get_children('')]
-        l.sort(reverse=reverse)
+        # Only the ID -> record dict is copied here; the rows are streamed to the file on a worker
+        write = prepare_export(self.store, self.category, path)
 
-        # Rearrange items in sorted positions
-        for index, (val, k) in enumerate(l):
-            tv.move(k, '', index)
+        def written(count):
+            messagebox.showinfo("Success", f"Exported {count} {self.category} to {path}.")
+
+        def failed(error):
+            messagebox.showerror("Error", f"Failed to export {self.category}: {error}")
+
+        if self.jobs is None:
+            written(write())
+            return
+        self.jobs.submit(lambda job: write(progress=job.report), name=f"Exporting {self.category}",
+                         on_done=written, on_error=failed)
+
+    def import_records(self):
+        path = filedialog.askopenfilename(parent=self.master, filetypes=TRANSFER_FILETYPES)
+        if not path:
+            return
+
+        # The file is read and checked on a worker; only storing the valid rows happens here
+        check = prepare_import_rows(self.service, read_rows(path, self.category))
+
+        def store_rows(store):
+            result = store()
+            message = f"Imported {len(result.ids)} {self.category}."
+            if result.errors:
+                lines = [f"Line {line}: {error}" for line, error in result.errors[:IMPORT_ERRORS_SHOWN]]
+                if len(result.errors) > IMPORT_ERRORS_SHOWN:
+                    lines.append(f"... and {len(result.errors) - IMPORT_ERRORS_SHOWN} more")
+                messagebox.showwarning("Import", f"{message}\n{len(result.errors)} rows were skipped:\n\n"
+                                       + "\n".join(lines))
+            else:
+                messagebox.showinfo("Success", message)
+
+        def failed(error):
+            messagebox.showerror("Error", f"Failed to import {self.category}: {error}")
+
+        if self.jobs is None:
+            try:
+                store = check()
+            except (OSError, ValueError) as e:
+                failed(e)
+                return
+            store_rows(store)
+            return
+        self.jobs.submit(lambda job: check(), name=f"Importing {os.path.basename(path)}", on_done=store_rows,
+                         on_error=failed)
+
+    def treeview_sort_column(self, tv, col, reverse):
+        # Sort the backing rows, the tree may only hold the visible window
+        self.sort_column = col
+        self.sort_reverse = reverse
+        self.all_ids = self.sorted_ids()
+        self.offset = 0
+        self.apply_search()
 
         # Reverse sort next time
         tv.heading(col, command=lambda: self.treeview_sort_column(tv, col, not reverse))
 
+    def sort_key(self, col):
+        """Key for ordering record IDs by a column: amounts as numbers, text ignoring case, IDs by number."""
+        records = self.data[self.category]
+        if col == 'ID':
+            return lambda record_id: (len(record_id), record_id)
+        if col in NUMBER_FIELDS:
+            def number(record_id):
+                value = getattr(records[record_id], col)  # parsed when the record was loaded
+                return (0, value) if isinstance(value, float) else (1, 0.0)  # unparseable amounts sort last
+            return number
+        return lambda record_id: str(records[record_id].get(col, '')).casefold()
+
+    def sorted_ids(self):
+        """All IDs in the current sort order; ascending it is the cached order itself, descending a reversed copy."""
+        order = self.sort_orders.get(self.sort_column)
+        if order is None:
+            key = self.sort_keys[self.sort_column] = self.sort_key(self.sort_column)
+            order = self.sort_orders[self.sort_column] = sorted(self.data[self.category], key=key)
+        return order[::-1] if self.sort_reverse else order
+
+    def update_sort_orders(self, change):
+        # Keep every cached order (and a reversed current view) sorted without re-sorting
+        for col, order in self.sort_orders.items():
+            mirror = self.all_ids if col == self.sort_column and self.sort_reverse else None
+            if change.old is not None:
+                index = order.index(change.record_id)
+                del order[index]
+                if mirror is not None:
+                    del mirror[len(order) - index]
+            if change.new is not None:
+                key = self.sort_keys[col]
+                index = bisect_right(order, key(change.record_id), key=key)
+                order.insert(index, change.record_id)
+                if mirror is not None:
+                    mirror.insert(len(order) - 1 - index, change.record_id)
+
     def search_records(self):
-        query = self.search_var.get().lower()
-        for child in self.tree.get_children():
-            if query in self.tree.item(child, 'values')[1].lower():
-                self.tree.selection_set(child)
-                self.tree.see(child)
-                return
+        # The list already holds every match; select the first one
+        self.apply_search()
+        if self.row_ids and self.search_var.get().strip():
+            self.show_record(self.row_ids[0])
+            return
         messagebox.showinfo("Search", "No matching record found!")
 
+    def schedule_search(self, delay=100):
+        # Coalesce keystrokes (and bursts of store changes) into one filter pass
+        if self.search_job is not None:
+            self.master.after_cancel(self.search_job)
+        self.search_job = self.master.after(delay, self.apply_search)
+
+    def schedule_render(self):
+        # A batch of store changes (an import, add_many) is drawn once, when Tk is idle
+        if self.render_job is None:
+            self.render_job = self.master.after_idle(self.render_rows)
+
+    @timer('search')
+    def apply_search(self):
+        """Narrow row_ids to the records matching the search box, in all_ids order."""
+        self.search_job = None
+        matches = self.store.search_index(self.category).search(self.search_var.get())
+        if matches is None:
+            self.row_ids = self.all_ids
+        else:
+            self.row_ids = [record_id for record_id in self.all_ids if record_id in matches]
+            self.offset = 0
+        self.render_rows()
+
+    def show_record(self, record_id):
+        """Scroll record_id into the rendered window and select it."""
+        if self.virtual:
+            index = self.row_ids.index(record_id)
+            if not self.offset <= index < self.offset + self.visible_rows:
+                self.offset = max(0, index - self.visible_rows // 2)
+                self.render_rows()
+        self.tree.selection_set(record_id)
+        self.tree.see(record_id)
+
+    @timer('refresh')
     def refresh_list(self):
-        for i in self.tree.get_children():
-            self.tree.delete(i)
+        self.sort_orders.clear()
+        self.sort_keys.clear()
+        self.all_ids = list(self.data[self.category]) if self.sort_column is None else self.sorted_ids()
+        self.row_ids = self.all_ids
+        if self.search_var.get().strip():
+            self.apply_search()
+        else:
+            self.render_rows()
+
+    def render_rows(self):
+        """Bring the Treeview in line with row_ids, touching only rows that were added, changed, moved or removed."""
+        if self.render_job is not None:
+            self.master.after_cancel(self.render_job)
+            self.render_job = None
+        self.virtual = len(self.row_ids) > VIRTUAL_THRESHOLD
+        if self.virtual:
+            self.offset = max(0, min(self.offset, len(self.row_ids) - self.visible_rows))
+            window = self.row_ids[self.offset:self.offset + self.visible_rows + VIRTUAL_BUFFER]
+        else:
+            self.offset = 0
+            window = self.row_ids
+
+        records = self.data[self.category]
+        wanted = {record_id: tuple(self.row_values(record_id, records[record_id])) for record_id in window}
+        for iid in [iid for iid in self.rendered if iid not in wanted]:
+            self.tree.delete(iid)
+            del self.rendered[iid]
+
+        current = list(self.tree.get_children())
+        for index, (iid, values) in enumerate(wanted.items()):
+            if iid in self.rendered:
+                if self.rendered[iid] != values:
+                    self.tree.item(iid, values=values)
+                if index >= len(current) or current[index] != iid:
+                    self.tree.move(iid, '', index)
+                    current.remove(iid)
+                    current.insert(index, iid)
+            else:
+                self.tree.insert('', index, iid=iid, values=values)
+                current.insert(index, iid)
+                if iid == self.selected_id:
+                    self.tree.selection_add(iid)  # scrolled back into view
+            self.rendered[iid] = values
+
+        if self.virtual:
+            # The tree itself always shows its first rows; the scrollbar tracks the position in row_ids
+            self.tree.yview_moveto(0)
+            total = len(self.row_ids)
+            self.scrollbar.set(self.offset / total, min(1.0, (self.offset + self.visible_rows) / total))
+
+    def row_values(self, record_id, info):
+        values = [record_id]
+        for field in self.fields:
+            if field in info:
+                values.append(self.display_value(field, info[field]))
+            else:
+                values.append("N/A")  # Provide a default value if the field is missing
+        return values
+
+    def display_value(self, field, value):
+        # How a stored value is shown in the list and the form
+        return value
+
+    def on_store_change(self, change):
+        # Only the changed row is touched in the Treeview
+        if self.sort_column is not None:
+            self.update_sort_orders(change)  # all_ids is, or mirrors, the current order
+        elif change.action == 'add':
+            self.all_ids.append(change.record_id)
+        elif change.action == 'delete' and change.record_id in self.all_ids:
+            self.all_ids.remove(change.record_id)
+        if self.row_ids is not self.all_ids:
+            if change.action == 'delete' and change.record_id in self.row_ids:
+                self.row_ids.remove(change.record_id)
+            # Filtered: whether the record still matches is known once the search index has seen the change
+            self.schedule_search(delay=0)
+        else:
+            self.schedule_render()
 
-        for record_id, info in self.data[self.category].items():
-            values = [record_id]
-            for field in self.fields:
-                if field in info:
-                    values.append(info[field])
-                else:
-                    values.append("N/A")  # Provide a default value if the field is missing
-            self.tree.insert('', 'end', iid=record_id, values=values)
+    def on_tree_scrolled(self, first, last):
+        if not self.virtual:
+            self.scrollbar.set(first, last)
+
+    def on_scroll(self, action, amount, unit=None):
+        if not self.virtual:
+            if unit:
+                self.tree.yview(action, amount, unit)
+            else:
+                self.tree.yview(action, amount)
+            return
+        if action == 'moveto':
+            self.offset = int(float(amount) * len(self.row_ids))
+        elif unit == 'pages':
+            self.offset += int(amount) * self.visible_rows
+        else:
+            self.offset += int(amount)
+        self.render_rows()
+
+    def on_mouse_wheel(self, event):
+        if not self.virtual:
+            return None  # the Treeview scrolls itself
+        step = -3 if event.num == 4 or event.delta > 0 else 3
+        self.on_scroll('scroll', step, 'units')
+        return 'break'
+
+    def on_tree_resize(self, event):
+        row_height = int(ttk.Style().lookup('Treeview', 'rowheight') or 20)
+        self.visible_rows = max(1, event.height // row_height - 1)  # minus the heading row
+        if self.virtual:
+            self.render_rows()
 
     def on_tree_select(self, _event):
         selection = self.tree.selection()
         if selection:  # Check if the selection is not empty
+            if selection[0] == self.selected_id:
+                return  # re-selected after scrolling back into view, keep any edits in the form
             self.selected_id = selection[0]
             selected_record = self.data[self.category][self.selected_id]
             for field in self.fields:
                 self.entries[field].delete(0, 'end')
-                self.entries[field].insert(0, selected_record[field])
+                self.entries[field].insert(0, self.display_value(field, selected_record[field]))
+        elif self.selected_id in self.data[self.category] and not self.tree.exists(self.selected_id):
+            pass  # the selected row was scrolled out of the rendered window
         else:
             self.clear_form()  # Clear the form if nothing is selected
 
@@ -341,27 +620,96 @@ class RecordManager:
 
 
 class TaskManager(RecordManager):
-    def __init__(self, master, category, fields, id_prefix):
-        # Load data before calling the base class
-        self.data = load_data()
-        self.employees = {emp_id: emp['name'] for emp_id, emp in self.data['employees'].items()}
-        self.clients = {client_id: client['name'] for client_id, client in self.data['clients'].items()}
-        self.employee_name_to_id = {emp['name']: emp_id for emp_id, emp in self.data['employees'].items()}
-        self.client_name_to_id = {client['name']: client_id for client_id, client in self.data['clients'].items()}
+    def __init__(self, master, service, fields, jobs=None):
+        # Employees and clients are shown by name; the store keeps their ID -> name maps up to
+        # date, and names typed or picked in the comboboxes are turned back into IDs by the TaskService
+        self.store = service.store
+        self.name_indexes = {field: self.store.name_index(category) for field, category in REFERENCES['tasks'].items()}
 
         # Add 'date' to fields to track when each task was completed
         fields.append('date')
 
-        # Call the superclass constructor to properly initialize the base class
-        super().__init__(master, category, fields, id_prefix)
+        # Call the superclass constructor; it builds the UI with the task form below
+        super().__init__(master, service, fields, jobs)
 
-        # Set up the custom UI for TaskManager
-        self.setup_task_ui()
+        # Renamed or removed employees and clients change how tasks are shown and sorted by them
+        self.store.subscribe(self.on_people_change, REFERENCES['tasks'].values())
 
-    def setup_task_ui(self):
-        # Ensure that any existing widgets are destroyed to avoid duplicates
-        if hasattr(self, 'form_frame') and self.form_frame:
-            self.form_frame.destroy()
+    def setup_list(self):
+        super().setup_list()
+        for field, category in REFERENCES['tasks'].items():
+            self.tree.heading(field, text=category[:-1].capitalize())  # the column shows names, not IDs
+
+    def display_value(self, field, value):
+        name_index = self.name_indexes.get(field)
+        if name_index is None:
+            return value
+        name = name_index.name(value)
+        return value if name is None else name  # tasks can outlive the employee or client they name
+
+    def sort_key(self, col):
+        name_index = self.name_indexes.get(col)
+        if name_index is None:
+            return super().sort_key(col)
+        records = self.data[self.category]
+        return lambda record_id: self.display_value(col, records[record_id].get(col, '')).casefold()
+
+    def on_people_change(self, change):
+        if change.action == 'add':
+            return  # no task refers to a new record yet
+        for field, category in REFERENCES['tasks'].items():
+            if category == change.category and self.sort_orders.pop(field, None) is not None:
+                self.sort_keys.pop(field, None)
+                if self.sort_column == field:
+                    # Names moved: re-sort by them, then filter and render as after clicking the heading
+                    self.all_ids = self.sorted_ids()
+                    self.schedule_search(delay=0)
+                    return
+        self.schedule_render()  # only rows showing a changed name are touched
+
+    def setup_search(self):
+        super().setup_search()
+        ttk.Button(self.search_row, text='Search Archive', command=self.search_archive).pack(side='right')
+
+    def search_archive(self):
+        # Old months are not in the list; their partitions are read on a worker, one month at a time
+        query = self.search_var.get().strip()
+        if not query:
+            messagebox.showinfo("Search Archive", "Type what to look for in the search box first.")
+            return
+        if not self.store.archive.months():
+            messagebox.showinfo("Search Archive", "No tasks have been archived yet.")
+            return
+        search = self.service.prepare_archive_search(query)
+
+        def found(matches):
+            if not matches:
+                messagebox.showinfo("Search Archive", "No matching archived task found!")
+                return
+            lines = [f"{task_id}  {task.get('date', '')}  {task.get('task_name', '')}  "
+                     f"{self.display_value('employee_id', task.get('employee_id', ''))}  "
+                     f"{self.display_value('client_id', task.get('client_id', ''))}  {task.get('hours_worked', '')} h"
+                     for task_id, task in matches[:ARCHIVE_MATCHES_SHOWN]]
+            if len(matches) > ARCHIVE_MATCHES_SHOWN:
+                lines.append(f"... and {len(matches) - ARCHIVE_MATCHES_SHOWN} more")
+            messagebox.showinfo("Search Archive", f"{len(matches)} archived tasks match:\n\n" + "\n".join(lines))
+
+        def failed(error):
+            messagebox.showerror("Error", f"Failed to search the archive: {error}")
+
+        if self.jobs is None:
+            found(search())
+            return
+        self.jobs.submit(lambda job: search(progress=job.report), name='Searching the archive',
+                         on_done=found, on_error=failed)
+
+    def filter_names(self, field):
+        # Type-ahead: offer the names matching what has been typed so far
+        combobox = self.entries[field]
+        combobox.config(values=self.name_indexes[field].matches(combobox.get(), COMBO_LIMIT))
+
+    def setup_form(self):
+        from tkcalendar import DateEntry
 
         # Set up the form specific to TaskManager
         self.form_frame = ttk.LabelFrame(self.master, text='Task Form')
@@ -375,12 +723,10 @@ class TaskManager(RecordManager):
             label = ttk.Label(row, text=field.capitalize() + ':')
             label.pack(side='left')
 
-            if field == 'employee_id':
-                # Use employee names instead of IDs
-                self.entries[field] = ttk.Combobox(row, values=list(self.employees.values()))
-            elif field == 'client_id':
-                # Use client names instead of IDs
-                self.entries[field] = ttk.Combobox(row, values=list(self.clients.values()))
+            if field in self.name_indexes:
+                # Pick employees and clients by name; the list is filled when it opens or as the user types
+                self.entries[field] = ttk.Combobox(row, postcommand=lambda _field=field: self.filter_names(_field))
+                self.entries[field].bind('<KeyRelease>', lambda _event, _field=field: self.filter_names(_field))
             elif field == 'date':
                 # Use DateEntry widget for date input
                 self.entries[field] = DateEntry(row, date_pattern='yyyy-mm-dd')
@@ -390,71 +736,60 @@ class TaskManager(RecordManager):
 
             self.entries[field].pack(side='right', expand=True, fill='x')
 
-        # Set up buttons and list to avoid duplicate creation
-        if hasattr(self, 'button_frame') and self.button_frame:
-            self.button_frame.destroy()
-        self.setup_buttons()
+    #ends here
 
-        if hasattr(self, 'list_frame') and self.list_frame:
-            self.list_frame.destroy()
-        self.setup_list()
+#end of task and start of payroll
 
-        # Avoid multiple calls to `setup_search()`
-        if hasattr(self, 'search_row') and self.search_row:
-            self.search_row.destroy()
-        self.setup_search()
-        self.refresh_list()
+class PayrollChart:
+    """
+    One matplotlib figure embedded in a Tk frame, redrawn in place for each result.
 
-    #ends here
-    def add_record(self):
-        new_data = {field: self.entries[field].get() for field in self.fields}
+    The figure is built with matplotlib.figure.Figure rather than pyplot, so it is not
+    kept alive by pyplot's figure registry, and redraws go through draw_idle.
+    """
 
-        # Check if all fields are filled
-        if any(v == "" for v in new_data.values()):
-            messagebox.showerror('Error', 'All fields must be filled.')
-            return
+    def __init__(self, master):
+        from matplotlib.backends.backend_tkagg import FigureCanvasTkAgg
+        from matplotlib.figure import Figure
 
-        # Convert employee and client names back to IDs for storage
-        if new_data['employee_id'] in self.employee_name_to_id:
-            new_data['employee_id'] = self.employee_name_to_id[new_data['employee_id']]
-        else:
-            messagebox.showerror('Error', 'Invalid employee selected.')
-            return
+        self.figure = Figure(figsize=(8, 5))
+        self.axes = self.figure.add_subplot()
+        self.canvas = FigureCanvasTkAgg(self.figure, master=master)
+        self.canvas.get_tk_widget().pack(side='right', fill='both', expand=True, padx=10, pady=10)
 
-        if new_data['client_id'] in self.client_name_to_id:
-            new_data['client_id'] = self.client_name_to_id[new_data['client_id']]
-        else:
-            messagebox.showerror('Error', 'Invalid client selected.')
-            return
+    def show(self, amounts, labels, title):
+        self.axes.clear()
+        self.axes.pie(amounts, labels=labels, autopct='%1.1f%%')
+        self.axes.set_title(title)
+        self.canvas.draw_idle()
 
-        try:
-            new_id = generate_id(self.id_prefix, self.data[self.category])
-            self.data[self.category][new_id] = new_data
-            save_data(self.data)
-            self.refresh_list()
-            self.clear_form()
-            messagebox.showinfo("Success", "Task added successfully.")
-        except Exception as e:
-            messagebox.showerror("Error", f"Failed to add Task: {str(e)}")
+    def clear(self):
+        self.axes.clear()
+        self.axes.set_axis_off()
+        self.canvas.draw_idle()
 
-#end of task and start of payroll
 
 class PayrollManager:
-    def __init__(self, master, category):
+    def __init__(self, master, service, jobs=None):
         self.master = master
-        self.category = category
-        self.data = load_data()  # Load data from JSON
-
-        # Load employee data for payroll calculations
-        self.employees = {emp_id: emp for emp_id, emp in self.data['employees'].items()}
+        self.service = service  # computes the payroll and writes the reports
+        self.store = service.store
+        self.jobs = jobs  # JobExecutor for payroll runs and PDFs; None runs them in the caller
+        self.data = self.store.data  # shared store, so new employees and tasks are always visible
+        self.pdf_job = None
 
         # Set up UI components
         self.form_frame = None
         self.start_date_entry = None
         self.end_date_entry = None
+        self.group_by_entry = None
+        self.period_kind_entry = None
+        self.period_entry = None
+        self.shown_periods = []  # (start, end, closed) behind period_entry's values
         self.calculate_button = None
         self.output_frame = None
         self.tree = None
+        self.chart = None  # PayrollChart, made on the first calculation
         self.generate_pdf_button = None
 
         self.setup_ui()
@@ -478,6 +813,29 @@ class PayrollManager:
         self.end_date_entry = ttk.Entry(end_date_row)
         self.end_date_entry.pack(side='left', expand=True, fill='x', padx=5)
 
+        # Breakdown Row
+        group_by_row = ttk.Frame(self.form_frame)
+        group_by_row.pack(fill='x', padx=5, pady=5)
+        ttk.Label(group_by_row, text='Group By:').pack(side='left')
+        self.group_by_entry = ttk.Combobox(group_by_row, values=[g.capitalize() for g in GROUPINGS], state='readonly')
+        self.group_by_entry.current(0)
+        self.group_by_entry.pack(side='left', expand=True, fill='x', padx=5)
+
+        # Pay Period Row: picking a period fills in its dates; a period that has ended can be closed
+        period_row = ttk.Frame(self.form_frame)
+        period_row.pack(fill='x', padx=5, pady=5)
+        ttk.Label(period_row, text='Pay Period:').pack(side='left')
+        self.period_kind_entry = ttk.Combobox(period_row, values=[kind.capitalize() for kind in PAY_PERIODS],
+                                              state='readonly', width=10)
+        self.period_kind_entry.current(PAY_PERIODS.index('monthly'))
+        self.period_kind_entry.pack(side='left', padx=5)
+        self.period_kind_entry.bind('<<ComboboxSelected>>', lambda _event: self.period_entry.set(''))
+        self.period_entry = ttk.Combobox(period_row, state='readonly', postcommand=self.list_pay_periods)
+        self.period_entry.pack(side='left', expand=True, fill='x', padx=5)
+        self.period_entry.bind('<<ComboboxSelected>>', self.on_period_selected)
+        self.close_button = ttk.Button(period_row, text='Close Period', command=self.close_period)
+        self.close_button.pack(side='left')
+
         # Buttons for calculating and generating payroll
         self.calculate_button = ttk.Button(self.master, text='Calculate Payroll', command=self.calculate_payroll)
         self.calculate_button.pack(pady=10)
@@ -486,6 +844,8 @@ class PayrollManager:
                                               command=self.generate_payroll_pdf)
         self.generate_pdf_button.pack(pady=10)
 
+        ttk.Button(self.master, text='Export Payroll', command=self.export_payroll).pack(pady=10)
+
         # Output frame for displaying results like charts and payroll breakdown
         self.output_frame = ttk.Frame(self.master)
         self.output_frame.pack(fill='both', expand=True)
@@ -499,141 +859,322 @@ class PayrollManager:
         self.tree.pack(side='left', fill='y', padx=10, pady=10)
 
     def calculate_payroll(self):
+        date_range = self.read_date_range()
+        if date_range is None:
+            return
+
+        # Calculating payroll
+        grouping = self.group_by_entry.get().lower()
+        self.run_payroll(date_range, grouping, self.show_payroll)
+
+    def show_payroll(self, result):
+        payroll_data = result.totals
+
+        # Displaying payroll breakdown in the Treeview
+        for item in self.tree.get_children():
+            self.tree.delete(item)  # Clearing the tree before updating
+
+        if result.grouping != 'employee':
+            # One row per week/month/client with its employees listed underneath
+            for group, amounts in result.groups.items():
+                label = self.service.client_name(group) if result.grouping == 'client' else group
+                parent = self.tree.insert('', 'end', values=(label, f"${sum(amounts.values()):.2f}"), open=True)
+                for employee_id, total_salary in amounts.items():
+                    self.tree.insert(parent, 'end', values=(self.employee_name(employee_id), f"${total_salary:.2f}"))
+        else:
+            for employee_id, total_salary in payroll_data.items():
+                self.tree.insert('', 'end', values=(self.employee_name(employee_id), f"${total_salary:.2f}"))
+
+        # Displaying results in pie chart
+        if payroll_data:
+            self.display_payroll_chart(payroll_data)
+        else:
+            if self.chart is not None:
+                self.chart.clear()
+            messagebox.showinfo("Info", "No tasks found for the specified date range.")
+
+    def employee_name(self, employee_id):
+        return self.service.employee_name(employee_id)
+
+    def display_payroll_chart(self, payroll_data):
+        # The figure and canvas are made once per tab and redrawn in place
+        if self.chart is None:
+            self.chart = PayrollChart(self.output_frame)
+        top, rest = top_slices(payroll_data, CHART_SLICES)
+        amounts = [amount for _employee_id, amount in top]
+        labels = [self.employee_name(employee_id) for employee_id, _amount in top]
+        if rest > 0:
+            amounts.append(rest)
+            labels.append(f"Other ({len(payroll_data) - len(top)})")
+        self.chart.show(amounts, labels, 'Payroll Distribution')
+
+    def read_date_range(self):
+        """Parse the start and end date entries; shows an error and returns None if they are invalid."""
         start_date = self.start_date_entry.get()
         end_date = self.end_date_entry.get()
         if not start_date or not end_date:
             messagebox.showerror('Error', 'Please enter start and end dates.')
-            return
+            return None
 
         try:
-            start_date = datetime.strptime(start_date, '%Y-%m-%d')
-            end_date = datetime.strptime(end_date, '%Y-%m-%d')
+            start_date = datetime.strptime(start_date, '%Y-%m-%d').date()
+            end_date = datetime.strptime(end_date, '%Y-%m-%d').date()
         except ValueError:
             messagebox.showerror('Error', 'Dates must be in YYYY-MM-DD format.')
-            return
+            return None
 
         if start_date > end_date:
             messagebox.showerror('Error', 'Start date must be before end date.')
+            return None
+        return start_date, end_date
+
+    def list_pay_periods(self):
+        kind = self.period_kind_entry.get().lower()
+        self.shown_periods = self.service.pay_periods(kind)[::-1]  # newest first
+        self.period_entry.config(values=[f"{start.isoformat()} to {end.isoformat()}" + (' (closed)' if closed else '')
+                                         for start, end, closed in self.shown_periods])
+
+    def on_period_selected(self, _event=None):
+        start, end, _closed = self.shown_periods[self.period_entry.current()]
+        for entry, day in ((self.start_date_entry, start), (self.end_date_entry, end)):
+            entry.delete(0, 'end')
+            entry.insert(0, day.isoformat())
+
+    def close_period(self):
+        index = self.period_entry.current()
+        if index < 0:
+            messagebox.showerror('Error', 'Please select a pay period to close.')
             return
+        kind = self.period_kind_entry.get().lower()
+        start, end, _closed = self.shown_periods[index]
+        if not messagebox.askyesno('Close Pay Period',
+                                   f"Close the {kind} period {start.isoformat()} to {end.isoformat()}?\n\n"
+                                   "Its tasks can no longer be added, changed or deleted, and reports on it "
+                                   "will show the pay as it is now."):
+            return
+        # The period's runs and snapshot are worked out on a worker; only writing it happens here
+        def failed(error):
+            messagebox.showerror('Error', f"Failed to close the pay period: {error}")
 
-        # Calculating payroll
-        payroll_data = {}
-        for task_id, task in self.data['tasks'].items():
-            employee_id = task['employee_id']
-            task_date = datetime.strptime(task['date'], '%Y-%m-%d')
+        def closed(prepared):
+            try:
+                self.service.finish_close_period(prepared)
+            except (OSError, ValueError) as e:
+                failed(e)
+                return
+            self.list_pay_periods()
+            self.period_entry.current(index)
+            messagebox.showinfo('Success', f"The {kind} period {start.isoformat()} to {end.isoformat()} is closed.")
+
+        try:
+            compute = self.service.prepare_close_period(kind, start)
+            if self.jobs is None:
+                closed(compute())
+                return
+        except (OSError, ValueError) as e:
+            failed(e)
+            return
+        self.close_button.config(state='disabled')
+        self.jobs.submit(lambda job: compute(), name=f"Closing the {kind} period", on_done=closed, on_error=failed,
+                         on_finish=lambda: self.close_button.config(state='normal'))
+
+    def run_payroll(self, date_range, grouping, on_done):
+        """Call on_done with the payroll for the range: from the cache if still valid, else computed on a worker."""
+        cached = self.service.cached(*date_range, grouping)
+        if cached is not None:
+            on_done(cached)
+            return
 
-            if start_date <= task_date <= end_date:
-                if employee_id not in payroll_data:
-                    payroll_data[employee_id] = 0
-                payroll_data[employee_id] += int(task['hours_worked']) * float(
-                    self.employees[employee_id]['hourly_rate'])
+        # The columns are copied here on the Tk thread; the number crunching runs on a worker
+        compute = self.service.prepare(*date_range, grouping)
+        if self.jobs is None:
+            on_done(compute())
+            return
+        self.calculate_button.config(state='disabled')
+        self.jobs.submit(lambda job: compute(), name='Calculating payroll', on_done=on_done,
+                         on_finish=lambda: self.calculate_button.config(state='normal'),
+                         on_error=lambda e: messagebox.showerror("Error", f"Failed to calculate payroll: {e}"))
 
-        # Displaying payroll breakdown in the Treeview
-        for item in self.tree.get_children():
-            self.tree.delete(item)  # Clearing the tree before updating
+    def generate_payroll_pdf(self):
+        date_range = self.read_date_range()
+        if date_range is None:
+            return
+        if self.pdf_job is not None:
+            messagebox.showinfo("Info", "A payroll report is already being generated.")
+            return
+        self.run_payroll(date_range, 'employee', self.write_pdf)
 
-        for employee_id, total_salary in payroll_data.items():
-            employee_name = self.employees[employee_id]['name']
-            self.tree.insert('', 'end', values=(employee_name, f"${total_salary:.2f}"))
+    def write_pdf(self, result):
+        if not result.totals:
+            messagebox.showinfo("Info", "No tasks found for the specified date range.")
+            return
 
-        # Displaying results in pie chart
-        if payroll_data:
-            fig, ax = plt.subplots(figsize=(8, 5))
-            ax.pie(
-                list(payroll_data.values()),
-                labels=[self.employees[emp_id]['name'] for emp_id in payroll_data.keys()],
-                autopct='%1.1f%%'
-            )
-            ax.set_title('Payroll Distribution')
-
-            # Clearing previous canvas if it exists
-            for widget in self.output_frame.pack_slaves():
-                if isinstance(widget, FigureCanvasTkAgg):
-                    widget.get_tk_widget().destroy()
-
-            # Displaying new pie chart
-            canvas = FigureCanvasTkAgg(fig, master=self.output_frame)
-            canvas.draw()
-            canvas.get_tk_widget().pack(side='right', fill='both', expand=True, padx=10, pady=10)
-        else:
+        # Prompting the user to choose a location to save the PDF
+        pdf_filename = filedialog.asksaveasfilename(
+            parent=self.master, defaultextension='.pdf', filetypes=[('PDF files', '*.pdf')],
+            initialfile=f"Payroll_Report_{result.start.isoformat()}_{result.end.isoformat()}.pdf")
+        if not pdf_filename:
+            return
+
+        # Snapshot what the report needs so the worker never reads the live store
+        write = self.service.prepare_pdf(pdf_filename, result)
+
+        def written(_pages):
+            # I Notify the user here
+            messagebox.showinfo("Success", f"Payroll report generated and saved as {pdf_filename}.")
+
+        def failed(error):
+            messagebox.showerror("Error", f"Failed to generate payroll report: {error}")
+
+        if self.jobs is None:
+            written(write())
+            return
+        self.generate_pdf_button.config(state='disabled', text='Generating Payroll PDF...')
+        self.pdf_job = self.jobs.submit(
+            lambda job: write(progress=job.report),
+            name='Generating payroll PDF', on_done=written, on_error=failed, on_finish=self.pdf_finished)
+
+    def export_payroll(self):
+        date_range = self.read_date_range()
+        if date_range is None:
+            return
+        self.run_payroll(date_range, self.group_by_entry.get().lower(), self.write_export)
+
+    def write_export(self, result):
+        if not result.totals:
             messagebox.showinfo("Info", "No tasks found for the specified date range.")
+            return
+        path = filedialog.asksaveasfilename(
+            parent=self.master, defaultextension='.csv', filetypes=TRANSFER_FILETYPES,
+            initialfile=f"Payroll_{result.start.isoformat()}_{result.end.isoformat()}.csv")
+        if not path:
+            return
+        # One row per employee (and group), so this is quick enough for the Tk thread
+        try:
+            export_payroll(self.service, result, path)
+        except (OSError, ValueError) as e:
+            messagebox.showerror("Error", f"Failed to export payroll: {e}")
+            return
+        messagebox.showinfo("Success", f"Payroll exported to {path}.")
 
-    def display_payroll_summary(self, payroll_data):
-        """
-        here prudence is displaying the payroll summary in the Treeview.
+    def pdf_finished(self):
+        self.pdf_job = None
+        self.generate_pdf_button.config(state='normal', text='Generate Payroll PDF')
 
-        Args:
-            payroll_data (dict): Dictionary where keys are employee IDs and values are total pay for each employee.
-        """
-        # Clearing existing entries in the Treeview
-        for i in self.tree.get_children():
-            self.tree.delete(i)
 
-        # Adding updated payroll summary to the Treeview
-        for employee_id, total_pay in payroll_data.items():
-            try:
-                # I Safely access employee name, handle missing employee case
-                employee_name = self.data['employees'][employee_id]['name']
-                self.tree.insert('', 'end', values=(employee_name, f"${total_pay:.2f}"))
-            except KeyError:
-                # Handling case where the employee ID doesn't exist in the data
-                print(f"Warning: Employee ID {employee_id} not found in data.")
+class DiagnosticsPanel:
+    """
+    The hidden Diagnostics tab: latency per operation, the latest timings and a one-shot profiler.
 
-    def display_payroll_chart(self, payroll_data):
-        fig, ax = plt.subplots(figsize=(10, 5))
-        ax.pie(list(payroll_data.values()), labels=[self.data['employees'][emp_id]['name'] for emp_id in payroll_data.keys()], autopct='%1.1f%%')
-        ax.set_title('Prudence Global Cleaning Ltd Payroll Distribution')
-        chart_canvas = FigureCanvasTkAgg(fig, master=self.output_frame)
-        chart_canvas.draw()
-        chart_canvas.get_tk_widget().pack()
+    It redraws about once a second while it is on screen, and only when new timings
+    have been recorded.
+    """
 
-    def generate_payroll_pdf(self):
-        # Prompting the user to choose a location to save the PDF
-        pdf_filename = 'Payroll_Report.pdf'
-        pdf = pdf_canvas.Canvas(pdf_filename, pagesize=letter)
-        width, height = letter
+    REFRESH_MS = 1000
 
-        # Add title to the PDF
-        pdf.setFont("Helvetica-Bold", 18)
-        pdf.drawString(100, height - 50, "Prudence Global Cleaning Limited Payroll Report")
+    def __init__(self, master, metrics):
+        self.master = master
+        self.metrics = metrics
+        self.shown_version = None
 
-        # Set the font for the rest of the PDF
-        pdf.setFont("Helvetica", 12)
-        y = height - 100
+        # Set up UI components
+        self.profile_entry = None
+        self.armed_label = None
+        self.summary_tree = None
+        self.recent_tree = None
+        self.profile_text = None
 
-        start_date = self.start_date_entry.get()
-        end_date = self.end_date_entry.get()
+        self.setup_ui()
+        self.refresh()
+
+    def setup_ui(self):
+        controls = ttk.Frame(self.master)
+        controls.pack(fill='x', padx=10, pady=10)
+        ttk.Label(controls, text='Profile next:').pack(side='left')
+        self.profile_entry = ttk.Combobox(controls, values=OPERATIONS, state='readonly', width=12)
+        self.profile_entry.current(0)
+        self.profile_entry.pack(side='left', padx=5)
+        ttk.Button(controls, text='Arm', command=self.arm_profile).pack(side='left')
+        ttk.Button(controls, text='Dump to Log', command=self.dump_metrics).pack(side='left', padx=5)
+        ttk.Button(controls, text='Reset', command=self.reset_metrics).pack(side='left')
+        self.armed_label = ttk.Label(controls, text='')
+        self.armed_label.pack(side='left', padx=10)
+
+        summary_frame = ttk.LabelFrame(self.master, text='Operations')
+        summary_frame.pack(fill='x', padx=10, pady=5)
+        columns = ['Operation', 'Count', 'Mean ms', 'P95 ms', 'Max ms']
+        self.summary_tree = ttk.Treeview(summary_frame, columns=columns, show='headings', height=len(OPERATIONS))
+        for column in columns:
+            self.summary_tree.heading(column, text=column)
+            self.summary_tree.column(column, anchor='center', width=100)
+        self.summary_tree.pack(fill='x')
+
+        recent_frame = ttk.LabelFrame(self.master, text=f"Last {self.metrics.recent.maxlen} Operations")
+        recent_frame.pack(fill='both', expand=True, padx=10, pady=5)
+        columns = ['Time', 'Operation', 'ms', 'Thread']
+        self.recent_tree = ttk.Treeview(recent_frame, columns=columns, show='headings', height=8)
+        for column in columns:
+            self.recent_tree.heading(column, text=column)
+            self.recent_tree.column(column, anchor='center', width=100)
+        scrollbar = ttk.Scrollbar(recent_frame, orient='vertical', command=self.recent_tree.yview)
+        self.recent_tree.config(yscrollcommand=scrollbar.set)
+        self.recent_tree.pack(side='left', fill='both', expand=True)
+        scrollbar.pack(side='right', fill='y')
+
+        profile_frame = ttk.LabelFrame(self.master, text='Profile')
+        profile_frame.pack(fill='both', expand=True, padx=10, pady=5)
+        self.profile_text = tk.Text(profile_frame, height=12, wrap='none', font='TkFixedFont')
+        self.profile_text.pack(fill='both', expand=True)
+
+    def refresh(self):
+        if self.master.winfo_ismapped() and self.metrics.version != self.shown_version:
+            self.shown_version = self.metrics.version
+            self.show_metrics()
+        self.refresh_label()
+        self.master.after(self.REFRESH_MS, self.refresh)
+
+    def show_metrics(self):
+        self.summary_tree.delete(*self.summary_tree.get_children())
+        for name, stats in self.metrics.summary().items():
+            self.summary_tree.insert('', 'end', values=(name, stats['count'], f"{stats['mean_ms']:.1f}",
+                                                        f"{stats['p95_ms']:.1f}", f"{stats['max_ms']:.1f}"))
+
+        self.recent_tree.delete(*self.recent_tree.get_children())
+        for timing in reversed(list(self.metrics.recent)):  # newest first
+            self.recent_tree.insert('', 'end', values=(time.strftime('%H:%M:%S', time.localtime(timing.finished)),
+                                                       timing.name, f"{timing.seconds * 1000:.1f}", timing.thread))
+
+        profile = self.metrics.profiles.get(self.metrics.last_profile, '')
+        self.profile_text.delete('1.0', 'end')
+        self.profile_text.insert('1.0', profile or 'Pick an operation and press Arm, then run it once.')
 
-        pdf.drawString(100, y, f"Prudence Global Cleaning Limited Payroll Report from {start_date} to {end_date}")
-        y -= 30
+    def arm_profile(self):
+        self.metrics.profile_next(self.profile_entry.get())
+        self.refresh_label()
 
-        payroll_data = {}
-        for task_id, task in self.data['tasks'].items():
-            employee_id = task['employee_id']
-            if employee_id not in payroll_data:
-                payroll_data[employee_id] = 0
-            payroll_data[employee_id] += int(task['hours_worked']) * float(self.data['employees'][employee_id]['hourly_rate'])
+    def refresh_label(self):
+        armed = self.metrics.armed
+        self.armed_label.config(text=f"Waiting for the next {armed}..." if armed else '')
 
-        # Writing employee payroll information to the PDF
-        for employee_id, total_pay in payroll_data.items():
-            employee_name = self.data['employees'][employee_id]['name']
-            pdf.drawString(100, y, f"Employee: {employee_name}, Total Pay: ${total_pay:.2f}")
-            y -= 20
+    def dump_metrics(self):
+        path = self.metrics.dump(METRICS_LOG or 'ems_metrics.log')
+        if path:
+            messagebox.showinfo("Diagnostics", f"Metrics appended to {path}.")
 
-            # Checking if I need to start a new page
-            if y < 50:
-                pdf.showPage()
-                y = height - 50
+    def reset_metrics(self):
+        self.metrics.reset()
 
-        # Saving my PDF file
-        pdf.save()
 
-        # I Notify the user here
-        messagebox.showinfo("Success", f"Payroll report generated and saved as {pdf_filename}.")
+def report_startup_time(root):
+    # Once the first frame has been drawn; enable with EMS_STARTUP_TIME=1
+    root.update_idletasks()
+    print(f"Startup took {(time.perf_counter() - STARTUP_BEGAN) * 1000:.0f} ms")
 
 
 # Main application setup
 if __name__ == '__main__':
     root = tk.Tk()
     app = ManagementApp(root)
+    if os.environ.get('EMS_STARTUP_TIME'):
+        root.after_idle(report_startup_time, root)
     root.mainloop()
@@ -0,0 +1,355 @@
+import argparse
+import importlib.util
+import json
+import os
+import platform
+import random
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+from datetime import date, timedelta
+from typing import Any, Callable, Dict, List, Optional
+
+from ems_indexes import UniqueIndex
+from ems_services import ClientService, EmployeeService, PayrollService, TaskService, ValidationError, validate_record
+from ems_store import FIELDS, ID_DIGITS, DataStore, IdAllocator, JsonBackend, save_data
+
+
+# Constants
+GUI_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'EMS-GUI.py')
+FIRST_NAMES = ('Grace', 'John', 'Amina', 'Chinedu', 'Mary', 'Peter', 'Fatima', 'David', 'Ngozi', 'James',
+               'Aisha', 'Samuel', 'Esther', 'Daniel', 'Joy', 'Michael', 'Blessing', 'Paul', 'Ruth', 'Joseph')
+LAST_NAMES = ('Okafor', 'Smith', 'Bello', 'Johnson', 'Adeyemi', 'Brown', 'Eze', 'Williams', 'Musa', 'Jones',
+              'Okeke', 'Taylor', 'Ibrahim', 'Davies', 'Nwosu', 'Evans', 'Olawale', 'Wilson', 'Yusuf', 'Thomas')
+POSITIONS = ('Cleaner', 'Senior Cleaner', 'Supervisor', 'Driver', 'Window Specialist', 'Carpet Technician')
+CLIENT_KINDS = ('Offices', 'Hotel', 'Clinic', 'School', 'Apartments', 'Warehouse', 'Restaurant', 'Bank')
+LOCATIONS = ('Lagos', 'Abuja', 'London', 'Manchester', 'Leeds', 'Ibadan', 'Birmingham', 'Port Harcourt')
+TASK_NAMES = ('Office cleaning', 'Deep clean', 'Window cleaning', 'Carpet shampoo', 'End of tenancy',
+              'Kitchen sanitising', 'Floor polishing', 'Washroom service')
+
+
+class Skipped(Exception):
+    """A benchmark that cannot run here, e.g. the Tk ones without a display."""
+
+
+# Synthetic data
+def generate_data(employees: int, clients: int, tasks: int, start: date = date(2024, 1, 1), days: int = 365,
+                  seed: int = 0) -> Dict[str, Any]:
+    """
+    A management_data document of the given size.
+
+    Names and phone numbers are unique (as the forms require), rates and hours vary, and
+    tasks are spread evenly over days days from start, each booked to a random employee
+    and client. The same seed gives the same document.
+    """
+    rng = random.Random(seed)
+    data = {'employees': {}, 'clients': {}, 'tasks': {}}
+    for i in range(employees):
+        data['employees'][f"E{i + 1:0{ID_DIGITS}d}"] = {
+            'name': f"{rng.choice(FIRST_NAMES)} {rng.choice(LAST_NAMES)} {i + 1}",
+            'phone_number': f"{7000000000 + i}",
+            'position': rng.choice(POSITIONS),
+            'hourly_rate': f"{rng.uniform(10, 45):.2f}",
+        }
+    for i in range(clients):
+        data['clients'][f"C{i + 1:0{ID_DIGITS}d}"] = {
+            'name': f"{rng.choice(LAST_NAMES)} {rng.choice(CLIENT_KINDS)} {i + 1}",
+            'phone_number': f"{8000000000 + i}",
+            'location': rng.choice(LOCATIONS),
+        }
+    employee_ids = list(data['employees'])
+    client_ids = list(data['clients'])
+    for i in range(tasks):
+        data['tasks'][f"T{i + 1:0{ID_DIGITS}d}"] = {
+            'task_name': rng.choice(TASK_NAMES),
+            'employee_id': rng.choice(employee_ids),
+            'client_id': rng.choice(client_ids),
+            'hours_worked': str(rng.randint(1, 20) / 2),
+            'date': (start + timedelta(days=rng.randrange(days))).isoformat(),
+        }
+    return data
+
+
+# Timing
+def measure(fn: Callable[[Any], Any], repeat: int, setup: Optional[Callable[[], Any]] = None,
+            teardown: Optional[Callable[[Any], None]] = None) -> Dict[str, Any]:
+    """Time fn(setup()) repeat times; setup and teardown are not timed."""
+    runs = []
+    for _ in range(repeat):
+        state = setup() if setup is not None else None
+        began = time.perf_counter()
+        fn(state)
+        runs.append(time.perf_counter() - began)
+        if teardown is not None:
+            teardown(state)
+    return {'best': min(runs), 'median': statistics.median(runs), 'runs': runs}
+
+
+def load_gui():
+    """EMS-GUI.py as a module; its file name is not importable."""
+    spec = importlib.util.spec_from_file_location('ems_gui', GUI_FILE)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+class Bench:
+    """
+    The benchmarks, run against a copy of one data file.
+
+    Each bench_* method returns measure() results (plus any counts worth keeping), or
+    raises Skipped. The store is loaded once and shared; benchmarks that would change it
+    work on their own objects.
+    """
+
+    def __init__(self, path: str, workdir: str, repeat: int, pdf_days: int):
+        self.path = path
+        self.workdir = workdir
+        self.repeat = repeat
+        self.pdf_days = pdf_days
+        self.store = DataStore(path, backend=JsonBackend(path))
+        days = [task.date for task in self.store.records('tasks').values() if isinstance(task.date, date)]
+        self.first_day = min(days, default=date.today())
+        self.last_day = max(days, default=date.today())
+        self._gui = None
+        self._listeners = len(self.store._listeners)  # subscriptions to keep, see _drop_listeners
+
+    def bench_load_data(self):
+        # What startup pays: reading the file and parsing every record into its typed form
+        return measure(lambda _: DataStore(self.path, backend=JsonBackend(self.path)).close(), self.repeat)
+
+    def bench_save_data(self):
+        out = os.path.join(self.workdir, 'save_data.json')
+        return measure(lambda _: save_data(self.store.data, out), self.repeat)
+
+    def bench_new_id(self):
+        # A fresh allocator scans the category once, then hands out 1000 IDs one at a time
+        tasks = self.store.records('tasks')
+
+        def allocate(allocator):
+            for _ in range(1000):
+                allocator.allocate('T', tasks)
+        return dict(measure(allocate, self.repeat, setup=IdAllocator), ids=1000)
+
+    def bench_unique_index_build(self):
+        return measure(lambda _: UniqueIndex(self.store, 'employees'), self.repeat,
+                       teardown=lambda _: self._drop_listeners())
+
+    def bench_duplicate_validation(self):
+        # 1000 candidates, half of them reusing an existing employee's name
+        employees = list(self.store.records('employees').values())
+        rng = random.Random(1)
+        candidates = []
+        for i in range(1000):
+            name = rng.choice(employees)['name'] if employees and i % 2 else f"New Starter {i}"
+            candidates.append({'name': name, 'phone_number': f"{9000000000 + i}", 'position': 'Cleaner',
+                               'hourly_rate': '15.00'})
+        self.store.unique_index('employees')  # built once, as in the app
+
+        def validate(_):
+            for candidate in candidates:
+                try:
+                    validate_record(self.store, 'employees', candidate)
+                except ValidationError:
+                    pass
+        return dict(measure(validate, self.repeat), records=len(candidates))
+
+    def bench_refresh_list(self):
+        results = {}
+        for category, manager in self._gui_managers().items():
+            def refresh(_, manager=manager):
+                manager.refresh_list()
+                manager.tree.update_idletasks()
+            results[category] = measure(refresh, self.repeat)
+        return results
+
+    def bench_treeview_sort_column(self):
+        # Cold runs sort from scratch in each direction; cached runs reuse the order kept since the first sort
+        results = {}
+        for category, manager in self._gui_managers().items():
+            column = FIELDS[category][0]
+
+            def forget(manager=manager):
+                manager.sort_orders.clear()
+                manager.sort_keys.clear()
+
+            def sort(reverse, manager=manager, column=column):
+                manager.treeview_sort_column(manager.tree, column, reverse)
+                manager.tree.update_idletasks()
+            results[category] = {
+                'ascending': measure(lambda _: sort(False), self.repeat, setup=forget),
+                'descending': measure(lambda _: sort(True), self.repeat, setup=forget),
+                'cached': measure(lambda _: sort(False), self.repeat),
+            }
+        return results
+
+    def bench_calculate_payroll(self):
+        # Cold: a new engine builds its columns first; warm: the columns are already there
+        results = {'cold': measure(lambda service: service.engine.compute(self.first_day, self.last_day),
+                                   self.repeat, setup=lambda: PayrollService(self.store),
+                                   teardown=lambda _: self._drop_listeners())}
+        service = PayrollService(self.store)
+        for grouping in ('employee', 'month'):
+            service.engine.compute(self.first_day, self.last_day, grouping)
+            results[grouping] = measure(lambda _: service.engine.compute(self.first_day, self.last_day, grouping),
+                                        self.repeat)
+        return results
+
+    def bench_generate_payroll_pdf(self):
+        service = PayrollService(self.store)
+        end = min(self.last_day, self.first_day + timedelta(days=self.pdf_days - 1))
+        result = service.calculate(self.first_day, end)
+        out = os.path.join(self.workdir, 'payroll.pdf')
+        pages = []
+        timing = measure(lambda _: pages.append(service.prepare_pdf(out, result)()), self.repeat)
+        return dict(timing, days=(end - self.first_day).days + 1, pages=pages[-1])
+
+    def _gui_managers(self):
+        if self._gui is None:
+            try:
+                import tkinter as tk
+                from tkinter import ttk
+                root = tk.Tk()
+            except Exception as e:  # ImportError without Tk, TclError without a display
+                raise Skipped(f"Tk is not available: {e}") from None
+            root.withdraw()
+            gui = load_gui()
+            # The managers the app builds, so tasks show (and sort by) employee and client names
+            self._gui = {
+                'employees': gui.RecordManager(ttk.Frame(root), EmployeeService(self.store),
+                                               fields=list(FIELDS['employees'])),
+                'clients': gui.RecordManager(ttk.Frame(root), ClientService(self.store), fields=list(FIELDS['clients'])),
+                'tasks': gui.TaskManager(ttk.Frame(root), TaskService(self.store),
+                                         fields=[field for field in FIELDS['tasks'] if field != 'date']),
+            }
+        return self._gui
+
+    def _drop_listeners(self) -> None:
+        # Indexes and engines built by a benchmark stay subscribed; keep only the first ones
+        del self.store._listeners[self._listeners:]
+
+    def run(self, names: List[str]) -> Dict[str, Any]:
+        results = {}
+        for name in names:
+            print(f"{name}...", file=sys.stderr)
+            try:
+                results[name] = getattr(self, 'bench_' + name)()
+            except Skipped as e:
+                results[name] = {'skipped': str(e)}
+            self._listeners = len(self.store._listeners)
+        return results
+
+
+BENCHMARKS = [name[len('bench_'):] for name in vars(Bench) if name.startswith('bench_')]
+
+
+# Commands
+def run_generate(args) -> int:
+    data = generate_data(args.employees, args.clients, args.tasks, seed=args.seed)
+    save_data(data, args.output)
+    print(f"Wrote {args.employees} employees, {args.clients} clients and {args.tasks} tasks to {args.output}")
+    return 0
+
+
+def run_bench(args) -> int:
+    names = args.only.split(',') if args.only else BENCHMARKS
+    unknown = [name for name in names if name not in BENCHMARKS]
+    if unknown:
+        sys.exit(f"error: unknown benchmark {', '.join(unknown)}; choose from {', '.join(BENCHMARKS)}")
+
+    workdir = tempfile.mkdtemp(prefix='ems_bench_')
+    try:
+        path = os.path.join(workdir, 'management_data.json')
+        if args.data:
+            shutil.copyfile(args.data, path)
+        else:
+            save_data(generate_data(args.employees, args.clients, args.tasks, seed=args.seed), path)
+        bench = Bench(path, workdir, args.repeat, args.pdf_days)
+        sizes = {category: len(bench.store.records(category)) for category in ('employees', 'clients', 'tasks')}
+        report = {
+            'created': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'sizes': sizes,
+            'repeat': args.repeat,
+            'results': bench.run(names),
+        }
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    text = json.dumps(report, indent=4)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(text + '\n')
+    else:
+        print(text)
+    return 0
+
+
+def _medians(results: Dict[str, Any], prefix: str = '') -> Dict[str, float]:
+    # Flatten {'calculate_payroll': {'cold': {'median': ...}}} to {'calculate_payroll.cold': ...}
+    medians = {}
+    for name, result in results.items():
+        if 'median' in result:
+            medians[prefix + name] = result['median']
+        elif 'skipped' not in result:
+            medians.update(_medians(result, prefix + name + '.'))
+    return medians
+
+
+def run_compare(args) -> int:
+    with open(args.baseline) as f:
+        baseline = _medians(json.load(f)['results'])
+    with open(args.current) as f:
+        current = _medians(json.load(f)['results'])
+    print(f"{'benchmark':40} {'baseline':>10} {'current':>10} {'ratio':>7}")
+    slower = 0
+    for name in sorted(set(baseline) & set(current)):
+        ratio = current[name] / baseline[name] if baseline[name] else float('inf')
+        flag = ' slower' if ratio > 1 + args.tolerance else ''
+        slower += bool(flag)
+        print(f"{name:40} {baseline[name] * 1000:8.1f}ms {current[name] * 1000:8.1f}ms {ratio:6.2f}x{flag}")
+    return 1 if slower else 0
+
+
+def build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(prog='ems_bench.py', description='Benchmark the hot paths on synthetic data.')
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    def add_sizes(command):
+        command.add_argument('--employees', type=int, default=1000)
+        command.add_argument('--clients', type=int, default=200)
+        command.add_argument('--tasks', type=int, default=100000)
+        command.add_argument('--seed', type=int, default=0)
+
+    generate = commands.add_parser('generate', help='write a synthetic management_data.json')
+    add_sizes(generate)
+    generate.add_argument('--output', '-o', default='management_data.json')
+    generate.set_defaults(run=run_generate)
+
+    bench = commands.add_parser('run', help='time the benchmarks and print the results as JSON')
+    add_sizes(bench)
+    bench.add_argument('--data', help='benchmark a copy of this file instead of generated data')
+    bench.add_argument('--only', help='comma-separated subset of: ' + ', '.join(BENCHMARKS))
+    bench.add_argument('--repeat', type=int, default=5)
+    bench.add_argument('--pdf-days', type=int, default=31, help='days of tasks in the PDF report (default 31)')
+    bench.add_argument('--output', '-o', help='write the JSON here instead of stdout')
+    bench.set_defaults(run=run_bench)
+
+    compare = commands.add_parser('compare', help='compare two result files, exit 1 if anything got slower')
+    compare.add_argument('baseline')
+    compare.add_argument('current')
+    compare.add_argument('--tolerance', type=float, default=0.1, help='allowed slowdown (default 0.1 = 10%%)')
+    compare.set_defaults(run=run_compare)
+    return parser
+
+
+def main(argv=None) -> int:
+    args = build_parser().parse_args(argv)
+    return args.run(args)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,227 @@
+import argparse
+import json
+import os
+import sys
+from datetime import date
+from typing import Tuple
+
+from ems_metrics import OPERATIONS, metrics
+from ems_payroll import GROUPINGS, PAY_PERIODS, PayrollResult
+from ems_services import ClientService, EmployeeService, PayrollService, TaskService
+from ems_store import CATEGORIES, DATA_FILE, FIELDS, RECENT_MONTHS, DataStore
+from ems_transfer import FORMATS as TRANSFER_FORMATS, export_payroll, export_records, import_file, payroll_columns, \
+    payroll_rows, record_columns, record_rows, write_csv
+
+
+# Constants
+FORMATS = ('csv', 'json', 'pdf', 'xlsx')
+SERVICES = {'employees': EmployeeService, 'clients': ClientService, 'tasks': TaskService}
+
+
+# Helper functions
+def parse_day(text: str) -> date:
+    try:
+        return date.fromisoformat(text)
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"{text!r} is not a YYYY-MM-DD date") from None
+
+
+def write_payroll(service: PayrollService, result: PayrollResult, output: str, output_format: str) -> None:
+    if output_format == 'pdf':
+        service.prepare_pdf(output, result)()
+        return
+    if output_format == 'xlsx':
+        export_payroll(service, result, output, 'xlsx')
+        return
+
+    out = sys.stdout if output == '-' else open(output, 'w', newline='', encoding='utf-8')
+    try:
+        if output_format == 'json':
+            json.dump({'start': result.start.isoformat(), 'end': result.end.isoformat(),
+                       'grouping': result.grouping, 'total': round(sum(result.totals.values()), 2),
+                       'rows': list(service.rows(result))}, out, indent=4)
+            out.write('\n')
+        else:
+            write_csv(out, payroll_columns(result.grouping), payroll_rows(service, result))
+    finally:
+        if out is not sys.stdout:
+            out.close()
+
+
+def import_records(store: DataStore, category: str, path: str) -> Tuple[int, int]:
+    """
+    Add (or, by their id column, replace) every valid row of a CSV or Excel file as one batch.
+
+    Rows are read one at a time and handed straight to the category's service, so only
+    the records being stored are held in memory; they are checked like the forms check
+    them and saved once. Rejected rows are reported on stderr with their line number.
+    Returns (imported, rejected).
+    """
+    result = import_file(SERVICES[category](store), path)
+    for line, message in result.errors:
+        print(f"{path}:{line}: {message}", file=sys.stderr)
+    return len(result.ids), len(result.errors)
+
+
+# Commands
+def run_payroll(args) -> int:
+    if args.start > args.end:
+        sys.exit("error: --from must not be after --to")
+    output_format = args.format
+    if output_format is None:
+        extension = os.path.splitext(args.output)[1].lstrip('.').lower()
+        output_format = extension if extension in FORMATS else 'csv'
+    if output_format == 'pdf' and args.output == '-':
+        sys.exit("error: a PDF report needs --output FILE")
+
+    store = DataStore(args.data)
+    try:
+        # The PDF lists employees only, whatever --group-by says
+        grouping = 'employee' if output_format == 'pdf' else args.group_by
+        service = PayrollService(store)
+        result = service.calculate(args.start, args.end, grouping)
+        write_payroll(service, result, args.output, output_format)
+    finally:
+        store.close()
+    if args.output != '-':
+        print(f"Payroll for {len(result.totals)} employees written to {args.output}")
+    return 0
+
+
+def run_import(args) -> int:
+    store = DataStore(args.data)
+    try:
+        imported, rejected = import_records(store, args.category, args.file)
+    except (OSError, ValueError) as e:
+        sys.exit(f"error: {e}")
+    finally:
+        store.close()
+    print(f"Imported {imported} {args.category}, rejected {rejected}")
+    return 1 if rejected else 0
+
+
+def run_export(args) -> int:
+    if args.output == '-' and args.format == 'xlsx':
+        sys.exit("error: an Excel file needs --output FILE")
+    if args.archived and args.category != 'tasks':
+        sys.exit("error: only tasks are archived")
+    store = DataStore(args.data)
+    try:
+        if args.output == '-':
+            count = write_csv(sys.stdout, record_columns(args.category),
+                              record_rows(store.records(args.category), args.category,
+                                          archive=store.archive if args.archived else None))
+        else:
+            count = export_records(store, args.category, args.output, args.format, args.archived)
+    except (OSError, ValueError) as e:
+        sys.exit(f"error: {e}")
+    finally:
+        store.close()
+    if args.output != '-':
+        print(f"Exported {count} {args.category} to {args.output}")
+    return 0
+
+
+def run_periods(args) -> int:
+    store = DataStore(args.data)
+    try:
+        service = PayrollService(store)
+        for start, end, closed in service.pay_periods(args.period):
+            result = service.calculate(start, end)  # closed periods come from their snapshots
+            print(f"{start.isoformat()}  {end.isoformat()}  {'closed' if closed else 'open':6}  "
+                  f"{len(result.totals):6d} employees  {sum(result.totals.values()):14.2f}")
+    finally:
+        store.close()
+    return 0
+
+
+def run_close_period(args) -> int:
+    store = DataStore(args.data)
+    try:
+        document = PayrollService(store).close_period(args.period, args.date)
+    except (OSError, ValueError) as e:
+        sys.exit(f"error: {e}")
+    finally:
+        store.close()
+    total = sum(entry['pay'] for entry in document['employees'].values())
+    print(f"Closed the {args.period} period {document['start']} to {document['end']}: "
+          f"{len(document['employees'])} employees, {total:.2f} in total")
+    return 0
+
+
+def run_archive(args) -> int:
+    store = DataStore(args.data)
+    try:
+        archived = store.archive_old_tasks(args.recent_months)
+        if archived:
+            store.save()
+        months = len(store.archive.months())
+    except (OSError, ValueError) as e:
+        sys.exit(f"error: {e}")
+    finally:
+        store.close()
+    print(f"Archived {archived} tasks; {months} months are archived in total")
+    return 0
+
+
+def build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(prog='ems_cli.py',
+                                     description='Run payroll, exports and bulk imports without opening the window.')
+    parser.add_argument('--data', default=DATA_FILE,
+                        help=f"data file (default {DATA_FILE}; EMS_STORAGE picks the storage mode as in the app)")
+    parser.add_argument('--profile', choices=OPERATIONS, metavar='OPERATION',
+                        help='print a cProfile of the first run of this operation to stderr: ' + ', '.join(OPERATIONS))
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    payroll = commands.add_parser('payroll', help='calculate payroll for a date range')
+    payroll.add_argument('--from', dest='start', type=parse_day, required=True, metavar='YYYY-MM-DD')
+    payroll.add_argument('--to', dest='end', type=parse_day, required=True, metavar='YYYY-MM-DD')
+    payroll.add_argument('--group-by', choices=GROUPINGS, default='employee')
+    payroll.add_argument('--format', choices=FORMATS, help='default: from the --output extension, else csv')
+    payroll.add_argument('--output', '-o', default='-', help='output file (default: stdout)')
+    payroll.set_defaults(run=run_payroll)
+
+    import_ = commands.add_parser('import', help='add or update records from a CSV or Excel file')
+    import_.add_argument('file', help='CSV or .xlsx file with a column per field (e.g. ' + ', '.join(FIELDS['tasks'])
+                         + ' for tasks) and optionally id')
+    import_.add_argument('--category', choices=CATEGORIES, default='tasks')
+    import_.set_defaults(run=run_import)
+
+    export = commands.add_parser('export', help='write every record of a category to a CSV or Excel file')
+    export.add_argument('category', choices=CATEGORIES)
+    export.add_argument('--format', choices=TRANSFER_FORMATS, help='default: from the --output extension, else csv')
+    export.add_argument('--output', '-o', default='-', help='output file (default: CSV on stdout)')
+    export.add_argument('--archived', action='store_true', help='tasks only: include the archived months too')
+    export.set_defaults(run=run_export)
+
+    periods = commands.add_parser('periods', help='list pay periods with their pay and whether they are closed')
+    periods.add_argument('--period', choices=PAY_PERIODS, default='monthly')
+    periods.set_defaults(run=run_periods)
+
+    close_period = commands.add_parser('close-period',
+                                       help='close a pay period that has ended into a snapshot its reports read')
+    close_period.add_argument('--period', choices=PAY_PERIODS, default='monthly')
+    close_period.add_argument('--date', type=parse_day, required=True, metavar='YYYY-MM-DD',
+                              help='any day of the period')
+    close_period.set_defaults(run=run_close_period)
+
+    archive = commands.add_parser('archive', help='move the tasks of old, closed months into monthly archive files')
+    archive.add_argument('--recent-months', type=int, default=RECENT_MONTHS, metavar='N',
+                         help=f"months before this one to keep loaded (default {RECENT_MONTHS}; EMS_RECENT_MONTHS)")
+    archive.set_defaults(run=run_archive)
+    return parser
+
+
+def main(argv=None) -> int:
+    args = build_parser().parse_args(argv)
+    metrics.profile_next(args.profile)
+    try:
+        return args.run(args)
+    finally:
+        if args.profile:
+            print(metrics.profiles.get(args.profile, f"No {args.profile} ran, nothing was profiled."), file=sys.stderr)
+        metrics.dump()  # only when EMS_METRICS_LOG names a file
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,329 @@
+import re
+from bisect import bisect_left, bisect_right, insort
+from datetime import date
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+
+from ems_records import amount, day_ordinal
+
+
+TOKEN_PATTERN = re.compile(r'[^\W_]+')  # runs of letters and digits
+
+
+def parse_date(text: str) -> Optional[int]:
+    """'YYYY-MM-DD' -> day ordinal, or None if the text is not a valid date."""
+    try:
+        return date.fromisoformat(text).toordinal()
+    except (TypeError, ValueError):
+        return None
+
+
+class TaskDateIndex:
+    """
+    Tasks kept sorted by date, plus per-day, per-employee hour totals.
+
+    Dates and hours come already parsed from the typed task records. A range query bisects to
+    the matching slice, and employee_hours() walks only the days in the range, so a
+    payroll run no longer touches every task ever recorded. The index follows the store
+    through its change notifications.
+    """
+
+    def __init__(self, store):
+        self._keys: List[Tuple[int, str]] = []  # (day ordinal, task_id), sorted
+        self._entries: Dict[str, Tuple[int, str, float]] = {}  # task_id -> (day, employee_id, hours)
+        self._days: List[int] = []  # sorted days that have hours booked
+        self._day_hours: Dict[int, Dict[str, list]] = {}  # day -> employee_id -> [hours, task count]
+
+        # Bulk load: append everything, then sort once
+        self._building = True
+        for task_id, task in store.records('tasks').items():
+            entry = self._parse(task)
+            if entry is not None:
+                self._entries[task_id] = entry
+                self._keys.append((entry[0], task_id))
+                self._book(entry, 1)
+        self._keys.sort()
+        self._days = sorted(self._day_hours)
+        self._building = False
+
+        store.subscribe(self.on_change, ['tasks'])
+
+    @staticmethod
+    def _parse(task) -> Optional[Tuple[int, str, float]]:
+        day = day_ordinal(task)
+        if day is None:
+            return None  # undated tasks cannot fall in any range
+        return day, task.employee_id, amount(task.hours_worked)
+
+    def _book(self, entry: Tuple[int, str, float], sign: int) -> None:
+        day, employee_id, hours = entry
+        employees = self._day_hours.get(day)
+        if employees is None:
+            employees = self._day_hours[day] = {}
+            if not self._building:
+                insort(self._days, day)
+        totals = employees.setdefault(employee_id, [0.0, 0])
+        totals[0] += sign * hours
+        totals[1] += sign
+        if totals[1] == 0:
+            # Drop emptied buckets instead of keeping float residue around
+            del employees[employee_id]
+            if not employees:
+                del self._day_hours[day]
+                del self._days[bisect_left(self._days, day)]
+
+    def _insert(self, task_id: str, task) -> None:
+        entry = self._parse(task)
+        if entry is None:
+            return
+        self._entries[task_id] = entry
+        insort(self._keys, (entry[0], task_id))
+        self._book(entry, 1)
+
+    def _remove(self, task_id: str) -> None:
+        entry = self._entries.pop(task_id, None)
+        if entry is None:
+            return
+        del self._keys[bisect_left(self._keys, (entry[0], task_id))]
+        self._book(entry, -1)
+
+    def on_change(self, change) -> None:
+        self._remove(change.record_id)
+        if change.new is not None:
+            self._insert(change.record_id, change.new)
+
+    def tasks_between(self, start: date, end: date) -> List[str]:
+        """IDs of the tasks dated start..end inclusive, in date order."""
+        low = bisect_left(self._keys, (start.toordinal(), ''))
+        high = bisect_left(self._keys, (end.toordinal() + 1, ''))
+        return [task_id for _day, task_id in self._keys[low:high]]
+
+    def day_totals(self) -> Iterable[Tuple[int, Dict[str, list]]]:
+        """(day ordinal, employee_id -> [hours, task count]) for every day with tasks; read, do not change."""
+        return self._day_hours.items()
+
+    def employee_hours(self, start: date, end: date) -> Dict[str, float]:
+        """Hours worked per employee ID between start and end inclusive."""
+        hours: Dict[str, float] = {}
+        low = bisect_left(self._days, start.toordinal())
+        high = bisect_right(self._days, end.toordinal())
+        for day in self._days[low:high]:
+            for employee_id, (day_hours, _count) in self._day_hours[day].items():
+                hours[employee_id] = hours.get(employee_id, 0.0) + day_hours
+        return hours
+
+
+class UniqueIndex:
+    """
+    Hash indexes over the fields of one category that must be unique.
+
+    Names are compared case-insensitively. Each normalized value maps to the set of
+    record IDs holding it (files written before validation covered updates can hold
+    duplicates), so a duplicate check is a dictionary lookup instead of a scan.
+    """
+
+    def __init__(self, store, category: str, fields: Tuple[str, ...] = ('name', 'phone_number')):
+        self.category = category
+        self.fields = fields
+        self._ids: Dict[str, Dict[str, set]] = {field: {} for field in fields}
+        for record_id, record in store.records(category).items():
+            self._insert(record_id, record)
+        store.subscribe(self.on_change, [category])
+
+    @staticmethod
+    def normalize(field: str, value) -> str:
+        value = str(value).strip()
+        return value.lower() if field == 'name' else value
+
+    def _insert(self, record_id: str, record) -> None:
+        for field in self.fields:
+            if field in record:
+                self._ids[field].setdefault(self.normalize(field, record[field]), set()).add(record_id)
+
+    def _remove(self, record_id: str, record) -> None:
+        for field in self.fields:
+            if field in record:
+                key = self.normalize(field, record[field])
+                ids = self._ids[field].get(key)
+                if ids is not None:
+                    ids.discard(record_id)
+                    if not ids:
+                        del self._ids[field][key]
+
+    def on_change(self, change) -> None:
+        if change.old is not None:
+            self._remove(change.record_id, change.old)
+        if change.new is not None:
+            self._insert(change.record_id, change.new)
+
+    def lookup(self, field: str, value) -> Set[str]:
+        """IDs of the records whose field matches value (names case-insensitively)."""
+        return set(self._ids[field].get(self.normalize(field, value), ()))
+
+    def copy(self) -> 'UniqueIndex':
+        """A detached copy, not kept up to date, that another thread can read while this one changes."""
+        index = UniqueIndex.__new__(UniqueIndex)
+        index.category, index.fields = self.category, self.fields
+        index._ids = {field: {value: set(ids) for value, ids in values.items()} for field, values in self._ids.items()}
+        return index
+
+    def conflict(self, record, exclude_id: Optional[str] = None) -> Optional[str]:
+        """First unique field whose value another record (other than exclude_id) already has, else None."""
+        for field in self.fields:
+            if field in record:
+                ids = self._ids[field].get(self.normalize(field, record[field]), ())
+                if any(record_id != exclude_id for record_id in ids):
+                    return field
+        return None
+
+
+class NameIndex:
+    """
+    Live ID -> name map of the employees or clients, with the names kept sorted.
+
+    Built once and then updated from the store's change notifications, so screens that
+    show names for IDs (the task list, the task form's comboboxes) neither scan the
+    records nor go stale when someone is added, renamed or removed. matches() serves
+    type-ahead: names starting with the typed text, found by bisecting the sorted names,
+    then names containing it further in.
+    """
+
+    def __init__(self, store, category: str):
+        self.names: Dict[str, str] = {record_id: record.get('name', '')
+                                      for record_id, record in store.records(category).items()}
+        self._sorted: List[Tuple[str, str]] = sorted((name.casefold(), record_id)
+                                                     for record_id, name in self.names.items())
+        store.subscribe(self.on_change, [category])
+
+    def on_change(self, change) -> None:
+        old_name = self.names.pop(change.record_id, None)
+        if old_name is not None:
+            del self._sorted[bisect_left(self._sorted, (old_name.casefold(), change.record_id))]
+        if change.new is not None:
+            name = self.names[change.record_id] = change.new.get('name', '')
+            insort(self._sorted, (name.casefold(), change.record_id))
+
+    def name(self, record_id: str) -> Optional[str]:
+        return self.names.get(record_id)
+
+    def matches(self, text: str, limit: int) -> List[str]:
+        """Up to limit names for the typed text, in name order, prefix matches first; all names for no text."""
+        text = text.strip().casefold()
+        found: List[str] = []
+        for index in range(bisect_left(self._sorted, (text, '')), len(self._sorted)):
+            key, record_id = self._sorted[index]
+            if len(found) >= limit or not key.startswith(text):
+                break
+            found.append(self.names[record_id])
+        if text and len(found) < limit:
+            for key, record_id in self._sorted:
+                if text in key and not key.startswith(text):
+                    found.append(self.names[record_id])
+                    if len(found) >= limit:
+                        break
+        return list(dict.fromkeys(found))  # a name several records share is offered once
+
+
+def tokenize(text) -> List[str]:
+    return TOKEN_PATTERN.findall(str(text).lower())
+
+
+class SearchIndex:
+    """
+    Inverted index from word to record IDs over every field of one category.
+
+    Lookups match word prefixes: the vocabulary is kept sorted, so all words starting
+    with a search term are one bisected slice. references maps a field holding another
+    record's ID to that record's category (a task's employee_id -> employees), so a task
+    is also found by the employee's or client's name, and is re-indexed when they change.
+    """
+
+    def __init__(self, store, category: str, references: Optional[Dict[str, str]] = None):
+        self.store = store
+        self.category = category
+        self.references = references or {}
+        self._postings: Dict[str, Set[str]] = {}
+        self._vocabulary: List[str] = []  # sorted keys of _postings
+        self._record_tokens: Dict[str, frozenset] = {}
+        self._referrers: Dict[str, Set[str]] = {}  # referenced ID -> IDs of records pointing at it
+
+        # Bulk load: fill the postings, then sort the vocabulary once
+        for record_id, record in store.records(category).items():
+            self._insert(record_id, record, bulk=True)
+        self._vocabulary = sorted(self._postings)
+
+        store.subscribe(self.on_change, [category])
+        if self.references:
+            store.subscribe(self.on_reference_change, set(self.references.values()))
+
+    def _tokens(self, record_id: str, record) -> frozenset:
+        tokens = set(tokenize(record_id))
+        for field, value in record.items():
+            tokens.update(tokenize(value))
+            referenced_category = self.references.get(field)
+            if referenced_category is not None:
+                referenced = self.store.get(referenced_category, value)
+                if referenced is not None:
+                    tokens.update(tokenize(referenced.get('name', '')))
+        return frozenset(tokens)
+
+    def _insert(self, record_id: str, record, bulk: bool = False) -> None:
+        tokens = self._tokens(record_id, record)
+        self._record_tokens[record_id] = tokens
+        for token in tokens:
+            ids = self._postings.get(token)
+            if ids is None:
+                ids = self._postings[token] = set()
+                if not bulk:
+                    insort(self._vocabulary, token)
+            ids.add(record_id)
+        for field in self.references:
+            if field in record:
+                self._referrers.setdefault(record[field], set()).add(record_id)
+
+    def _remove(self, record_id: str, record) -> None:
+        for token in self._record_tokens.pop(record_id, ()):
+            ids = self._postings[token]
+            ids.discard(record_id)
+            if not ids:
+                del self._postings[token]
+                del self._vocabulary[bisect_left(self._vocabulary, token)]
+        for field in self.references:
+            referrers = self._referrers.get(record.get(field))
+            if referrers is not None:
+                referrers.discard(record_id)
+
+    def on_change(self, change) -> None:
+        if change.old is not None:
+            self._remove(change.record_id, change.old)
+        if change.new is not None:
+            self._insert(change.record_id, change.new)
+
+    def on_reference_change(self, change) -> None:
+        # A renamed employee or client changes the words their tasks are found by
+        records = self.store.records(self.category)
+        for record_id in list(self._referrers.get(change.record_id, ())):
+            record = records.get(record_id)
+            if record is not None:
+                self._remove(record_id, record)
+                self._insert(record_id, record)
+
+    def _prefix_matches(self, term: str) -> Iterable[str]:
+        low = bisect_left(self._vocabulary, term)
+        high = bisect_left(self._vocabulary, term + '\uffff')
+        return self._vocabulary[low:high]
+
+    def search(self, query: str) -> Optional[Set[str]]:
+        """IDs of the records with a word starting with every term of query; None for an empty query."""
+        terms = tokenize(query)
+        if not terms:
+            return None
+        # Rarest-looking (longest) terms first keeps the intersection small
+        result: Optional[Set[str]] = None
+        for term in sorted(set(terms), key=len, reverse=True):
+            matches: Set[str] = set()
+            for token in self._prefix_matches(term):
+                matches.update(self._postings[token])
+            result = matches if result is None else result & matches
+            if not result:
+                break
+        return result
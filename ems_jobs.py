@@ -0,0 +1,189 @@
+import queue
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Optional
+
+
+class JobCancelled(Exception):
+    """Raised inside a job (from Job.report or Job.check) once it has been cancelled."""
+
+
+class Job:
+    """
+    Handle of one submitted job.
+
+    The job function receives it as its first argument and calls report(fraction) as it
+    goes; that both feeds the progress bar and is where a cancelled job stops.
+    """
+
+    def __init__(self, executor, name: str, cancellable: bool):
+        self.executor = executor
+        self.name = name
+        self.cancellable = cancellable
+        self.progress: Optional[float] = None  # None until the job reports, i.e. indeterminate
+        self.future = None
+        self._cancelled = threading.Event()
+
+    @property
+    def cancelled(self) -> bool:
+        return self._cancelled.is_set()
+
+    def cancel(self) -> None:
+        if self.cancellable:
+            self._cancelled.set()
+            if self.future is not None and self.future.cancel():
+                self.executor.post(self, 'cancelled', None)  # never started
+
+    def check(self) -> None:
+        if self._cancelled.is_set():
+            raise JobCancelled()
+
+    def report(self, fraction: float) -> None:
+        self.check()
+        self.executor.post(self, 'progress', fraction)
+
+
+class JobExecutor:
+    """
+    Runs functions on a small thread pool and hands their results back on the Tk thread.
+
+    Workers never touch widgets: they put events on a queue, and the executor polls it
+    with after() while jobs are running, calling on_done / on_error / on_progress from
+    the main loop. on_update(job) is called whenever a job starts, progresses or ends,
+    for a status bar.
+    """
+
+    def __init__(self, master, max_workers: int = 2, poll_ms: int = 50,
+                 on_update: Optional[Callable[[Job], None]] = None):
+        self.master = master
+        self.poll_ms = poll_ms
+        self.on_update = on_update
+        self.active = []  # jobs submitted and not yet finished, oldest first
+        self._pool = ThreadPoolExecutor(max_workers, thread_name_prefix='ems-job')
+        self._events = queue.Queue()
+        self._callbacks = {}
+        self._polling = False
+
+    def submit(self, fn: Callable[..., Any], *args, name: str = '', cancellable: bool = True,
+               on_done: Optional[Callable[[Any], None]] = None,
+               on_error: Optional[Callable[[BaseException], None]] = None,
+               on_progress: Optional[Callable[[float], None]] = None,
+               on_finish: Optional[Callable[[], None]] = None) -> Job:
+        """
+        Run fn(job, *args) on a worker; the callbacks run on the Tk thread.
+
+        on_finish is called however the job ends (done, failed or cancelled), before
+        on_done or on_error.
+        """
+        job = Job(self, name, cancellable)
+        self._callbacks[job] = (on_done, on_error, on_progress, on_finish)
+        self.active.append(job)
+        job.future = self._pool.submit(self._run, job, fn, args)
+        self._changed(job)
+        if not self._polling:
+            self._polling = True
+            self.master.after(self.poll_ms, self._poll)
+        return job
+
+    def _run(self, job: Job, fn, args) -> None:
+        try:
+            job.check()
+            result = fn(job, *args)
+        except JobCancelled:
+            self.post(job, 'cancelled', None)
+        except Exception as e:
+            self.post(job, 'error', e)
+        else:
+            self.post(job, 'done', result)
+
+    def post(self, job: Job, kind: str, value: Any) -> None:
+        self._events.put((job, kind, value))
+
+    def _poll(self) -> None:
+        while True:
+            try:
+                job, kind, value = self._events.get_nowait()
+            except queue.Empty:
+                break
+            if job not in self._callbacks:
+                continue  # already finished, e.g. cancelled before it started
+            on_done, on_error, on_progress, on_finish = self._callbacks[job]
+            if kind == 'progress':
+                job.progress = value
+                if on_progress is not None:
+                    on_progress(value)
+                self._changed(job)
+                continue
+            del self._callbacks[job]
+            self.active.remove(job)
+            self._changed(job)
+            if on_finish is not None:
+                on_finish()
+            if kind == 'done' and on_done is not None:
+                on_done(value)
+            elif kind == 'error':
+                if on_error is not None:
+                    on_error(value)
+                else:
+                    print(f"{job.name or 'Background job'} failed:", value)
+        if self.active:
+            self.master.after(self.poll_ms, self._poll)
+        else:
+            self._polling = False
+
+    def _changed(self, job: Job) -> None:
+        if self.on_update is not None:
+            self.on_update(job)
+
+    def shutdown(self) -> None:
+        """Wait for running jobs; their callbacks are dropped."""
+        for job in list(self.active):
+            job.cancel()
+        self._pool.shutdown(wait=True)
+
+
+class BackgroundSaver:
+    """
+    Runs the store's saves on the executor, one at a time.
+
+    Saves requested while one is being written are coalesced into a single follow-up
+    save, so a burst of clicks costs at most two writes and never blocks the UI. The
+    store's pending changes (and any snapshot the backend needs) are taken on the Tk
+    thread when the write starts.
+    """
+
+    def __init__(self, store, executor: JobExecutor):
+        self.store = store
+        self.executor = executor
+        self._job: Optional[Job] = None
+        self._again = False
+
+    def request(self) -> None:
+        if self._job is not None:
+            self._again = True
+            return
+        write = self.store.prepare_save()
+        self._job = self.executor.submit(lambda job: write(), name='Saving', cancellable=False,
+                                         on_done=self._finished, on_error=self._failed)
+
+    def _finished(self, result=None) -> None:
+        self._job = None
+        self.store.finish_save(result)  # catch up with other copies of the app writing the same file
+        if self._again:
+            self._again = False
+            self.request()
+
+    def _failed(self, error: BaseException) -> None:
+        print("An error occurred while saving:", error)
+        self._finished()
+
+    def flush(self) -> None:
+        """Block until everything requested so far is on disk (used when the app closes)."""
+        if self._job is not None:
+            try:
+                self.store.finish_save(self._job.future.result())
+            except Exception as e:
+                print("An error occurred while saving:", e)
+            self._job = None
+        self._again = False
+        self.store.save()
@@ -0,0 +1,181 @@
+import io
+import json
+import os
+import threading
+import time
+from bisect import bisect_left
+from collections import deque
+from contextlib import contextmanager
+from functools import wraps
+from typing import Any, Callable, Deque, Dict, Iterator, List, NamedTuple, Optional
+
+
+# Constants
+# Upper bounds of the latency histogram buckets in milliseconds; one more bucket holds the slower ones
+BUCKETS_MS = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000)
+RECENT_SIZE = 200  # timings kept for the Diagnostics tab
+PROFILE_LINES = 25  # functions listed from a captured profile
+# Set EMS_METRICS_LOG to a file to append a summary of the metrics to it when the app or CLI exits
+METRICS_LOG = os.environ.get('EMS_METRICS_LOG')
+# The operations timed across the app, for the Diagnostics tab's profile picker
+OPERATIONS = ('load', 'save', 'refresh', 'search', 'validate', 'add', 'update', 'delete', 'import', 'export', 'payroll',
+              'pdf')
+
+
+class Timing(NamedTuple):
+    name: str
+    finished: float  # time.time() when it ended
+    seconds: float
+    thread: str
+
+
+class Metrics:
+    """
+    Counters and latency histograms per operation, plus the most recent timings.
+
+    Code wraps its hot paths in timed('name') or decorates them with timer('name'); that
+    costs two clock reads and a lock, so it stays on in normal use. Timings can be
+    recorded from any thread. profile_next(name) arms a one-shot cProfile capture of the
+    next run of that operation, whichever thread runs it.
+    """
+
+    def __init__(self, recent: int = RECENT_SIZE):
+        self._lock = threading.Lock()
+        self.counts: Dict[str, int] = {}
+        self.totals: Dict[str, float] = {}  # seconds
+        self.maxima: Dict[str, float] = {}
+        self.histograms: Dict[str, List[int]] = {}
+        self.recent: Deque[Timing] = deque(maxlen=recent)
+        self.version = 0  # bumped on every record, so a display knows when to redraw
+        self.profiles: Dict[str, str] = {}  # operation -> report of its last captured profile
+        self.last_profile: Optional[str] = None  # operation profiled most recently
+        self._profile_next: Optional[str] = None
+
+    def record(self, name: str, seconds: float) -> None:
+        bucket = bisect_left(BUCKETS_MS, seconds * 1000)
+        with self._lock:
+            if name not in self.counts:
+                self.counts[name] = 0
+                self.totals[name] = 0.0
+                self.maxima[name] = 0.0
+                self.histograms[name] = [0] * (len(BUCKETS_MS) + 1)
+            self.counts[name] += 1
+            self.totals[name] += seconds
+            self.maxima[name] = max(self.maxima[name], seconds)
+            self.histograms[name][bucket] += 1
+            self.recent.append(Timing(name, time.time(), seconds, threading.current_thread().name))
+            self.version += 1
+
+    @contextmanager
+    def timed(self, name: str) -> Iterator[None]:
+        profiler = None
+        if self._profile_next == name:
+            with self._lock:
+                if self._profile_next == name:
+                    self._profile_next = None
+                    import cProfile  # profiling is rare; keep it out of startup
+                    profiler = cProfile.Profile()
+            if profiler is not None:
+                try:
+                    profiler.enable()
+                except ValueError:  # another profiler is already running in this process
+                    profiler = None
+        began = time.perf_counter()
+        try:
+            yield
+        finally:
+            seconds = time.perf_counter() - began
+            if profiler is not None:
+                profiler.disable()
+                self._keep_profile(name, profiler, seconds)
+            self.record(name, seconds)
+
+    def timer(self, name: str) -> Callable[[Callable], Callable]:
+        """Decorator form of timed()."""
+        def decorate(fn: Callable) -> Callable:
+            @wraps(fn)
+            def wrapper(*args, **kwargs):
+                with self.timed(name):
+                    return fn(*args, **kwargs)
+            return wrapper
+        return decorate
+
+    def profile_next(self, name: Optional[str]) -> None:
+        """Capture a cProfile of the next run of name (None disarms)."""
+        with self._lock:
+            self._profile_next = name
+
+    @property
+    def armed(self) -> Optional[str]:
+        return self._profile_next
+
+    def _keep_profile(self, name: str, profiler, seconds: float) -> None:
+        import pstats
+
+        out = io.StringIO()
+        out.write(f"{name} took {seconds * 1000:.1f} ms at {time.strftime('%H:%M:%S')}\n")
+        pstats.Stats(profiler, stream=out).sort_stats('cumulative').print_stats(PROFILE_LINES)
+        with self._lock:
+            self.profiles[name] = out.getvalue()
+            self.last_profile = name
+            self.version += 1
+
+    @staticmethod
+    def percentile(histogram: List[int], slowest_ms: float, fraction: float) -> float:
+        """Upper bound in milliseconds of the histogram bucket holding that fraction of the runs."""
+        target = fraction * sum(histogram)
+        seen = 0
+        for bucket, count in enumerate(histogram):
+            seen += count
+            if count and seen >= target:
+                return min(BUCKETS_MS[bucket], slowest_ms) if bucket < len(BUCKETS_MS) else slowest_ms
+        return 0.0
+
+    def summary(self) -> Dict[str, Dict[str, Any]]:
+        """Per operation: count, mean/p95/max in milliseconds and the histogram."""
+        with self._lock:
+            rows = [(name, self.counts[name], self.totals[name], self.maxima[name], list(self.histograms[name]))
+                    for name in sorted(self.counts)]
+        summary = {}
+        for name, count, total, slowest, histogram in rows:
+            buckets = {f"<={bound}ms": n for bound, n in zip(BUCKETS_MS, histogram)}
+            buckets[f">{BUCKETS_MS[-1]}ms"] = histogram[-1]
+            summary[name] = {
+                'count': count,
+                'mean_ms': round(total / count * 1000, 3),
+                'p95_ms': round(self.percentile(histogram, slowest * 1000, 0.95), 3),
+                'max_ms': round(slowest * 1000, 3),
+                'histogram': buckets,
+            }
+        return summary
+
+    def reset(self) -> None:
+        with self._lock:
+            self.counts.clear()
+            self.totals.clear()
+            self.maxima.clear()
+            self.histograms.clear()
+            self.recent.clear()
+            self.profiles.clear()
+            self.last_profile = None
+            self.version += 1
+
+    def dump(self, path: Optional[str] = None) -> Optional[str]:
+        """Append the summary as one JSON line to path (default EMS_METRICS_LOG); returns the file written."""
+        path = path or METRICS_LOG
+        if not path:
+            return None
+        entry = {'time': time.strftime('%Y-%m-%dT%H:%M:%S'), 'pid': os.getpid(), 'metrics': self.summary()}
+        try:
+            with open(path, 'a') as f:
+                f.write(json.dumps(entry) + '\n')
+        except IOError as e:
+            print("An error occurred while writing the metrics log:", e)
+            return None
+        return path
+
+
+# The process-wide metrics every module records into
+metrics = Metrics()
+timed = metrics.timed
+timer = metrics.timer
@@ -0,0 +1,653 @@
+import heapq
+import threading
+from collections import OrderedDict
+from datetime import date, timedelta
+from operator import itemgetter
+from typing import Any, Callable, Dict, Iterable, List, NamedTuple, Optional, Sequence, Tuple
+
+from ems_records import amount, day_ordinal
+
+
+GROUPINGS = ('employee', 'week', 'month', 'client')
+PAY_PERIODS = ('weekly', 'biweekly', 'monthly')
+BIWEEKLY_ANCHOR = date(2024, 1, 1).toordinal()  # a Monday; biweekly periods start every other Monday from it
+EPOCH_ORDINAL = date(1970, 1, 1).toordinal()
+REPORT_TITLE = "Prudence Global Cleaning Limited Payroll Report"
+PAYROLL_CACHE_SIZE = 32  # payroll results kept for repeated runs
+
+np = None  # NumPy, imported on the first payroll run since it is slow to load
+_numpy_missing = False
+
+
+def _load_numpy():
+    """The numpy module, or None if it is not installed (payroll then uses the store's per-day hour totals)."""
+    global np, _numpy_missing
+    if np is None and not _numpy_missing:
+        try:
+            import numpy
+            np = numpy
+        except ImportError:
+            _numpy_missing = True
+    return np
+
+
+class PayrollResult(NamedTuple):
+    """Pay for one date range. groups maps a week/month/client key to pay per employee ID."""
+    start: date
+    end: date
+    grouping: str
+    totals: Dict[str, float]  # employee_id -> pay
+    hours: Dict[str, float]  # employee_id -> hours worked
+    groups: Dict[str, Dict[str, float]]
+    closed: Tuple[Tuple[date, date], ...] = ()  # closed pay periods whose snapshots were read instead of tasks
+
+
+def _rate(employee) -> float:
+    # Missing employees, and rates the file holds as unreadable text, pay 0
+    return amount(getattr(employee, 'hourly_rate', None))
+
+
+def _hours(task) -> float:
+    return amount(task.hours_worked)
+
+
+def group_label(grouping: str, day: int) -> str:
+    """Key of the week (its Monday) or month a day ordinal falls in."""
+    if grouping == 'week':
+        return date.fromordinal(day - (day - 1) % 7).isoformat()  # ordinal 1 is a Monday
+    return date.fromordinal(day).isoformat()[:7]
+
+
+def period_start(kind: str, day: int) -> int:
+    """Day ordinal of the first day of the weekly, biweekly or monthly pay period a day ordinal falls in."""
+    if kind == 'weekly':
+        return day - (day - 1) % 7
+    if kind == 'biweekly':
+        return day - (day - BIWEEKLY_ANCHOR) % 14
+    return day - date.fromordinal(day).day + 1
+
+
+def period_bounds(kind: str, day: date) -> Tuple[date, date]:
+    """First and last day of the pay period of this kind that day falls in."""
+    if kind not in PAY_PERIODS:
+        raise ValueError(f"Unknown pay period: {kind}")
+    start = date.fromordinal(period_start(kind, day.toordinal()))
+    if kind == 'monthly':
+        next_start = date(start.year + start.month // 12, start.month % 12 + 1, 1)
+        return start, date.fromordinal(next_start.toordinal() - 1)
+    return start, date.fromordinal(start.toordinal() + (6 if kind == 'weekly' else 13))
+
+
+def period_kind(start: date, end: date) -> Optional[str]:
+    """The kind of pay period start..end is exactly, or None."""
+    return next((kind for kind in PAY_PERIODS if period_bounds(kind, start) == (start, end)), None)
+
+
+def open_ranges(start: date, end: date, closed: Iterable[Tuple[date, date]]) -> List[Tuple[date, date]]:
+    """The parts of start..end outside the closed ranges, which must be disjoint, sorted and inside it."""
+    ranges, day = [], start
+    for closed_start, closed_end in closed:
+        if closed_start > day:
+            ranges.append((day, closed_start - timedelta(days=1)))
+        day = closed_end + timedelta(days=1)
+    if day <= end:
+        ranges.append((day, end))
+    return ranges
+
+
+def top_slices(totals: Dict[str, float], limit: int) -> Tuple[List[Tuple[str, float]], float]:
+    """The limit largest (employee_id, pay) pairs, largest first, and the summed pay of everyone else."""
+    if len(totals) <= limit:
+        return sorted(totals.items(), key=itemgetter(1), reverse=True), 0.0
+    top = heapq.nlargest(limit, totals.items(), key=itemgetter(1))
+    return top, sum(totals.values()) - sum(pay for _employee_id, pay in top)
+
+
+def _compute_columns(start: date, end: date, grouping: str, columns, rates, employee_ids: List[str],
+                     client_ids: List[str]) -> PayrollResult:
+    employee_col, client_col, day_col, hours_col = columns
+    mask = (day_col >= start.toordinal()) & (day_col <= end.toordinal())
+    employees = employee_col[mask]
+    hours = hours_col[mask]
+    pay = hours * rates[employees]
+
+    n_employees = len(employee_ids)
+    hours_totals = np.bincount(employees, weights=hours, minlength=n_employees)
+    groups: Dict[str, Dict[str, float]] = {}
+    if grouping == 'employee':
+        pay_totals = np.bincount(employees, weights=pay, minlength=n_employees)
+    else:
+        days = day_col[mask]
+        if grouping == 'client':
+            group_col = client_col[mask].astype(np.int64)
+        elif grouping == 'week':
+            group_col = (days - (days - 1) % 7).astype(np.int64)
+        else:
+            group_col = (days - EPOCH_ORDINAL).astype('datetime64[D]').astype('datetime64[M]').astype(np.int64)
+        # One bincount over the (group, employee) pairs that occur gives both breakdowns
+        keys, inverse = np.unique(group_col * n_employees + employees, return_inverse=True)
+        pay_by_key = np.bincount(inverse.ravel(), weights=pay, minlength=len(keys))
+        pay_totals = np.bincount(keys % n_employees, weights=pay_by_key, minlength=n_employees)
+        for key, group_pay in zip(keys.tolist(), pay_by_key.tolist()):
+            group, employee = divmod(key, n_employees)
+            if grouping == 'client':
+                label = client_ids[group]
+            elif grouping == 'week':
+                label = date.fromordinal(group).isoformat()
+            else:
+                label = str(np.datetime64(group, 'M'))  # 'YYYY-MM'
+            groups.setdefault(label, {})[employee_ids[employee]] = group_pay
+
+    worked = np.flatnonzero(np.bincount(employees, minlength=n_employees)).tolist()
+    totals = {employee_ids[i]: float(pay_totals[i]) for i in worked}
+    worked_hours = {employee_ids[i]: float(hours_totals[i]) for i in worked}
+    return PayrollResult(start, end, grouping, totals, worked_hours, groups)
+
+
+class PayrollCache:
+    """
+    Least recently used payroll results, keyed by (start, end, grouping).
+
+    Entries are not thrown away wholesale when the store changes: a task change only
+    drops the ranges covering its old or new date, and a change to an employee's rate
+    (or the employee being added or removed) only the results that pay that employee.
+    A run is registered with begin() before it is computed, tagged with the store
+    version; a relevant change arriving while it runs makes put() discard the result.
+    Results are stored from worker threads, so the cache has its own lock.
+    """
+
+    def __init__(self, store, size: int = PAYROLL_CACHE_SIZE):
+        self.store = store
+        self.size = size
+        self._lock = threading.Lock()
+        self._entries: "OrderedDict[Tuple[date, date, str], PayrollResult]" = OrderedDict()  # oldest use first
+        self._pending: Dict[Tuple[date, date, str], int] = {}  # runs in progress -> store version at begin()
+        store.subscribe(self.on_change, ['tasks', 'employees'])
+
+    def get(self, start: date, end: date, grouping: str = 'employee') -> Optional[PayrollResult]:
+        with self._lock:
+            key = (start, end, grouping)
+            if key not in self._entries and grouping == 'employee':
+                # Any breakdown of the same range carries the per-employee totals as well
+                key = next((other for other in self._entries if other[:2] == (start, end)), key)
+            result = self._entries.get(key)
+            if result is None:
+                return None
+            self._entries.move_to_end(key)
+            if result.grouping != grouping:
+                result = result._replace(grouping=grouping, groups={})  # just the totals, as computed for employees
+            return result
+
+    def begin(self, start: date, end: date, grouping: str) -> int:
+        """Register a run about to be computed; pass the returned version to put()."""
+        with self._lock:
+            version = self._pending[start, end, grouping] = self.store.version
+            return version
+
+    def put(self, result: PayrollResult, version: int) -> None:
+        key = (result.start, result.end, result.grouping)
+        with self._lock:
+            if self._pending.get(key) != version:
+                return  # invalidated while it was computed, or superseded by a newer run
+            del self._pending[key]
+            self._entries[key] = result
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.size:
+                self._entries.popitem(last=False)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self._pending.clear()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def on_change(self, change) -> None:
+        if change.category == 'tasks':
+            days = {day_ordinal(task) for task in (change.old, change.new) if task is not None}
+            days.discard(None)
+            if days:
+                def covers(key) -> bool:
+                    return any(key[0].toordinal() <= day <= key[1].toordinal() for day in days)
+                self._drop(lambda key, _result: covers(key), covers)
+        elif change.old is None or change.new is None or _rate(change.old) != _rate(change.new):
+            # Which employees a run in progress pays is not known yet, so those are all dropped
+            self._drop(lambda _key, result: change.record_id in result.totals, lambda _key: True)
+
+    def _drop(self, entry_affected: Callable[[Tuple, PayrollResult], bool],
+              pending_affected: Callable[[Tuple], bool]) -> None:
+        with self._lock:
+            for key in [key for key, result in self._entries.items() if entry_affected(key, result)]:
+                del self._entries[key]
+            for key in [key for key in self._pending if pending_affected(key)]:
+                del self._pending[key]
+
+
+class PayrollEngine:
+    """
+    Payroll over columnar task arrays.
+
+    Each task is one row of four NumPy columns: employee index, client index, day ordinal
+    and hours. Totals for a range are a masked, rate-weighted bincount, and the week,
+    month or client breakdown is computed in the same pass by binning on a combined
+    (group, employee) key. Rows follow the store's change notifications; deleted tasks
+    become tombstones that can never match a range until the columns are compacted.
+    Without NumPy the engine falls back to the store's TaskDateIndex.
+    """
+
+    def __init__(self, store):
+        self.store = store
+        self._built = False
+        self._rows: Dict[str, int] = {}  # task_id -> row
+        self._size = 0
+        self._tombstones = 0
+        self._employee_index: Dict[str, int] = {}
+        self._employee_ids: List[str] = []
+        self._client_index: Dict[str, int] = {}
+        self._client_ids: List[str] = []
+        store.subscribe(self.on_change, ['tasks', 'employees'])
+
+    # Column maintenance
+
+    def _build(self) -> None:
+        tasks = self.store.records('tasks')
+        capacity = max(1024, len(tasks))
+        self._employee_col = np.zeros(capacity, dtype=np.int32)
+        self._client_col = np.zeros(capacity, dtype=np.int32)
+        self._day_col = np.full(capacity, -1, dtype=np.int32)
+        self._hours_col = np.zeros(capacity, dtype=np.float64)
+        self._rates = np.zeros(16, dtype=np.float64)
+        self._rows, self._size, self._tombstones = {}, 0, 0
+        self._employee_index, self._employee_ids = {}, []
+        self._client_index, self._client_ids = {}, []
+        for employee_id in self.store.records('employees'):
+            self._employee(employee_id)
+        for task_id, task in tasks.items():
+            self._write(task_id, task)
+        self._built = True
+
+    def _employee(self, employee_id: str) -> int:
+        index = self._employee_index.get(employee_id)
+        if index is None:
+            index = self._employee_index[employee_id] = len(self._employee_ids)
+            self._employee_ids.append(employee_id)
+            if index >= len(self._rates):
+                self._rates = np.resize(self._rates, 2 * len(self._rates))
+            # Tasks of deleted employees keep a row but are paid at 0
+            self._rates[index] = _rate(self.store.get('employees', employee_id))
+        return index
+
+    def _client(self, client_id: str) -> int:
+        index = self._client_index.get(client_id)
+        if index is None:
+            index = self._client_index[client_id] = len(self._client_ids)
+            self._client_ids.append(client_id)
+        return index
+
+    def _write(self, task_id: str, task) -> None:
+        row = self._rows.get(task_id)
+        if row is None:
+            if self._size == len(self._day_col):
+                self._grow()
+            row = self._rows[task_id] = self._size
+            self._size += 1
+        day = day_ordinal(task)
+        self._employee_col[row] = self._employee(task.employee_id)
+        self._client_col[row] = self._client(task.client_id)
+        self._day_col[row] = -1 if day is None else day
+        self._hours_col[row] = _hours(task)
+
+    def _grow(self) -> None:
+        capacity = 2 * len(self._day_col)
+        self._employee_col = np.resize(self._employee_col, capacity)
+        self._client_col = np.resize(self._client_col, capacity)
+        self._hours_col = np.resize(self._hours_col, capacity)
+        day_col = np.full(capacity, -1, dtype=np.int32)
+        day_col[:self._size] = self._day_col[:self._size]
+        self._day_col = day_col
+
+    def on_change(self, change) -> None:
+        if not self._built:
+            return  # the columns are read from the store when first needed
+        if change.category == 'employees':
+            index = self._employee(change.record_id)
+            self._rates[index] = _rate(change.new)
+        elif change.new is not None:
+            self._write(change.record_id, change.new)
+        else:
+            row = self._rows.pop(change.record_id, None)
+            if row is not None:
+                self._day_col[row] = -1
+                self._tombstones += 1
+                if self._tombstones > len(self._rows):
+                    self._built = False  # mostly tombstones, rebuild compactly on the next run
+
+    # Queries
+
+    def prepare(self, start: date, end: date, grouping: str = 'employee') -> Callable[[], PayrollResult]:
+        """The function computing a payroll run from copies of the columns, safe to call on a worker."""
+        compute = self.prepare_ranges([(start, end)], grouping)
+        return lambda: compute()[0]
+
+    def prepare_ranges(self, ranges: Sequence[Tuple[date, date]],
+                       grouping: str = 'employee') -> Callable[[], List[PayrollResult]]:
+        """Like prepare(), for several ranges sharing one copy of the columns; results in the order of ranges."""
+        if grouping not in GROUPINGS:
+            raise ValueError(f"Unknown grouping: {grouping}")
+        if _load_numpy() is None:
+            results = [self._compute_without_numpy(start, end, grouping) for start, end in ranges]
+            return lambda: results
+        if not self._built:
+            self._build()
+
+        n = self._size
+        columns = (self._employee_col[:n].copy(), self._client_col[:n].copy(),
+                   self._day_col[:n].copy(), self._hours_col[:n].copy())
+        rates = self._rates[:len(self._employee_ids)].copy()
+        employee_ids, client_ids = list(self._employee_ids), list(self._client_ids)
+        return lambda: [_compute_columns(start, end, grouping, columns, rates, employee_ids, client_ids)
+                        for start, end in ranges]
+
+    def compute(self, start: date, end: date, grouping: str = 'employee') -> PayrollResult:
+        """Pay per employee for tasks dated start..end inclusive, optionally broken down by grouping."""
+        return self.prepare(start, end, grouping)()
+
+    def _compute_without_numpy(self, start: date, end: date, grouping: str) -> PayrollResult:
+        employees = self.store.records('employees')
+        if grouping != 'employee':
+            return compute_tasks(start, end, grouping, self.store.tasks_between(start, end).values(), employees)
+        hours = self.store.task_index.employee_hours(start, end)
+        totals = {employee_id: worked * _rate(employees.get(employee_id)) for employee_id, worked in hours.items()}
+        return PayrollResult(start, end, grouping, totals, hours, {})
+
+
+def compute_tasks(start: date, end: date, grouping: str, tasks: Iterable[Any],
+                  employees: Dict[str, Any]) -> PayrollResult:
+    """Pay for tasks (all dated start..end) by plain iteration: the path without NumPy, and archived tasks."""
+    rates: Dict[str, float] = {}
+    hours: Dict[str, float] = {}
+    groups: Dict[str, Dict[str, float]] = {}
+    for task in tasks:
+        employee_id = task.employee_id
+        if employee_id not in rates:
+            rates[employee_id] = _rate(employees.get(employee_id))
+        task_hours = _hours(task)
+        hours[employee_id] = hours.get(employee_id, 0.0) + task_hours
+        if grouping == 'employee':
+            continue
+        if grouping == 'client':
+            key = task.client_id
+        else:
+            key = group_label(grouping, day_ordinal(task))
+        group = groups.setdefault(key, {})
+        group[employee_id] = group.get(employee_id, 0.0) + task_hours * rates[employee_id]
+    totals = {employee_id: worked * rates[employee_id] for employee_id, worked in hours.items()}
+    return PayrollResult(start, end, grouping, totals, hours, groups)
+
+
+class PeriodTotals:
+    """
+    Running hours per employee for every weekly, biweekly and monthly pay period.
+
+    Each kind is built on first use by rolling up the store's per-day hour totals
+    (TaskDateIndex), then kept up to date from the store's change notifications, so the
+    pay for a whole period is one lookup per employee at the current rates instead of a
+    pass over the tasks. Only per-employee totals are kept; week, month and client
+    breakdowns still come from the PayrollEngine.
+    """
+
+    def __init__(self, store):
+        self.store = store
+        # kind -> period start ordinal -> employee_id -> [hours, task count], for the kinds built so far
+        self._periods: Dict[str, Dict[int, Dict[str, list]]] = {}
+        store.subscribe(self.on_change, ['tasks'])
+
+    def _built(self, kind: str) -> Dict[int, Dict[str, list]]:
+        periods = self._periods.get(kind)
+        if periods is None:
+            if kind not in PAY_PERIODS:
+                raise ValueError(f"Unknown pay period: {kind}")
+            periods = {}
+            for day, employees in self.store.task_index.day_totals():
+                bucket = periods.setdefault(period_start(kind, day), {})
+                for employee_id, (hours, count) in employees.items():
+                    totals = bucket.get(employee_id)
+                    if totals is None:
+                        bucket[employee_id] = [hours, count]
+                    else:
+                        totals[0] += hours
+                        totals[1] += count
+            self._periods[kind] = periods
+        return periods
+
+    def _book(self, task, sign: int) -> None:
+        day = day_ordinal(task)
+        if day is None:
+            return  # undated tasks fall in no period
+        employee_id, hours = task.employee_id, _hours(task)
+        for kind, periods in self._periods.items():
+            start = period_start(kind, day)
+            employees = periods.get(start)
+            if employees is None:
+                employees = periods[start] = {}
+            totals = employees.get(employee_id)
+            if totals is None:
+                totals = employees[employee_id] = [0.0, 0]
+            totals[0] += sign * hours
+            totals[1] += sign
+            if totals[1] == 0:
+                # Drop emptied buckets instead of keeping float residue around
+                del employees[employee_id]
+                if not employees:
+                    del periods[start]
+
+    def on_change(self, change) -> None:
+        if change.old is not None:
+            self._book(change.old, -1)
+        if change.new is not None:
+            self._book(change.new, 1)
+
+    def is_built(self, kind: str) -> bool:
+        return kind in self._periods
+
+    def periods(self, kind: str) -> List[date]:
+        """First days of the periods of this kind that have tasks, oldest first."""
+        return [date.fromordinal(start) for start in sorted(self._built(kind))]
+
+    def result(self, kind: str, day: date) -> PayrollResult:
+        """Pay per employee for the period of this kind that day falls in, at the current rates."""
+        start, end = period_bounds(kind, day)
+        employees = self.store.records('employees')
+        hours = {employee_id: totals[0] for employee_id, totals in self._built(kind).get(start.toordinal(), {}).items()}
+        totals = {employee_id: worked * _rate(employees.get(employee_id)) for employee_id, worked in hours.items()}
+        return PayrollResult(start, end, 'employee', totals, hours, {})
+
+
+# Closed pay periods
+
+def period_snapshot(kind: str, results: Dict[str, PayrollResult], employees: Dict[str, Any],
+                    clients: Dict[str, Any], closed_at: str) -> Dict[str, Any]:
+    """
+    The document a closed pay period is kept as (see ems_store.PeriodArchive).
+
+    results holds the period's week, month and client runs. Each employee paid keeps the
+    name, rate, hours and pay they had when the period was closed, and each client its
+    name, so later reports on the period read neither the tasks nor the live records.
+    """
+    result = results['client']
+
+    def name_of(records: Dict[str, Any], record_id: str) -> str:
+        record = records.get(record_id)
+        return record['name'] if record else f"Unknown ({record_id})"
+
+    return {
+        'kind': kind, 'start': result.start.isoformat(), 'end': result.end.isoformat(), 'closed_at': closed_at,
+        'employees': {employee_id: {'name': name_of(employees, employee_id), 'rate': _rate(employees.get(employee_id)),
+                                    'hours': result.hours[employee_id], 'pay': pay}
+                      for employee_id, pay in result.totals.items()},
+        'clients': {client_id: name_of(clients, client_id) for client_id in result.groups},
+        'groups': {grouping: results[grouping].groups for grouping in ('week', 'month', 'client')},
+    }
+
+
+def snapshot_result(document: Dict[str, Any], grouping: str = 'employee') -> PayrollResult:
+    """A closed period's payroll as it was when the period was closed."""
+    start, end = date.fromisoformat(document['start']), date.fromisoformat(document['end'])
+    employees = document['employees']
+    return PayrollResult(start, end, grouping, {employee_id: entry['pay'] for employee_id, entry in employees.items()},
+                         {employee_id: entry['hours'] for employee_id, entry in employees.items()},
+                         {} if grouping == 'employee' else document['groups'][grouping], ((start, end),))
+
+
+def combine_results(start: date, end: date, grouping: str, parts: Iterable[PayrollResult]) -> PayrollResult:
+    """One result for start..end from the results of the disjoint ranges it was split into."""
+    totals: Dict[str, float] = {}
+    hours: Dict[str, float] = {}
+    groups: Dict[str, Dict[str, float]] = {}
+    closed: List[Tuple[date, date]] = []
+    for part in parts:
+        for employee_id, pay in part.totals.items():
+            totals[employee_id] = totals.get(employee_id, 0.0) + pay
+        for employee_id, worked in part.hours.items():
+            hours[employee_id] = hours.get(employee_id, 0.0) + worked
+        for label, amounts in part.groups.items():
+            group = groups.setdefault(label, {})
+            for employee_id, pay in amounts.items():
+                group[employee_id] = group.get(employee_id, 0.0) + pay
+        closed.extend(part.closed)
+    return PayrollResult(start, end, grouping, totals, hours, dict(sorted(groups.items())), tuple(sorted(closed)))
+
+
+# PDF reports
+
+class _PdfTableWriter:
+    """Draws rows straight onto a reportlab canvas, starting a new page (with the header repeated) when full."""
+
+    def __init__(self, pdf, page_size, font_size: int = 10):
+        self.pdf = pdf
+        self.width, self.height = page_size
+        self.font_size = font_size
+        self.line_height = font_size + 6
+        self.margin = 50
+        self.page = 1
+        self.y = self.height - self.margin
+        self.columns: Sequence[Tuple[str, float, str]] = ()
+
+    def heading(self, text: str, font_size: int = 14) -> None:
+        self._ensure_room(font_size + 10)
+        self.pdf.setFont("Helvetica-Bold", font_size)
+        self.pdf.drawString(self.margin, self.y, text)
+        self.y -= font_size + 10
+
+    def table(self, columns: Sequence[Tuple[str, float, str]], rows: Iterable[Sequence[str]]) -> None:
+        """columns are (title, width, 'left'|'right'); rows are consumed one at a time."""
+        self.columns = columns
+        self._ensure_room(3 * self.line_height)
+        self._draw_header()
+        self.pdf.setFont("Helvetica", self.font_size)
+        for row in rows:
+            if self.y < self.margin + self.line_height:
+                self.new_page()
+                self._draw_header()
+                self.pdf.setFont("Helvetica", self.font_size)
+            self._draw_row(row)
+        self.columns = ()
+        self.y -= self.line_height
+
+    def new_page(self) -> None:
+        self._footer()
+        self.pdf.showPage()
+        self.page += 1
+        self.y = self.height - self.margin
+
+    def finish(self) -> None:
+        self._footer()
+        self.pdf.save()
+
+    def _ensure_room(self, needed: float) -> None:
+        if self.y - needed < self.margin:
+            self.new_page()
+
+    def _draw_header(self) -> None:
+        self.pdf.setFont("Helvetica-Bold", self.font_size)
+        self._draw_row([title for title, _width, _align in self.columns])
+        self.pdf.line(self.margin, self.y + self.line_height - 4,
+                      self.margin + sum(width for _title, width, _align in self.columns), self.y + self.line_height - 4)
+
+    def _draw_row(self, row: Sequence[str]) -> None:
+        x = self.margin
+        for value, (_title, width, align) in zip(row, self.columns):
+            text = str(value)
+            max_chars = int(width / (self.font_size * 0.55))  # rough Helvetica average, keeps cells from overlapping
+            if len(text) > max_chars:
+                text = text[:max_chars - 1] + '…'
+            if align == 'right':
+                self.pdf.drawRightString(x + width - 4, self.y, text)
+            else:
+                self.pdf.drawString(x, self.y, text)
+            x += width
+        self.y -= self.line_height
+
+    def _footer(self) -> None:
+        self.pdf.setFont("Helvetica", 8)
+        self.pdf.drawRightString(self.width - self.margin, self.margin / 2, f"Page {self.page}")
+
+
+def write_payroll_pdf(path: str, result: PayrollResult, employees: Dict[str, Any], clients: Dict[str, Any],
+                      tasks: Dict[str, Any], details: bool = True, title: str = REPORT_TITLE,
+                      progress: Optional[Callable[[float], None]] = None,
+                      rates: Optional[Dict[str, float]] = None) -> int:
+    """
+    Write a payroll report for result to path and return the number of pages.
+
+    employees, clients and tasks are plain dicts of typed records (the tasks of the result's
+    range), so the report can be written off the Tk thread from a snapshot. The summary
+    table lists every employee paid in the range; with details, each employee then gets
+    their own page(s) listing the tasks behind their total. progress(fraction) is called
+    after each employee's details; it may raise to abandon the report. rates, if given,
+    replaces the current hourly rates in the summary (for pay read from closed periods).
+    """
+    from reportlab.lib.pagesizes import letter
+    from reportlab.pdfgen import canvas as pdf_canvas
+
+    def name_of(records: Dict[str, Any], record_id: Optional[str]) -> str:
+        record = records.get(record_id)
+        return record['name'] if record else f"Unknown ({record_id})"
+
+    pdf = pdf_canvas.Canvas(path, pagesize=letter)
+    writer = _PdfTableWriter(pdf, letter)
+    writer.heading(title, 18)
+    writer.heading(f"Payroll from {result.start.isoformat()} to {result.end.isoformat()}", 12)
+
+    rates = rates or {}
+    order = sorted(result.totals, key=lambda employee_id: name_of(employees, employee_id).lower())
+    summary_columns = (('Employee', 200, 'left'), ('ID', 80, 'left'), ('Hours', 70, 'right'),
+                       ('Rate', 70, 'right'), ('Total Pay', 90, 'right'))
+    writer.table(summary_columns, (
+        (name_of(employees, employee_id), employee_id, f"{result.hours.get(employee_id, 0.0):.2f}",
+         f"${rates.get(employee_id, _rate(employees.get(employee_id))):.2f}", f"${result.totals[employee_id]:.2f}")
+        for employee_id in order))
+    writer.heading(f"Total payroll: ${sum(result.totals.values()):.2f}", 12)
+
+    if details:
+        by_employee: Dict[str, List[Dict[str, Any]]] = {}
+        for task in tasks.values():
+            by_employee.setdefault(task.employee_id, []).append(task)
+        detail_columns = (('Date', 80, 'left'), ('Task', 170, 'left'), ('Client', 140, 'left'),
+                          ('Hours', 60, 'right'), ('Pay', 60, 'right'))
+        for done, employee_id in enumerate(order):
+            if progress is not None:
+                progress(done / len(order))
+            rate = _rate(employees.get(employee_id))
+            employee_tasks = sorted(by_employee.get(employee_id, []), key=lambda task: day_ordinal(task) or 0)
+            writer.new_page()
+            writer.heading(f"{name_of(employees, employee_id)} ({employee_id})", 14)
+            writer.table(detail_columns, (
+                (task.get('date', ''), task.get('task_name', ''), name_of(clients, task.client_id),
+                 task.get('hours_worked', ''), f"${_hours(task) * rate:.2f}")
+                for task in employee_tasks))
+            writer.heading(f"Total: ${result.totals[employee_id]:.2f}", 11)
+
+    writer.finish()
+    return writer.page
@@ -0,0 +1,165 @@
+import math
+from collections.abc import Mapping
+from dataclasses import dataclass
+from datetime import date
+from operator import attrgetter
+from typing import Any, Callable, ClassVar, Dict, Iterator, Optional, Tuple, Union
+
+
+# Helper functions
+def parse_amount(value) -> Union[float, str, None]:
+    """A number read from the file as a float; text that is not a finite number is kept as it was."""
+    if value is None or isinstance(value, float):
+        return value
+    try:
+        number = float(value)
+    except (TypeError, ValueError):
+        return value
+    return number if math.isfinite(number) else value
+
+
+def parse_day(value) -> Union[date, str, None]:
+    """A 'YYYY-MM-DD' date read from the file as a date; anything else is kept as it was."""
+    if value is None or isinstance(value, date):
+        return value
+    try:
+        return date.fromisoformat(value)
+    except (TypeError, ValueError):
+        return value
+
+
+def format_value(value) -> Any:
+    """The text a parsed value is written back as: '15' or '7.5' for numbers, 'YYYY-MM-DD' for dates."""
+    if isinstance(value, float):
+        return str(int(value)) if value.is_integer() else repr(value)
+    if isinstance(value, date):
+        return value.isoformat()
+    return value
+
+
+def amount(value) -> float:
+    """A parsed amount as a number; missing or unreadable amounts count as 0."""
+    return value if isinstance(value, float) else 0.0
+
+
+def day_ordinal(task) -> Optional[int]:
+    """Day ordinal of a task's date, or None if it has no valid date."""
+    day = getattr(task, 'date', None)
+    return day.toordinal() if isinstance(day, date) else None
+
+
+class Record(Mapping):
+    """
+    Base of the typed records the store holds.
+
+    Each category's fields are slots, and amounts and dates are parsed once when a record
+    is created instead of on every payroll pass. A field the file does not have is None,
+    and keys the file has that are not fields are kept in extra. Read as a mapping, a
+    record gives every field back as the text the JSON file holds, so record['date'],
+    record.get(...) and dict(record) behave as the plain dicts did.
+
+    Records are never changed in place: a change replaces the record with a new one, so a
+    shallow copy of a category's ID -> record dict is a consistent snapshot.
+    """
+
+    __slots__ = ()
+
+    FIELDS: ClassVar[Tuple[str, ...]] = ()
+    PARSERS: ClassVar[Dict[str, Callable[[Any], Any]]] = {}
+
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        cls._field_set = frozenset(cls.FIELDS)
+        cls._values = attrgetter(*cls.FIELDS)  # every field in one call
+        cls._parsed = tuple((cls.FIELDS.index(field), parse) for field, parse in cls.PARSERS.items())
+
+    @classmethod
+    def from_dict(cls, data: Mapping) -> 'Record':
+        values = list(map(data.get, cls.FIELDS))
+        for position, parse in cls._parsed:
+            values[position] = parse(values[position])
+        record = cls(*values)
+        if not data.keys() <= cls._field_set:
+            record.extra = {key: value for key, value in data.items() if key not in cls._field_set}
+        return record
+
+    def to_dict(self) -> Dict[str, Any]:
+        """The record as the plain dict of text the JSON file holds."""
+        data = dict(zip(self.FIELDS, self._values(self)))
+        for field in self.PARSERS:
+            data[field] = format_value(data[field])
+        if None in data.values():
+            data = {field: value for field, value in data.items() if value is not None}
+        if self.extra:
+            data.update(self.extra)
+        return data
+
+    def __getitem__(self, key: str) -> Any:
+        if key in self._field_set:
+            value = getattr(self, key)
+            if value is not None:
+                return format_value(value)
+        elif self.extra and key in self.extra:
+            return self.extra[key]
+        raise KeyError(key)
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self.to_dict())
+
+    def __len__(self) -> int:
+        return len(self.to_dict())
+
+    def __repr__(self) -> str:
+        return f"{type(self).__name__}({self.to_dict()!r})"
+
+
+@dataclass(slots=True, eq=False, repr=False)
+class Employee(Record):
+    name: Optional[str] = None
+    phone_number: Optional[str] = None
+    position: Optional[str] = None
+    hourly_rate: Union[float, str, None] = None
+    extra: Optional[Dict[str, Any]] = None
+
+    FIELDS: ClassVar[Tuple[str, ...]] = ('name', 'phone_number', 'position', 'hourly_rate')
+    PARSERS: ClassVar[Dict[str, Callable[[Any], Any]]] = {'hourly_rate': parse_amount}
+
+
+@dataclass(slots=True, eq=False, repr=False)
+class Client(Record):
+    name: Optional[str] = None
+    phone_number: Optional[str] = None
+    location: Optional[str] = None
+    extra: Optional[Dict[str, Any]] = None
+
+    FIELDS: ClassVar[Tuple[str, ...]] = ('name', 'phone_number', 'location')
+    PARSERS: ClassVar[Dict[str, Callable[[Any], Any]]] = {}
+
+
+@dataclass(slots=True, eq=False, repr=False)
+class Task(Record):
+    task_name: Optional[str] = None
+    employee_id: Optional[str] = None
+    client_id: Optional[str] = None
+    hours_worked: Union[float, str, None] = None
+    date: Union[date, str, None] = None
+    extra: Optional[Dict[str, Any]] = None
+
+    FIELDS: ClassVar[Tuple[str, ...]] = ('task_name', 'employee_id', 'client_id', 'hours_worked', 'date')
+    PARSERS: ClassVar[Dict[str, Callable[[Any], Any]]] = {'hours_worked': parse_amount, 'date': parse_day}
+
+
+RECORD_TYPES = {'employees': Employee, 'clients': Client, 'tasks': Task}
+
+
+def as_record(category: str, data: Mapping) -> Record:
+    """data as the category's record type; records of that type are returned as they are."""
+    record_type = RECORD_TYPES[category]
+    return data if type(data) is record_type else record_type.from_dict(data)
+
+
+def to_json(value) -> Any:
+    """json.dump default= hook writing records as the plain objects the file has always held."""
+    if isinstance(value, Record):
+        return value.to_dict()
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
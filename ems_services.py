@@ -0,0 +1,535 @@
+import copy
+import math
+import re
+from datetime import date, datetime
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Mapping, NamedTuple, Optional, Tuple
+
+from ems_indexes import parse_date, tokenize
+from ems_metrics import timed, timer
+from ems_payroll import PAY_PERIODS, PayrollCache, PayrollEngine, PayrollResult, PeriodTotals, combine_results, \
+    compute_tasks, open_ranges, period_bounds, period_kind, period_snapshot, snapshot_result, write_payroll_pdf
+from ems_records import Employee, Record, day_ordinal, parse_day
+from ems_store import FIELDS, ID_PREFIXES, REFERENCES, DataStore, month_bounds
+
+
+PHONE_PATTERN = re.compile(r'\d{10}')
+NUMBER_FIELDS = {'hourly_rate': 'Hourly rate', 'hours_worked': 'Hours worked'}
+
+
+class ValidationError(ValueError):
+    """A record the forms would refuse; the message is the one shown to the user."""
+
+
+class BatchValidationError(ValidationError):
+    """Some records of a batch are invalid, so none of the batch was stored."""
+
+    def __init__(self, errors: List[Tuple[Any, str]]):
+        self.errors = errors  # (position or record ID, message) per invalid record
+        key, message = errors[0]
+        more = f" (and {len(errors) - 1} more)" if len(errors) > 1 else ''
+        super().__init__(f"{key}: {message}{more}")
+
+
+class BatchResult(NamedTuple):
+    ids: List[str]  # IDs of the records stored
+    errors: List[Tuple[Any, str]]  # (position or record ID, message) of the records skipped
+
+
+class CheckedImport(NamedTuple):
+    """Records of an import checked on a worker, for RecordService.finish_import()."""
+    valid: List[Tuple[int, Optional[str], Dict[str, Any]]]  # (position, ID replaced or None, record)
+    errors: List[Tuple[int, str]]
+    wanted_ids: Dict[int, str]  # position -> free ID a new record asked for
+    version: int  # store version the records were checked against
+
+
+class StoreSnapshot:
+    """
+    What validating records reads from a DataStore, safe to use on a worker while the store changes.
+
+    Records are looked up in the live store, since a single dict lookup is safe. The unique
+    indexes and closed pay-period days are changed in place, so they are copied when the
+    snapshot is taken, on the thread that changes the store.
+    """
+
+    def __init__(self, store: DataStore, categories: Iterable[str]):
+        self._store = store
+        self._unique_indexes = {}
+        for category in categories:
+            index = store.unique_index(category)
+            self._unique_indexes[category] = None if index is None else index.copy()
+        self.periods = store.periods.snapshot()
+
+    def get(self, category: str, record_id: str) -> Optional[Record]:
+        return self._store.get(category, record_id)
+
+    def unique_index(self, category: str):
+        return self._unique_indexes[category]
+
+
+def resolve_reference(store, category: str, value) -> Optional[str]:
+    """ID of the employee or client given by its ID or by its name (case-insensitive), or None."""
+    value = str(value).strip()
+    if store.get(category, value) is not None:
+        return value
+    ids = store.unique_index(category).lookup('name', value)
+    return ids.pop() if len(ids) == 1 else None  # unknown, or a name shared by several records
+
+
+def validate_record(store, category: str, record: Dict[str, Any], exclude_id: Optional[str] = None) -> Dict[str, Any]:
+    """
+    Check a record the way the forms do and return it as it should be stored.
+
+    Tasks may give their employee and client by ID or by name; they are stored as IDs.
+    exclude_id is the record being updated, which may keep its own name and phone number.
+    Raises ValidationError on the first problem found.
+    """
+    new_data = {field: record.get(field, '') for field in FIELDS[category]}
+
+    # Check if all fields are filled
+    if any(v == "" for v in new_data.values()):
+        raise ValidationError('All fields must be filled.')
+
+    # Validate phone number if 'phone_number' is a field
+    if 'phone_number' in new_data and not PHONE_PATTERN.fullmatch(new_data['phone_number']):
+        raise ValidationError('Phone number must contain exactly 10 digits.')
+
+    for field, label in NUMBER_FIELDS.items():
+        if field in new_data:
+            try:
+                number = float(new_data[field])
+                if not math.isfinite(number) or number < 0:  # 'nan' and 'inf' parse as floats too
+                    raise ValueError
+            except ValueError:
+                raise ValidationError(f"{label} must be a non-negative number.") from None
+
+    if 'date' in new_data and parse_date(new_data['date']) is None:
+        raise ValidationError('Date must be in YYYY-MM-DD format.')
+
+    # Check for duplicate names and phone numbers in the store's hash indexes
+    unique_index = store.unique_index(category)
+    duplicate = unique_index.conflict(new_data, exclude_id) if unique_index else None
+    if duplicate == 'name':
+        raise ValidationError(f"A record with the same {duplicate} already exists.")
+    if duplicate == 'phone_number':
+        raise ValidationError('An item with the same phone number already exists.')
+
+    # Convert employee and client names to IDs for storage
+    for field, referenced_category in REFERENCES.get(category, {}).items():
+        referenced_id = resolve_reference(store, referenced_category, new_data[field])
+        if referenced_id is None:
+            raise ValidationError(f"Invalid {referenced_category[:-1]} selected.")
+        new_data[field] = referenced_id
+
+    return new_data
+
+
+class RecordService:
+    """
+    Validation and persistence of one category, independent of any widget.
+
+    The managers call into a service instead of the store, so the same rules apply to
+    the forms, the command line and bulk jobs. Every call that changes records ends with
+    one store.request_save(); the *_many variants check the whole batch before storing
+    any of it, allocate all new IDs at once and save once.
+    """
+
+    category = ''
+
+    def __init__(self, store: DataStore):
+        self.store = store
+        self.id_prefix = ID_PREFIXES[self.category]
+
+    def get(self, record_id: str) -> Optional[Dict[str, Any]]:
+        return self.store.get(self.category, record_id)
+
+    def records(self) -> Dict[str, Dict[str, Any]]:
+        return self.store.records(self.category)
+
+    def validate(self, record: Dict[str, Any], exclude_id: Optional[str] = None) -> Dict[str, Any]:
+        return validate_record(self.store, self.category, record, exclude_id)
+
+    def add(self, record: Dict[str, Any]) -> str:
+        try:
+            return self.add_many([record]).ids[0]
+        except BatchValidationError as e:
+            raise ValidationError(e.errors[0][1]) from None  # just the message, no batch position
+
+    def update(self, record_id: str, record: Dict[str, Any]) -> None:
+        if self.get(record_id) is None:
+            raise KeyError(record_id)
+        try:
+            self.update_many({record_id: record})
+        except BatchValidationError as e:
+            raise ValidationError(e.errors[0][1]) from None
+
+    @timer('delete')
+    def delete(self, record_id: str) -> None:
+        self.store.delete(self.category, record_id)  # KeyError if the record does not exist
+        self.store.request_save()
+
+    @timer('add')
+    def add_many(self, records: Iterable[Dict[str, Any]], skip_invalid: bool = False) -> BatchResult:
+        """
+        Validate and store new records, errors keyed by their position in records.
+
+        With skip_invalid the valid records are stored and the others reported in the
+        result; otherwise one invalid record raises BatchValidationError and nothing is stored.
+        """
+        valid, errors = self._check_batch((position, None, record) for position, record in enumerate(records))
+        if errors and not skip_invalid:
+            raise BatchValidationError(errors)
+        ids = self.store.new_ids(self.category, len(valid), self.id_prefix) if valid else []
+        for record_id, (_key, _old_id, record) in zip(ids, valid):
+            self.store.add(self.category, record_id, record)
+        if ids:
+            self.store.request_save()
+            # A save made right away may have moved new records past IDs another user took meanwhile
+            ids = [self.store.renamed.get((self.category, record_id), record_id) for record_id in ids]
+        return BatchResult(ids, errors)
+
+    @timer('update')
+    def update_many(self, records: Mapping[str, Dict[str, Any]], skip_invalid: bool = False) -> BatchResult:
+        """Validate and replace existing records (record ID -> new fields), errors keyed by record ID."""
+        valid, errors = self._check_batch((record_id, record_id, record) for record_id, record in records.items())
+        if errors and not skip_invalid:
+            raise BatchValidationError(errors)
+        for _key, record_id, record in valid:
+            self.store.update(self.category, record_id, record)
+        if valid:
+            self.store.request_save()
+        return BatchResult([record_id for _key, record_id, _record in valid], errors)
+
+    def import_many(self, records: Iterable[Dict[str, Any]], skip_invalid: bool = True) -> BatchResult:
+        """
+        Add or replace records read from a file, errors keyed by their position in records.
+
+        A record whose 'id' is one of this category's records replaces it. One whose 'id'
+        is free and in this category's ID style is added under that ID, so an export can be
+        restored with its tasks still pointing at the right people; any other is added
+        under a new ID. Like add_many, the whole batch is checked before any of it is
+        stored, and it is saved once.
+        """
+        return self.finish_import(self.prepare_import(records)(), skip_invalid)
+
+    def prepare_import(self, records: Iterable[Dict[str, Any]]) -> Callable[[], CheckedImport]:
+        """The function reading and checking records on a worker; pass its result to finish_import() on this thread."""
+        # The worker checks against copies of what changes in place (see StoreSnapshot)
+        checker = copy.copy(self)
+        checker.store = StoreSnapshot(self.store, (self.category,) + tuple(REFERENCES.get(self.category, {}).values()))
+        version = self.store.version
+
+        def check() -> CheckedImport:
+            wanted_ids: Dict[int, str] = {}
+
+            def items():
+                for position, record in enumerate(records):
+                    record_id = str(record.get('id') or '').strip()
+                    if record_id and checker.get(record_id) is not None:
+                        yield position, record_id, record
+                        continue
+                    if record_id.startswith(self.id_prefix) and record_id[len(self.id_prefix):].isdigit():
+                        wanted_ids[position] = record_id
+                    yield position, None, record
+
+            with timed('import'):  # reading the rows and checking them
+                valid, errors = checker._check_batch(items())
+            return CheckedImport(valid, errors, wanted_ids, version)
+        return check
+
+    def finish_import(self, checked: CheckedImport, skip_invalid: bool = True) -> BatchResult:
+        """Store the records prepare_import()'s function found valid, as one batch with one save."""
+        valid, errors = checked.valid, checked.errors
+        if self.store.version != checked.version:
+            # Records changed while the file was checked; check the valid ones again against them
+            valid, late_errors = self._check_batch(valid)
+            errors = sorted(errors + late_errors)
+        if errors and not skip_invalid:
+            raise BatchValidationError(errors)
+        ids, new, kept = [], [], []
+        for position, record_id, record in valid:
+            if record_id is not None:
+                self.store.update(self.category, record_id, record)
+            elif checked.wanted_ids.get(position) is not None and self.get(checked.wanted_ids[position]) is None:
+                record_id = checked.wanted_ids[position]  # the same ID twice in the file: the second gets a new one
+                self.store.add(self.category, record_id, record)
+                kept.append(record_id)
+            else:
+                new.append((len(ids), record))
+            ids.append(record_id)
+        # Never hand out a kept ID again, even after its record is deleted
+        self.store.ids.reserve(self.id_prefix, kept)
+        if new:
+            for (index, record), record_id in zip(new, self.store.new_ids(self.category, len(new), self.id_prefix)):
+                self.store.add(self.category, record_id, record)
+                ids[index] = record_id
+        if ids:
+            self.store.request_save()
+            ids = [self.store.renamed.get((self.category, record_id), record_id) for record_id in ids]
+        return BatchResult(ids, errors)
+
+    @timer('validate')
+    def _check_batch(self, items: Iterable[Tuple[Any, Optional[str], Dict[str, Any]]]):
+        """Validate (error key, ID of the record replaced or None, record) triples against the store and each other."""
+        unique_index = self.store.unique_index(self.category)
+        seen: Dict[Tuple[str, str], Any] = {}  # (field, normalized value) -> key of the record using it
+        valid, errors = [], []
+        for key, record_id, record in items:
+            try:
+                if record_id is not None and self.get(record_id) is None:
+                    raise ValidationError('Record does not exist.')
+                record = self.validate(record, record_id)
+                if unique_index is not None:
+                    values = [(field, unique_index.normalize(field, record[field])) for field in unique_index.fields]
+                    for value in values:
+                        if value in seen:
+                            raise ValidationError(f"Same {value[0].replace('_', ' ')} as record {seen[value]} of this batch.")
+                    seen.update(dict.fromkeys(values, key))
+            except ValidationError as e:
+                errors.append((key, str(e)))
+                continue
+            valid.append((key, record_id, record))
+        return valid, errors
+
+
+class EmployeeService(RecordService):
+    category = 'employees'
+
+
+class ClientService(RecordService):
+    category = 'clients'
+
+
+class TaskService(RecordService):
+    """
+    Tasks; their employee and client may be given by ID or by name, and are stored as IDs.
+
+    Tasks dated in a closed pay period can no longer be added, changed or deleted, so
+    the period's snapshot keeps matching its tasks.
+    """
+
+    category = 'tasks'
+
+    def validate(self, record: Dict[str, Any], exclude_id: Optional[str] = None) -> Dict[str, Any]:
+        record = super().validate(record, exclude_id)
+        self.check_open(record['date'])
+        old = self.get(exclude_id) if exclude_id is not None else None
+        if old is not None:
+            self.check_open(old.date)
+        return record
+
+    def delete(self, record_id: str) -> None:
+        task = self.get(record_id)
+        if task is not None:
+            self.check_open(task.date)
+        super().delete(record_id)
+
+    def check_open(self, day) -> None:
+        """Raise ValidationError if day (a date or YYYY-MM-DD) is in a closed pay period."""
+        day = parse_day(day)
+        if isinstance(day, date) and self.store.periods.is_closed(day):
+            raise ValidationError(f"{day.isoformat()} is in a closed pay period; its tasks can no longer be changed.")
+
+    def employee_id(self, name_or_id) -> Optional[str]:
+        return resolve_reference(self.store, 'employees', name_or_id)
+
+    def client_id(self, name_or_id) -> Optional[str]:
+        return resolve_reference(self.store, 'clients', name_or_id)
+
+    def prepare_archive_search(self, query: str) -> Callable[..., List[Tuple[str, Record]]]:
+        """The function finding archived tasks the search box would match for query, month by month, oldest first."""
+        terms = set(tokenize(query))
+        names = {field: dict(self.store.name_index(category).names) for field, category in REFERENCES['tasks'].items()}
+        live = self.store.records('tasks')
+        archive = self.store.archive
+
+        def matches(task_id: str, task: Record) -> bool:
+            tokens = set(tokenize(task_id))
+            for field, value in task.items():
+                tokens.update(tokenize(value))
+                if field in names:
+                    tokens.update(tokenize(names[field].get(value, '')))
+            return all(any(token.startswith(term) for token in tokens) for term in terms)
+
+        def search(progress: Optional[Callable[[float], None]] = None) -> List[Tuple[str, Record]]:
+            found = []
+            months = archive.months() if terms else []
+            for done, month in enumerate(months, 1):
+                found.extend(item for item in archive.tasks([month], live) if matches(*item))
+                if progress is not None:
+                    progress(done / len(months))
+            return found
+        return search
+
+
+class PayrollService:
+    """
+    Payroll runs and reports over a store.
+
+    Totals come from a PayrollEngine. Results are kept in a PayrollCache, so running
+    the same period again (or its PDF) is a lookup until a change touching it is made.
+    Closed pay periods inside a range are read from their snapshots, and an open range
+    that is exactly one pay period from the running PeriodTotals once those are kept for
+    its kind, so only what is left is computed from the tasks.
+    """
+
+    def __init__(self, store: DataStore):
+        self.store = store
+        self.engine = PayrollEngine(store)
+        self.cache = PayrollCache(store)
+        self.periods = PeriodTotals(store)
+
+    def cached(self, start: date, end: date, grouping: str = 'employee') -> Optional[PayrollResult]:
+        """A still valid earlier result for this query, else None."""
+        return self.cache.get(start, end, grouping)
+
+    def prepare(self, start: date, end: date, grouping: str = 'employee') -> Callable[[], PayrollResult]:
+        """The function computing a payroll run on a worker and caching its result."""
+        cached = self.cached(start, end, grouping)
+        if cached is not None:
+            return lambda: cached
+        closed = self.store.periods.within(start, end)
+        parts = [snapshot_result(self.store.periods.load(period), grouping) for period in closed]
+        archived_months = [month_bounds(month) for month in self.store.archive.months_between(start, end)]
+        ranges, archived_ranges = [], []
+        for range_start, range_end in open_ranges(start, end, [(period.start, period.end) for period in closed]):
+            # Archived months are only read for days no closed period in the range covers
+            if any(month_start <= range_end and range_start <= month_end
+                   for month_start, month_end in archived_months):
+                archived_ranges.append((range_start, range_end))
+                ranges.append((range_start, range_end))  # may hold tasks outside the archived months too
+                continue
+            kind = period_kind(range_start, range_end) if grouping == 'employee' else None
+            if kind is not None and self.periods.is_built(kind):
+                parts.append(self.periods.result(kind, range_start))
+            else:
+                ranges.append((range_start, range_end))
+        compute = self.engine.prepare_ranges(ranges, grouping) if ranges else lambda: []
+        employees = dict(self.store.records('employees')) if archived_ranges else {}
+        live, archive = self.store.records('tasks'), self.store.archive
+        version = self.cache.begin(start, end, grouping)
+
+        def run() -> PayrollResult:
+            with timed('payroll'):
+                computed = compute()
+                for range_start, range_end in archived_ranges:
+                    tasks = (task for _task_id, task in archive.tasks_between(range_start, range_end, live))
+                    computed.append(compute_tasks(range_start, range_end, grouping, tasks, employees))
+                if len(computed) == 1 and not parts:
+                    result = computed[0]
+                else:
+                    result = combine_results(start, end, grouping, parts + computed)
+            self.cache.put(result, version)
+            return result
+        return run
+
+    def calculate(self, start: date, end: date, grouping: str = 'employee') -> PayrollResult:
+        return self.prepare(start, end, grouping)()
+
+    def pay_periods(self, kind: str) -> List[Tuple[date, date, bool]]:
+        """(start, end, closed) of every period of this kind that has tasks or is closed, oldest first."""
+        closed = {period.start for period in self.store.periods.periods(kind)}
+        return [period_bounds(kind, start) + (start in closed,)
+                for start in sorted(set(self.periods.periods(kind)) | closed)]
+
+    def close_period(self, kind: str, day: date, today: Optional[date] = None) -> Dict[str, Any]:
+        """
+        Close the pay period of this kind that day falls in, and return its snapshot.
+
+        Its pay, with week, month and client breakdowns, is worked out one last time and
+        written to the store's PeriodArchive. From then on reports read the snapshot
+        instead of the tasks, and TaskService refuses changes to tasks dated in it.
+        Raises ValueError if the period has not ended yet or is already closed.
+        """
+        return self.finish_close_period(self.prepare_close_period(kind, day, today)())
+
+    def prepare_close_period(self, kind: str, day: date,
+                             today: Optional[date] = None) -> Callable[[], Tuple[Dict[str, Any], Dict[str, PayrollResult]]]:
+        """The function computing a period's snapshot on a worker; hand what it returns to finish_close_period."""
+        if kind not in PAY_PERIODS:
+            raise ValueError(f"Unknown pay period: {kind}")
+        start, end = period_bounds(kind, day)
+        if end >= (today or date.today()):
+            raise ValueError(f"The {kind} period {start.isoformat()} to {end.isoformat()} has not ended yet.")
+        if self.store.periods.get(kind, start) is not None:
+            raise ValueError(f"The {kind} period {start.isoformat()} to {end.isoformat()} is already closed.")
+        runs = {grouping: self.prepare(start, end, grouping) for grouping in ('week', 'month', 'client')}
+        employees, clients = dict(self.store.records('employees')), dict(self.store.records('clients'))
+        closed_at = datetime.now().isoformat(timespec='seconds')
+
+        def run() -> Tuple[Dict[str, Any], Dict[str, PayrollResult]]:
+            results = {grouping: compute() for grouping, compute in runs.items()}
+            return period_snapshot(kind, results, employees, clients, closed_at), results
+        return run
+
+    def finish_close_period(self, prepared: Tuple[Dict[str, Any], Dict[str, PayrollResult]]) -> Dict[str, Any]:
+        """Write a snapshot computed by prepare_close_period, unless its tasks or rates changed meanwhile."""
+        document, results = prepared
+        for grouping, result in results.items():
+            # A change touching the period drops its cached runs (see PayrollCache)
+            if self.cached(result.start, result.end, grouping) is not result:
+                raise ValueError(f"The {document['kind']} period {document['start']} to {document['end']} "
+                                 f"changed while it was being closed; close it again.")
+        self.store.periods.add(document)
+        return document
+
+    def employee_name(self, employee_id: str) -> str:
+        # Tasks can outlive the employee they were booked to
+        employee = self.store.get('employees', employee_id)
+        return employee['name'] if employee else self._closed_name('employees', employee_id)
+
+    def client_name(self, client_id: str) -> str:
+        client = self.store.get('clients', client_id)
+        return client['name'] if client else self._closed_name('clients', client_id)
+
+    def _closed_name(self, category: str, record_id: str) -> str:
+        # A closed period remembers the names of the people it paid, even after they are deleted
+        for period in reversed(self.store.periods.periods()):
+            entry = self.store.periods.load(period)[category].get(record_id)
+            if entry is not None:
+                return entry['name'] if category == 'employees' else entry
+        return f"Unknown ({record_id})"
+
+    def rows(self, result: PayrollResult) -> Iterator[Dict[str, Any]]:
+        """One row per employee, or per group and employee, ready for CSV or JSON."""
+        if result.grouping == 'employee':
+            for employee_id, pay in result.totals.items():
+                yield {'employee_id': employee_id, 'name': self.employee_name(employee_id),
+                       'hours': round(result.hours.get(employee_id, 0.0), 2), 'pay': round(pay, 2)}
+            return
+        for group, amounts in result.groups.items():
+            for employee_id, pay in amounts.items():
+                row = {'client_id': group, 'client_name': self.client_name(group)} if result.grouping == 'client' \
+                    else {result.grouping: group}
+                row.update(employee_id=employee_id, name=self.employee_name(employee_id), pay=round(pay, 2))
+                yield row
+
+    def prepare_pdf(self, path: str, result: PayrollResult) -> Callable[..., int]:
+        """The function writing the PDF report on result, safe to call on a worker."""
+        tasks = in_range = self.store.tasks_between(result.start, result.end)
+        archive = self.store.archive
+        employees = dict(self.store.records('employees'))
+        clients = dict(self.store.records('clients'))
+        rates = None
+        closed_days = set()
+        if result.closed:
+            # Closed periods were paid at the rates they closed with: the summary shows the
+            # rate actually paid, and detail lines are listed for the open days only
+            for closed_start, closed_end in result.closed:
+                closed_days.update(range(closed_start.toordinal(), closed_end.toordinal() + 1))
+            tasks = {task_id: task for task_id, task in tasks.items() if day_ordinal(task) not in closed_days}
+            for period in self.store.periods.within(result.start, result.end):
+                for employee_id, entry in self.store.periods.load(period)['employees'].items():
+                    if employee_id not in employees:
+                        employees[employee_id] = Employee(name=entry['name'], hourly_rate=entry['rate'])
+            rates = {employee_id: pay / result.hours[employee_id]
+                     for employee_id, pay in result.totals.items() if result.hours.get(employee_id)}
+
+        def write(progress: Optional[Callable[[float], None]] = None) -> int:
+            with timed('pdf'):
+                # Archived months are read here, on the worker; a task left in both places is dated in range
+                archived = archive.tasks_between(result.start, result.end, in_range)
+                report_tasks = dict(tasks)
+                report_tasks.update((task_id, task) for task_id, task in archived if day_ordinal(task) not in closed_days)
+                return write_payroll_pdf(path, result, employees, clients, report_tasks, progress=progress, rates=rates)
+        return write
@@ -0,0 +1,1107 @@
+import json
+import os
+import sqlite3
+import sys
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import replace
+from datetime import date, timedelta
+from typing import Any, Callable, Dict, FrozenSet, Iterable, Iterator, List, NamedTuple, Optional, Tuple
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+    import msvcrt
+
+from ems_indexes import NameIndex, SearchIndex, TaskDateIndex, UniqueIndex
+from ems_metrics import timed
+from ems_records import RECORD_TYPES, Record, as_record, day_ordinal, to_json
+
+
+# Constants
+DATA_FILE = 'management_data.json'
+SQLITE_FILE = 'management_data.db'
+CATEGORIES = ('employees', 'clients', 'tasks')
+# 'json' rewrites the whole file on every save, 'journal' appends each change to a write-ahead log,
+# 'sqlite' keeps the records in management_data.db
+STORAGE_MODE = os.environ.get('EMS_STORAGE', 'json')
+# Record IDs are the category prefix followed by a zero-padded number, e.g. E000123
+ID_PREFIXES = {'employees': 'E', 'clients': 'C', 'tasks': 'T'}
+ID_DIGITS = 6
+UNIQUE_CATEGORIES = ('employees', 'clients')
+# Fields holding another record's ID, searched by that record's name as well
+REFERENCES = {'tasks': {'employee_id': 'employees', 'client_id': 'clients'}}
+LOCK_TIMEOUT = 10  # seconds to wait for another copy of the app to finish writing the data file
+# Closed months before the current one whose tasks stay in the data file; older ones are archived
+RECENT_MONTHS = int(os.environ.get('EMS_RECENT_MONTHS', '3'))
+ARCHIVE_CACHE_MONTHS = 12  # archived months kept parsed once a payroll run or search has read them
+# Fields of each category's records (and the SQLite backend's columns)
+FIELDS = {
+    'employees': ('name', 'phone_number', 'position', 'hourly_rate'),
+    'clients': ('name', 'phone_number', 'location'),
+    'tasks': ('task_name', 'employee_id', 'client_id', 'hours_worked', 'date'),
+}
+
+
+# Helper functions
+def load_data(path: str = DATA_FILE) -> Dict[str, Any]:
+    try:
+        with open(path, 'r') as my_file:
+            data = json.load(my_file)
+    except FileNotFoundError:
+        data = {}  # to handle the error, the file is created on the first save
+    for category in CATEGORIES:
+        data.setdefault(category, {})
+    return data
+
+
+def load_partition(path: str) -> Dict[str, Any]:
+    """The task ID -> task dict of an archived month's file."""
+    with open(path, 'r') as my_file:
+        return json.load(my_file)
+
+
+def save_data(data: Dict[str, Any], path: str = DATA_FILE) -> None:
+    try:
+        write_json_atomic(data, path)
+    except IOError as e:
+        print("An error occurred while writing to the file:", e)
+
+
+def write_json_atomic(data: Dict[str, Any], path: str) -> None:
+    # Write next to the target and rename over it, so a crash never leaves a truncated file
+    temp_path = path + '.tmp'
+    with open(temp_path, 'w') as my_file:
+        # One dumps() call runs the C encoder; json.dump() streams through the pure-Python one
+        my_file.write(json.dumps(data, default=to_json))
+        my_file.flush()
+        os.fsync(my_file.fileno())
+    os.replace(temp_path, path)
+
+
+def month_bounds(month: str) -> Tuple[date, date]:
+    """First and last day of a 'YYYY-MM' month."""
+    start = date.fromisoformat(month + '-01')
+    return start, date(start.year + start.month // 12, start.month % 12 + 1, 1) - timedelta(days=1)
+
+
+def file_stamp(path: str) -> Optional[Tuple[int, int, int]]:
+    """(mtime, size, inode) of a file, which changes whenever another writer replaces it; None if it is missing."""
+    try:
+        stat = os.stat(path)
+    except FileNotFoundError:
+        return None
+    return stat.st_mtime_ns, stat.st_size, stat.st_ino
+
+
+class FileLock:
+    """
+    Advisory lock shared by every copy of the app that uses the same data file.
+
+    Held as a context manager around each read and write of the file. It uses POSIX
+    record locks (fcntl.lockf) or msvcrt byte-range locks, which network shares pass on
+    between machines, and a thread lock so two threads of one process exclude each other
+    too. The operating system drops the lock if the process holding it dies.
+    """
+
+    def __init__(self, path: str, timeout: float = LOCK_TIMEOUT):
+        self.path = path
+        self.timeout = timeout
+        self._thread_lock = threading.Lock()
+        self._file = None
+
+    def __enter__(self) -> 'FileLock':
+        self._thread_lock.acquire()
+        try:
+            self._file = open(self.path, 'a+b')
+            deadline = time.monotonic() + self.timeout
+            while not self._try_lock():
+                if time.monotonic() > deadline:
+                    raise TimeoutError(f"{self.path} is held by another copy of the app")
+                time.sleep(0.05)
+        except BaseException:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+            self._thread_lock.release()
+            raise
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        try:
+            if fcntl is not None:
+                fcntl.lockf(self._file, fcntl.LOCK_UN)
+            else:
+                self._file.seek(0)
+                msvcrt.locking(self._file.fileno(), msvcrt.LK_UNLCK, 1)
+        finally:
+            self._file.close()
+            self._file = None
+            self._thread_lock.release()
+
+    def _try_lock(self) -> bool:
+        try:
+            if fcntl is not None:
+                fcntl.lockf(self._file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            else:
+                self._file.seek(0)
+                msvcrt.locking(self._file.fileno(), msvcrt.LK_NBLCK, 1)
+        except OSError:
+            return False
+        return True
+
+
+class Change(NamedTuple):
+    """A single mutation of the store, passed to every subscribed listener."""
+    category: str
+    action: str  # 'add', 'update' or 'delete'
+    record_id: str
+    old: Optional[Dict[str, Any]]
+    new: Optional[Dict[str, Any]]
+
+
+class Conflict(NamedTuple):
+    """A record this copy and another copy of the app both changed; the other copy's version was kept."""
+    category: str
+    record_id: str
+    ours: Optional[Dict[str, Any]]  # what this copy tried to save (None: deleted)
+    theirs: Optional[Dict[str, Any]]  # what the file holds now (None: deleted), or the record ours duplicated
+
+
+class SyncResult(NamedTuple):
+    """What a save found other copies of the app had written, for DataStore.finish_save()."""
+    changes: List[Change]  # to apply to this copy, so it matches the file
+    conflicts: List[Conflict]
+    counters: Dict[str, int]  # merged next_id counters
+    renamed: Dict[Tuple[str, str], str]  # (category, ID) of our new records saved under another ID -> that ID
+
+
+class JsonBackend:
+    """
+    Keeps the whole document in management_data.json and rewrites it on every save.
+
+    Several copies of the app may share the file, e.g. on a network drive. Reads and
+    writes happen under a FileLock on management_data.json.lock, and every record has a
+    version, bumped when it changes (kept in the document's meta section; records never
+    saved by this version of the app count as version 0). A save only re-reads the file
+    when its mtime, size or inode show another copy wrote it since this one last read
+    or wrote it. The file is then merged with this copy's changes: changes to different
+    records are combined, a new record whose ID the other copy also used is given the
+    next free ID, and a record both copies changed keeps the version saved first and is
+    reported as a Conflict. So is an employee or client of ours taking a name or phone
+    number the other copy saved first; theirs is kept, and a duplicate we added is
+    replaced by theirs. save() returns what this copy has to apply to catch up.
+    """
+
+    def __init__(self, path: str = DATA_FILE):
+        self.path = path
+        self.lock = FileLock(path + '.lock')
+        self.versions: Dict[str, Dict[str, int]] = {}  # category -> record_id -> version, as last read or written
+        self._stamp: Optional[Tuple[int, int, int]] = None
+        self._unsaved: List[Change] = []  # changes of a failed save, retried with the next one
+
+    def load(self) -> Dict[str, Any]:
+        with self.lock:
+            self._stamp = file_stamp(self.path)
+            data = load_data(self.path)
+        self.versions = data['meta'].pop('versions', {}) if data.get('meta') else {}
+        return data
+
+    def needs_snapshot(self, changes: List[Change]) -> bool:
+        return True  # the whole document is written
+
+    def save(self, data: Dict[str, Any], changes: List[Change]) -> Optional[SyncResult]:
+        changes, self._unsaved = self._unsaved + changes, []
+        try:
+            with self.lock:
+                stamp = file_stamp(self.path)
+                result = None
+                if stamp is None or stamp == self._stamp:
+                    # Nobody else wrote since we last read or wrote the file; write ours as it is
+                    document, versions = data, dict(self.versions)
+                    for category in {change.category for change in changes} & set(CATEGORIES):
+                        versions[category] = dict(versions.get(category, {}))  # kept only if the write succeeds
+                    for change in changes:
+                        if change.category in CATEGORIES:
+                            self._bump(versions, change.category, change.record_id, change.new)
+                else:
+                    document = load_data(self.path)
+                    versions = document['meta'].pop('versions', {}) if document.get('meta') else {}
+                    result = self._merge(data, changes, document, versions)
+                write_json_atomic(dict(document, meta=dict(document.get('meta', {}), versions=versions)), self.path)
+                self.versions = versions
+                self._stamp = file_stamp(self.path)
+                return result
+        except (IOError, ValueError) as e:
+            self._unsaved = changes
+            print("An error occurred while writing to the file:", e)
+            return None
+
+    @staticmethod
+    def _bump(versions: Dict[str, Dict[str, int]], category: str, record_id: str, record) -> None:
+        category_versions = versions.setdefault(category, {})
+        if record is None:
+            category_versions.pop(record_id, None)
+        else:
+            category_versions[record_id] = category_versions.get(record_id, 0) + 1
+
+    def _merge(self, data: Dict[str, Any], changes: List[Change], document: Dict[str, Any],
+               versions: Dict[str, Dict[str, int]]) -> SyncResult:
+        """Fold our changes into document (the file as another copy left it) and return what we must apply."""
+        # Our changes since the last save, per record: (record as last synced, record now)
+        ours: Dict[Tuple[str, str], tuple] = {}
+        for change in changes:
+            if change.category in CATEGORIES:
+                key = (change.category, change.record_id)
+                ours[key] = (ours[key][0] if key in ours else change.old, change.new)
+
+        # next_id counters: the higher of both, so neither copy reuses a number the other allocated
+        counters = dict(document['meta'].get('next_id', {})) if document.get('meta') else {}
+        for prefix, number in data.get('meta', {}).get('next_id', {}).items():
+            counters[prefix] = max(counters.get(prefix, 0), number)
+        ids = IdAllocator(counters)
+
+        catch_up: List[Change] = []
+        conflicts: List[Conflict] = []
+        renamed: Dict[Tuple[str, str], str] = {}  # (category, our new ID) -> ID it was saved under
+        for category in CATEGORIES:  # employees and clients before the tasks that refer to them
+            moved = set()  # IDs our renamed records were saved under
+            records = data[category]
+            theirs = document[category]
+            base_versions = self.versions.get(category, {})
+            their_versions = versions.get(category, {})
+            unique: Optional[Dict[Tuple[str, str], set]] = None  # (field, normalized value) -> their IDs
+
+            def duplicate_of(record_id: str, record, added: bool) -> Optional[str]:
+                # A record of theirs we did not change holding one of record's unique values
+                nonlocal unique
+                if category not in UNIQUE_CATEGORIES:
+                    return None
+                if unique is None:
+                    unique = {}
+                    for their_id, their_record in theirs.items():
+                        for field in ('name', 'phone_number'):
+                            if field in their_record:
+                                key = (field, UniqueIndex.normalize(field, their_record[field]))
+                                unique.setdefault(key, set()).add(their_id)
+                for field in ('name', 'phone_number'):
+                    if field in record:
+                        for their_id in unique.get((field, UniqueIndex.normalize(field, record[field])), ()):
+                            if (their_id == record_id and added) or (
+                                    their_id != record_id and (category, their_id) not in ours):
+                                return their_id
+                return None
+
+            def synced_present(record_id: str) -> bool:
+                key = (category, record_id)
+                return ours[key][0] is not None if key in ours else record_id in records
+
+            def changed_by_them(record_id: str) -> bool:
+                return (their_versions.get(record_id, 0) != base_versions.get(record_id, 0)
+                        or (record_id in theirs) != synced_present(record_id))
+
+            for (change_category, record_id), (old, new) in ours.items():
+                if change_category != category:
+                    continue
+                if new is not None:
+                    for field, referenced_category in REFERENCES.get(category, {}).items():
+                        new_reference = renamed.get((referenced_category, getattr(new, field)))
+                        if new_reference is not None:
+                            rewritten = replace(new, **{field: new_reference})
+                            catch_up.append(Change(category, 'update', record_id, new, rewritten))
+                            new = rewritten
+                duplicate = None
+                if new is not None and (old is None or not changed_by_them(record_id)):
+                    duplicate = duplicate_of(record_id, new, old is None)
+                if duplicate is not None:
+                    # The other copy saved this name or phone number first: keep theirs
+                    conflicts.append(Conflict(category, record_id, new, theirs[duplicate]))
+                    catch_up.append(_change(category, record_id, new, theirs.get(record_id)))
+                    if old is None and duplicate != record_id:
+                        renamed[category, record_id] = duplicate  # our tasks refer to their record instead
+                elif not changed_by_them(record_id):
+                    self._apply(theirs, versions, category, record_id, new)
+                elif old is None and new is not None and record_id in theirs:
+                    # Both copies added a record under the same ID; ours moves to the next free one
+                    new_id = ids.allocate(ID_PREFIXES[category], theirs)[0]
+                    renamed[category, record_id] = new_id
+                    moved.add(new_id)
+                    self._apply(theirs, versions, category, new_id, new)
+                    catch_up.append(Change(category, 'add', new_id, None, new))
+                    catch_up.append(Change(category, 'update', record_id, new, theirs[record_id]))
+                elif new != theirs.get(record_id):  # both made the same change is no conflict
+                    conflicts.append(Conflict(category, record_id, new, theirs.get(record_id)))
+                    catch_up.append(_change(category, record_id, new, theirs.get(record_id)))
+
+            # Their changes to records we did not touch
+            candidates = theirs.keys() ^ records.keys()
+            candidates.update(record_id for record_id, version in their_versions.items()
+                              if base_versions.get(record_id, 0) != version)
+            candidates.update(record_id for record_id in base_versions if record_id not in their_versions)
+            for record_id in candidates:
+                if (category, record_id) not in ours and record_id not in moved and changed_by_them(record_id):
+                    catch_up.append(_change(category, record_id, records.get(record_id), theirs.get(record_id)))
+
+        document.setdefault('meta', {}).update(data.get('meta', {}), next_id=ids.counters())
+        return SyncResult(catch_up, conflicts, ids.counters(), renamed)
+
+    def _apply(self, records: Dict[str, Any], versions: Dict[str, Dict[str, int]], category: str, record_id: str,
+               record) -> None:
+        if record is None:
+            records.pop(record_id, None)
+        else:
+            records[record_id] = record
+        self._bump(versions, category, record_id, record)
+
+    def close(self) -> None:
+        pass
+
+
+def _change(category: str, record_id: str, old, new) -> Change:
+    action = 'add' if old is None else 'delete' if new is None else 'update'
+    return Change(category, action, record_id, old, new)
+
+
+class JournalBackend:
+    """
+    Appends each change to a write-ahead journal next to the JSON snapshot.
+
+    On load the snapshot is read and the journal replayed on top of it. Once the journal
+    holds compact_every entries, the current data is written to a new snapshot on a
+    background thread (temp file + rename) and the journal is discarded, so the JSON file
+    keeps the same layout the json mode uses.
+    """
+
+    def __init__(self, path: str = DATA_FILE, compact_every: int = 500):
+        self.path = path
+        self.journal_path = path + '.journal'
+        # Journal being folded into the snapshot; replayed on load if a compaction was interrupted
+        self.old_journal_path = path + '.journal.old'
+        self.compact_every = compact_every
+        self._entries = 0
+        self._lock = threading.Lock()
+        self._compactor: Optional[threading.Thread] = None
+
+    def load(self) -> Dict[str, Any]:
+        data = load_data(self.path)
+        for journal_path in (self.old_journal_path, self.journal_path):
+            self._entries += self._replay(data, journal_path)
+        return data
+
+    @staticmethod
+    def _replay(data: Dict[str, Any], journal_path: str) -> int:
+        count = 0
+        try:
+            with open(journal_path, 'rb+') as journal:
+                good_end = 0
+                for line in journal:
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:
+                        # Torn last line from a crash mid-append; cut it off so later appends replay
+                        journal.truncate(good_end)
+                        break
+                    records = data.setdefault(entry['category'], {})
+                    if entry['op'] == 'delete':
+                        records.pop(entry['id'], None)
+                    else:
+                        records[entry['id']] = entry['record']
+                    good_end += len(line)
+                    count += 1
+        except FileNotFoundError:
+            pass
+        return count
+
+    def needs_snapshot(self, changes: List[Change]) -> bool:
+        return self._entries + len(changes) >= self.compact_every  # the save will compact
+
+    def save(self, data: Dict[str, Any], changes: List[Change]) -> None:
+        if changes:
+            try:
+                with self._lock, open(self.journal_path, 'a') as journal:
+                    for change in changes:
+                        journal.write(json.dumps({'op': change.action, 'category': change.category,
+                                                  'id': change.record_id, 'record': change.new}, default=to_json) + '\n')
+                    journal.flush()
+                    os.fsync(journal.fileno())
+            except IOError as e:
+                print("An error occurred while writing to the journal:", e)
+                return
+            self._entries += len(changes)
+        if self._entries >= self.compact_every:
+            self.compact(data)
+
+    def compact(self, data: Dict[str, Any]) -> None:
+        """Fold the journal into a fresh snapshot without blocking the caller."""
+        if self._compactor is not None and self._compactor.is_alive():
+            return
+        with self._lock:
+            # Copy the category dicts now (see Record)
+            snapshot = {category: dict(records) for category, records in data.items()}
+            if os.path.exists(self.old_journal_path):
+                # An earlier compaction never finished; the snapshot below covers both journals
+                self._append_file(self.journal_path, self.old_journal_path)
+            elif os.path.exists(self.journal_path):
+                os.replace(self.journal_path, self.old_journal_path)
+            self._entries = 0
+        self._compactor = threading.Thread(target=self._write_snapshot, args=(snapshot,), daemon=True)
+        self._compactor.start()
+
+    def _write_snapshot(self, snapshot: Dict[str, Any]) -> None:
+        try:
+            write_json_atomic(snapshot, self.path)
+            os.remove(self.old_journal_path)
+        except (IOError, OSError) as e:
+            # The old journal is kept, so the next load still replays it
+            print("An error occurred while compacting the journal:", e)
+
+    @staticmethod
+    def _append_file(source_path: str, target_path: str) -> None:
+        if not os.path.exists(source_path):
+            return
+        with open(source_path, 'r') as source, open(target_path, 'a') as target:
+            for line in source:
+                target.write(line)
+        os.remove(source_path)
+
+    def close(self) -> None:
+        if self._compactor is not None:
+            self._compactor.join()
+
+
+class SqliteBackend:
+    """
+    Keeps the records in an SQLite database, one table per category.
+
+    Saves apply only the changed rows in a single transaction. Values are stored as the
+    same text the JSON file uses. Queries are answered by the DataStore's in-memory
+    indexes, which also see changes not saved yet, so the tables carry no indexes of their own.
+    """
+
+    def __init__(self, path: str = SQLITE_FILE, json_path: Optional[str] = DATA_FILE):
+        self.path = path
+        self.json_path = json_path
+        self._lock = threading.Lock()
+        self.connection = None
+
+    def _connect(self) -> None:
+        # Saves may run off the Tk thread, access is serialised by self._lock
+        self.connection = sqlite3.connect(self.path, check_same_thread=False)
+        with self.connection:
+            for category, fields in FIELDS.items():
+                columns = ', '.join(f"{field} TEXT" for field in fields)
+                self.connection.execute(f"CREATE TABLE IF NOT EXISTS {category} (id TEXT PRIMARY KEY, {columns})")
+            for index in ('tasks_employee_id', 'tasks_client_id', 'tasks_date'):
+                self.connection.execute(f"DROP INDEX IF EXISTS {index}")  # made by earlier versions, never queried
+            # Everything that is not a record (ID counters), as JSON text
+            self.connection.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)")
+
+    def load(self) -> Dict[str, Any]:
+        first_run = not os.path.exists(self.path)
+        self._connect()
+        if first_run and self.json_path and os.path.exists(self.json_path):
+            self.import_data(load_data(self.json_path))
+        data = {category: self._select(category, '') for category in CATEGORIES}
+        with self._lock:
+            data['meta'] = {key: json.loads(value)
+                            for key, value in self.connection.execute("SELECT key, value FROM meta")}
+        return data
+
+    def _select(self, category: str, where: str, params: tuple = ()) -> Dict[str, Dict[str, Any]]:
+        fields = FIELDS[category]
+        with self._lock:
+            rows = self.connection.execute(f"SELECT id, {', '.join(fields)} FROM {category} {where}", params).fetchall()
+        return {row[0]: {field: value for field, value in zip(fields, row[1:]) if value is not None} for row in rows}
+
+    @staticmethod
+    def _row(category: str, record_id: str, record: Dict[str, Any]) -> tuple:
+        return (record_id,) + tuple(record.get(field) for field in FIELDS[category])
+
+    def _upsert_sql(self, category: str) -> str:
+        fields = FIELDS[category]
+        return (f"INSERT OR REPLACE INTO {category} (id, {', '.join(fields)}) "
+                f"VALUES ({', '.join('?' * (len(fields) + 1))})")
+
+    def import_data(self, data: Dict[str, Any]) -> None:
+        """Replace the database contents with the given document in one transaction."""
+        with self._lock, self.connection:
+            for category in CATEGORIES:
+                self.connection.execute(f"DELETE FROM {category}")
+                self.connection.executemany(self._upsert_sql(category),
+                                            (self._row(category, record_id, record)
+                                             for record_id, record in data.get(category, {}).items()))
+            self.connection.execute("DELETE FROM meta")
+            self.connection.executemany("INSERT INTO meta (key, value) VALUES (?, ?)",
+                                        ((key, json.dumps(value)) for key, value in data.get('meta', {}).items()))
+
+    def needs_snapshot(self, changes: List[Change]) -> bool:
+        return False  # only the changed rows are written
+
+    def save(self, data: Dict[str, Any], changes: List[Change]) -> None:
+        try:
+            with self._lock, self.connection:
+                for change in changes:
+                    if change.category == 'meta':
+                        self.connection.execute("INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)",
+                                                (change.record_id, json.dumps(change.new)))
+                    elif change.action == 'delete':
+                        self.connection.execute(f"DELETE FROM {change.category} WHERE id = ?", (change.record_id,))
+                    else:
+                        self.connection.execute(self._upsert_sql(change.category),
+                                                self._row(change.category, change.record_id, change.new))
+        except sqlite3.Error as e:
+            print("An error occurred while writing to the database:", e)
+
+    def close(self) -> None:
+        if self.connection is not None:
+            with self._lock:
+                self.connection.close()
+            self.connection = None
+
+
+def migrate_json_to_sqlite(json_path: str = DATA_FILE, db_path: str = SQLITE_FILE) -> Dict[str, int]:
+    """Copy every record from the JSON file into the database, replacing what it held."""
+    data = load_data(json_path)
+    backend = SqliteBackend(db_path, json_path=None)
+    backend.load()
+    backend.import_data(data)
+    backend.close()
+    return {category: len(data[category]) for category in CATEGORIES}
+
+
+def open_backend(mode: str = STORAGE_MODE, path: str = DATA_FILE):
+    if mode == 'journal':
+        return JournalBackend(path)
+    if mode == 'sqlite':
+        # The first run imports management_data.json if the database does not exist yet
+        return SqliteBackend(os.path.splitext(path)[0] + '.db', json_path=path)
+    if mode == 'json':
+        return JsonBackend(path)
+    raise ValueError(f"Unknown storage mode: {mode}")
+
+
+def periods_dir(path: str = DATA_FILE) -> str:
+    """Directory of the closed pay periods kept next to a data file: management_data.periods."""
+    return os.path.splitext(path)[0] + '.periods'
+
+
+class ClosedPeriod(NamedTuple):
+    """A closed pay period, as named by its snapshot file."""
+    kind: str  # 'weekly', 'biweekly' or 'monthly'
+    start: date
+    end: date
+
+
+class ClosedDays(NamedTuple):
+    """The days in a closed pay period when PeriodArchive.snapshot() was called, for a worker to check against."""
+    days: FrozenSet[int]  # day ordinals
+
+    def is_closed(self, day: date) -> bool:
+        return day.toordinal() in self.days
+
+
+class PeriodArchive:
+    """
+    Snapshots of closed pay periods, one JSON file each in a directory next to the data file.
+
+    Files are named kind_start_end.json, so which days are closed is known from a
+    directory listing; a snapshot itself (a plain document whose contents are up to
+    ems_payroll) is only read when a report needs it. Snapshots are immutable: each is
+    written once, made read-only, and closing a period that already has one fails.
+    Other copies of the app close periods too, so the listing is re-read whenever the
+    directory's modification time changes. Deleting a file by hand reopens its period.
+    """
+
+    def __init__(self, directory: str):
+        self.directory = directory
+        self.lock = FileLock(directory + '.lock')
+        self._stamp = None
+        self._periods: Dict[Tuple[str, date], ClosedPeriod] = {}  # (kind, start) -> period
+        self._documents: Dict[ClosedPeriod, Dict[str, Any]] = {}  # snapshots read so far
+        self._closed_days: set = set()  # day ordinals inside any closed period
+
+    @staticmethod
+    def file_name(period: ClosedPeriod) -> str:
+        return f"{period.kind}_{period.start.isoformat()}_{period.end.isoformat()}.json"
+
+    def refresh(self) -> None:
+        stamp = file_stamp(self.directory)
+        if stamp == self._stamp:
+            return
+        periods = {}
+        for name in os.listdir(self.directory) if stamp else ():
+            parts = name[:-len('.json')].split('_')
+            if not name.endswith('.json') or len(parts) != 3:
+                continue
+            try:
+                period = ClosedPeriod(parts[0], date.fromisoformat(parts[1]), date.fromisoformat(parts[2]))
+            except ValueError:
+                continue
+            periods[period.kind, period.start] = period
+        self._periods = periods
+        self._documents = {period: document for period, document in self._documents.items()
+                           if periods.get((period.kind, period.start)) == period}
+        closed_days = set()
+        for period in periods.values():
+            closed_days.update(range(period.start.toordinal(), period.end.toordinal() + 1))
+        self._closed_days = closed_days  # replaced whole, never seen half-built
+        self._stamp = stamp
+
+    def periods(self, kind: Optional[str] = None) -> List[ClosedPeriod]:
+        """Every closed period (of one kind), by start date."""
+        self.refresh()
+        return sorted(period for period in self._periods.values() if kind is None or period.kind == kind)
+
+    def get(self, kind: str, start: date) -> Optional[ClosedPeriod]:
+        self.refresh()
+        return self._periods.get((kind, start))
+
+    def load(self, period: ClosedPeriod) -> Dict[str, Any]:
+        """The snapshot of a closed period; ValueError if it cannot be read."""
+        document = self._documents.get(period)
+        if document is None:
+            path = os.path.join(self.directory, self.file_name(period))
+            try:
+                with open(path, 'r') as my_file:
+                    document = json.load(my_file)
+            except (IOError, ValueError) as e:
+                raise ValueError(f"Pay period snapshot {path} could not be read: {e}") from None
+            self._documents[period] = document
+        return document
+
+    def is_closed(self, day: date) -> bool:
+        """True if day falls in any closed period."""
+        self.refresh()
+        return day.toordinal() in self._closed_days
+
+    def snapshot(self) -> ClosedDays:
+        self.refresh()
+        return ClosedDays(frozenset(self._closed_days))
+
+    def covers(self, start: date, end: date) -> bool:
+        """True if every day of start..end is in a closed period."""
+        self.refresh()
+        return all(day in self._closed_days for day in range(start.toordinal(), end.toordinal() + 1))
+
+    def within(self, start: date, end: date) -> List[ClosedPeriod]:
+        """
+        Non-overlapping closed periods lying entirely in start..end, by start date.
+
+        Periods of different kinds may overlap (a week inside a closed month); of those
+        starting first, the longest is taken.
+        """
+        chosen: List[ClosedPeriod] = []
+        for period in sorted(self.periods(), key=lambda period: (period.start, -period.end.toordinal())):
+            if start <= period.start and period.end <= end and (not chosen or period.start > chosen[-1].end):
+                chosen.append(period)
+        return chosen
+
+    def add(self, document: Dict[str, Any]) -> ClosedPeriod:
+        """Store the snapshot of a newly closed period; ValueError if the period is already closed."""
+        period = ClosedPeriod(document['kind'], date.fromisoformat(document['start']),
+                              date.fromisoformat(document['end']))
+        os.makedirs(self.directory, exist_ok=True)
+        with self.lock:
+            self._stamp = None  # re-list under the lock, another copy may have just closed it
+            if self.get(period.kind, period.start) is not None:
+                raise ValueError(f"The {period.kind} period {period.start.isoformat()} to "
+                                 f"{period.end.isoformat()} is already closed.")
+            path = os.path.join(self.directory, self.file_name(period))
+            write_json_atomic(document, path)
+            os.chmod(path, 0o444)
+        self._documents[period] = document
+        self.refresh()
+        return period
+
+
+def tasks_dir(path: str = DATA_FILE) -> str:
+    """Directory of the archived monthly task partitions kept next to a data file: management_data.tasks."""
+    return os.path.splitext(path)[0] + '.tasks'
+
+
+class TaskArchive:
+    """
+    Tasks of old months, one JSON file per month (YYYY-MM.json) in a directory next to the data file.
+
+    Only months whose every day is in a closed pay period are archived (see
+    DataStore.archive_old_tasks), and tasks dated in a closed period can no longer change,
+    so a partition is written once and from then on only read. Partitions are read when a
+    payroll run, report, search or export reaches back into them, a month at a time, and
+    the ARCHIVE_CACHE_MONTHS most recently used are kept parsed. Reads come from worker
+    threads too, so the archive has its own lock.
+    """
+
+    def __init__(self, directory: str, cache_size: int = ARCHIVE_CACHE_MONTHS):
+        self.directory = directory
+        self.cache_size = cache_size
+        self.lock = FileLock(directory + '.lock')
+        self._lock = threading.RLock()
+        self._stamp = None
+        self._months: List[str] = []  # sorted 'YYYY-MM' of the partitions
+        self._cache: "OrderedDict[str, Dict[str, Record]]" = OrderedDict()  # oldest use first
+
+    def _path(self, month: str) -> str:
+        return os.path.join(self.directory, month + '.json')
+
+    def _refresh(self) -> None:
+        stamp = file_stamp(self.directory)
+        if stamp == self._stamp:
+            return
+        months = []
+        for name in os.listdir(self.directory) if stamp else ():
+            month = name[:-len('.json')]
+            if name.endswith('.json') and len(month) == 7 and month[4] == '-' and (month[:4] + month[5:]).isdigit():
+                months.append(month)
+        self._months = sorted(months)
+        for month in [month for month in self._cache if month not in months]:
+            del self._cache[month]
+        self._stamp = stamp
+
+    def months(self) -> List[str]:
+        with self._lock:
+            self._refresh()
+            return list(self._months)
+
+    def months_between(self, start: date, end: date) -> List[str]:
+        low, high = start.isoformat()[:7], end.isoformat()[:7]
+        return [month for month in self.months() if low <= month <= high]
+
+    def load(self, month: str) -> Dict[str, Record]:
+        """The tasks of an archived month (read, do not change); ValueError if the partition cannot be read."""
+        with self._lock:
+            tasks = self._cache.get(month)
+            if tasks is not None:
+                self._cache.move_to_end(month)
+                return tasks
+            try:
+                data = load_partition(self._path(month))
+            except (IOError, ValueError) as e:
+                raise ValueError(f"Archived tasks {self._path(month)} could not be read: {e}") from None
+            task_type = RECORD_TYPES['tasks']
+            tasks = self._cache[month] = {task_id: task_type.from_dict(task) for task_id, task in data.items()}
+            while len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+            return tasks
+
+    def tasks(self, months: Optional[Iterable[str]] = None,
+              exclude: Optional[Dict[str, Any]] = None) -> Iterator[Tuple[str, Record]]:
+        """
+        (task ID, task) of every archived task (of the given months), a month at a time.
+
+        IDs in exclude, the working set, are skipped: a task is only in both if archiving
+        it was cut short before the data file was saved.
+        """
+        for month in self.months() if months is None else months:
+            for task_id, task in self.load(month).items():
+                if exclude is None or task_id not in exclude:
+                    yield task_id, task
+
+    def tasks_between(self, start: date, end: date,
+                      exclude: Optional[Dict[str, Any]] = None) -> Iterator[Tuple[str, Record]]:
+        """(task ID, task) of the archived tasks dated start..end inclusive."""
+        low, high = start.toordinal(), end.toordinal()
+        for task_id, task in self.tasks(self.months_between(start, end), exclude):
+            day = day_ordinal(task)
+            if day is not None and low <= day <= high:
+                yield task_id, task
+
+    def write(self, month: str, tasks: Dict[str, Record]) -> None:
+        """Store tasks in a month's partition, adding to it if an earlier archiving was cut short."""
+        os.makedirs(self.directory, exist_ok=True)
+        path = self._path(month)
+        with self._lock, self.lock:
+            if os.path.exists(path):
+                tasks = dict(load_partition(path), **tasks)
+                os.chmod(path, 0o644)
+            write_json_atomic(tasks, path)
+            os.chmod(path, 0o444)
+            self._cache.pop(month, None)
+            self._stamp = None
+
+
+class IdAllocator:
+    """
+    Sequential record IDs per prefix, in the existing E123456 style.
+
+    The first allocation for a prefix scans that category's IDs once for the highest
+    number; after that an ID costs a counter increment. Counters are persisted in the
+    document's 'meta' section, so numbers of deleted records are never reused. Past
+    999999 the number simply grows a digit.
+    """
+
+    def __init__(self, counters: Optional[Dict[str, int]] = None):
+        self._next: Dict[str, int] = dict(counters or {})
+        self._seeded = set()
+        self.dirty = False  # counters changed since they were last saved
+
+    def seed(self, prefix: str, records: Dict[str, Any]) -> None:
+        """Start the prefix's counter past the highest number in records, if that has not been done yet."""
+        if prefix in self._seeded:
+            return
+        highest = 0
+        for record_id in records:
+            number = record_id[len(prefix):]
+            if record_id.startswith(prefix) and number.isdigit():
+                highest = max(highest, int(number))
+        self._next[prefix] = max(self._next.get(prefix, 1), highest + 1)
+        self._seeded.add(prefix)
+        self.dirty = True
+
+    def allocate(self, prefix: str, records: Dict[str, Any], count: int = 1) -> List[str]:
+        """count new IDs for records, e.g. a whole block for a bulk import."""
+        self.seed(prefix, records)
+        number = self._next[prefix]
+        new_ids = []
+        while len(new_ids) < count:
+            new_id = f"{prefix}{number:0{ID_DIGITS}d}"
+            number += 1
+            if new_id not in records:  # e.g. written by another copy of the app
+                new_ids.append(new_id)
+        self._next[prefix] = number
+        self.dirty = True
+        return new_ids
+
+    def reserve(self, prefix: str, record_ids: Iterable[str]) -> None:
+        """Continue past IDs of this prefix that records were stored under without allocate(), e.g. by an import."""
+        numbers = [int(record_id[len(prefix):]) for record_id in record_ids
+                   if record_id.startswith(prefix) and record_id[len(prefix):].isdigit()]
+        if numbers and max(numbers) >= self._next.get(prefix, 1):
+            self._next[prefix] = max(numbers) + 1
+            self.dirty = True
+
+    def counters(self) -> Dict[str, int]:
+        return dict(self._next)
+
+    def merge(self, counters: Dict[str, int]) -> None:
+        """Continue past numbers another copy of the app has allocated."""
+        for prefix, number in counters.items():
+            self._next[prefix] = max(self._next.get(prefix, 0), number)
+
+
+class DataStore:
+    """
+    Single in-memory copy of the management data shared by every tab.
+
+    The file is parsed once when the store is created, into the typed records of
+    ems_records; add and update take plain dicts as well. Managers mutate records through
+    add/update/delete so that listeners registered with subscribe() are told exactly
+    which record changed, and call save() to persist the changes made since the last save.
+    Work handed to another thread takes copies of the category dicts (see Record).
+    """
+
+    def __init__(self, path: str = DATA_FILE, backend=None):
+        self.path = path
+        self.backend = backend or open_backend(STORAGE_MODE, path)
+        with timed('load'):
+            self.data = self.backend.load()
+            for category, record_type in RECORD_TYPES.items():
+                # Parse amounts and dates once, here, instead of on every use
+                self.data[category] = {record_id: record_type.from_dict(record)
+                                       for record_id, record in self.data[category].items()}
+        self.ids = IdAllocator(self.data.get('meta', {}).get('next_id'))
+        self.version = 0  # bumped on every change
+        self._listeners: List[tuple] = []
+        self._pending: List[Change] = []
+        # Indexes are built on first use, so startup only pays for parsing the file
+        self._task_index: Optional[TaskDateIndex] = None
+        self._unique_indexes: Dict[str, UniqueIndex] = {}
+        self._search_indexes: Dict[str, SearchIndex] = {}
+        self._name_indexes: Dict[str, NameIndex] = {}
+        self.saver = None  # set to save in the background, see request_save()
+        # (category, ID) -> ID of new records the last save had to store under another ID (see JsonBackend)
+        self.renamed: Dict[tuple, str] = {}
+        # Called with the Conflicts a save reports; printed if unset
+        self.conflict_handler: Optional[Callable[[List[Conflict]], None]] = None
+        # Closed pay periods, read on first use from management_data.periods/
+        self.periods = PeriodArchive(periods_dir(path))
+        # Tasks of old closed months, moved to management_data.tasks/ by archive_old_tasks()
+        self.archive = TaskArchive(tasks_dir(path))
+
+    def subscribe(self, listener: Callable[[Change], None], categories: Optional[Iterable[str]] = None) -> None:
+        """Call listener(change) after every change, optionally only for the given categories."""
+        self._listeners.append((listener, frozenset(categories) if categories else None))
+
+    def unsubscribe(self, listener: Callable[[Change], None]) -> None:
+        self._listeners = [entry for entry in self._listeners if entry[0] != listener]
+
+    def records(self, category: str) -> Dict[str, Record]:
+        return self.data[category]
+
+    def get(self, category: str, record_id: str) -> Optional[Record]:
+        return self.data[category].get(record_id)
+
+    @property
+    def task_index(self) -> TaskDateIndex:
+        if self._task_index is None:
+            self._task_index = TaskDateIndex(self)
+        return self._task_index
+
+    def unique_index(self, category: str) -> Optional[UniqueIndex]:
+        """Names and phone numbers must be unique among employees and among clients; None for tasks."""
+        if category not in UNIQUE_CATEGORIES:
+            return None
+        index = self._unique_indexes.get(category)
+        if index is None:
+            index = self._unique_indexes[category] = UniqueIndex(self, category)
+        return index
+
+    def search_index(self, category: str) -> SearchIndex:
+        """Full-text index of the category, built on first use."""
+        index = self._search_indexes.get(category)
+        if index is None:
+            index = self._search_indexes[category] = SearchIndex(self, category, REFERENCES.get(category))
+        return index
+
+    def name_index(self, category: str) -> NameIndex:
+        """Live ID -> name map of the employees or clients, built on first use."""
+        index = self._name_indexes.get(category)
+        if index is None:
+            index = self._name_indexes[category] = NameIndex(self, category)
+        return index
+
+    def new_id(self, category: str, prefix: Optional[str] = None) -> str:
+        return self.new_ids(category, 1, prefix)[0]
+
+    def new_ids(self, category: str, count: int, prefix: Optional[str] = None) -> List[str]:
+        return self.ids.allocate(prefix or ID_PREFIXES[category], self.data[category], count)
+
+    def tasks_between(self, start: date, end: date) -> Dict[str, Record]:
+        """Tasks dated start..end inclusive, in date order."""
+        tasks = self.data['tasks']
+        return {task_id: tasks[task_id] for task_id in self.task_index.tasks_between(start, end)}
+
+    def archive_old_tasks(self, recent_months: int = RECENT_MONTHS, today: Optional[date] = None) -> int:
+        """
+        Move the tasks of old, closed months out of the working set into the TaskArchive.
+
+        A month is archived once every day of it is in a closed pay period and it is more
+        than recent_months months before today's. Each month's partition is written
+        before its tasks are deleted here, so an interrupted run leaves tasks in both
+        places rather than in neither. The deletions are saved like any other; call
+        request_save() afterwards. Returns the number of tasks archived.
+        """
+        if not self.periods.periods():
+            return 0  # nothing is closed, so nothing can be archived
+        today = today or date.today()
+        first_recent = today.year * 12 + today.month - 1 - recent_months
+        by_month: Dict[str, Dict[str, Record]] = {}
+        for task_id, task in self.data['tasks'].items():
+            day = task.date
+            if isinstance(day, date) and day.year * 12 + day.month - 1 < first_recent:
+                by_month.setdefault(day.isoformat()[:7], {})[task_id] = task
+        # Archived IDs leave the working set; the saved counter keeps them from being reused
+        self.ids.seed(ID_PREFIXES['tasks'], self.data['tasks'])
+        archived = 0
+        for month, tasks in sorted(by_month.items()):
+            if not self.periods.covers(*month_bounds(month)):
+                continue
+            self.archive.write(month, tasks)
+            for task_id in tasks:
+                self.delete('tasks', task_id)
+            archived += len(tasks)
+        return archived
+
+    def add(self, category: str, record_id: str, record: Dict[str, Any]) -> None:
+        if record_id in self.data[category]:
+            raise KeyError(f"{record_id} already exists in {category}")
+        record = as_record(category, record)
+        self.data[category][record_id] = record
+        self._notify(Change(category, 'add', record_id, None, record))
+
+    def update(self, category: str, record_id: str, record: Dict[str, Any]) -> None:
+        old = self.data[category][record_id]  # KeyError if the record does not exist
+        record = as_record(category, record)
+        self.data[category][record_id] = record
+        self._notify(Change(category, 'update', record_id, old, record))
+
+    def delete(self, category: str, record_id: str) -> None:
+        old = self.data[category].pop(record_id)  # KeyError if the record does not exist
+        self._notify(Change(category, 'delete', record_id, old, None))
+
+    def save(self) -> None:
+        self.finish_save(self.prepare_save()())
+
+    def prepare_save(self) -> Callable[[], None]:
+        """The function writing the changes made since the last save; pass its result to finish_save()."""
+        if self.ids.dirty:
+            self._set_meta('next_id', self.ids.counters())
+            self.ids.dirty = False
+        changes, self._pending = self._pending, []
+        data = self.data
+        if self.backend.needs_snapshot(changes):
+            # The backend writes the whole document from a worker: copy the category dicts (see Record)
+            data = {category: dict(records) for category, records in self.data.items()}
+        backend = self.backend
+
+        def write() -> Optional[SyncResult]:
+            with timed('save'):
+                return backend.save(data, changes)
+        return write
+
+    def finish_save(self, result: Optional[SyncResult]) -> None:
+        """
+        Apply what a save found other copies of the app had written to the file.
+
+        Their records are notified to listeners like local changes but not saved again.
+        A record changed here again since the save began keeps this copy's version,
+        which the next save writes.
+        """
+        if result is None:
+            return
+        self.ids.merge(result.counters)
+        self.renamed = result.renamed
+        edited = {(change.category, change.record_id) for change in self._pending}
+        for change in result.changes:
+            if (change.category, change.record_id) in edited:
+                continue
+            records = self.data[change.category]
+            old = records.get(change.record_id)
+            new = None if change.new is None else as_record(change.category, change.new)
+            if new is None:
+                if records.pop(change.record_id, None) is None:
+                    continue
+            else:
+                records[change.record_id] = new
+            self._notify(_change(change.category, change.record_id, old, new), local=False)
+        if result.conflicts:
+            if self.conflict_handler is not None:
+                self.conflict_handler(result.conflicts)
+            else:
+                for conflict in result.conflicts:
+                    print(f"{conflict.record_id} in {conflict.category} was also changed by another user; "
+                          f"their version was kept")
+
+    def request_save(self) -> None:
+        """Persist soon: through self.saver when one is installed, otherwise right away."""
+        if self.saver is not None:
+            self.saver.request()
+        else:
+            self.save()
+
+    def close(self) -> None:
+        """Wait for background writes (journal compaction) to finish."""
+        self.backend.close()
+
+    def _set_meta(self, key: str, value: Any) -> None:
+        # Bookkeeping, not a record: persisted with the next save but not sent to listeners
+        meta = self.data.setdefault('meta', {})
+        self._pending.append(Change('meta', 'update', key, meta.get(key), value))
+        meta[key] = value
+
+    def _notify(self, change: Change, local: bool = True) -> None:
+        self.version += 1
+        if local:
+            self._pending.append(change)
+        for listener, categories in list(self._listeners):
+            if categories is None or change.category in categories:
+                listener(change)
+
+
+# One-shot migration: python ems_store.py migrate [management_data.json] [management_data.db]
+if __name__ == '__main__':
+    if len(sys.argv) < 2 or sys.argv[1] != 'migrate':
+        sys.exit("usage: python ems_store.py migrate [json_file] [db_file]")
+    counts = migrate_json_to_sqlite(*sys.argv[2:4])
+    print("Migrated " + ", ".join(f"{count} {category}" for category, count in counts.items()))
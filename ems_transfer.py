@@ -0,0 +1,237 @@
+import csv
+import os
+from datetime import date, datetime
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional, Sequence, TextIO, Tuple
+
+from ems_metrics import timed
+from ems_payroll import PayrollResult
+from ems_services import BatchResult, RecordService
+from ems_store import FIELDS, DataStore
+
+
+# Constants
+FORMATS = ('csv', 'xlsx')
+ID_COLUMN = 'id'
+PROGRESS_EVERY = 5000  # rows between progress reports of an export
+
+
+# Helper functions
+def file_format(path: str, default: str = 'csv') -> str:
+    """'csv' or 'xlsx' from the file extension, else default."""
+    extension = os.path.splitext(path)[1].lstrip('.').lower()
+    return extension if extension in FORMATS else default
+
+
+def record_columns(category: str) -> List[str]:
+    return [ID_COLUMN] + list(FIELDS[category])
+
+
+def payroll_columns(grouping: str) -> List[str]:
+    if grouping == 'employee':
+        return ['employee_id', 'name', 'hours', 'pay']
+    if grouping == 'client':
+        return ['client_id', 'client_name', 'employee_id', 'name', 'pay']
+    return [grouping, 'employee_id', 'name', 'pay']
+
+
+def cell_text(value) -> str:
+    """A spreadsheet cell as the text a form would hold: 15.0 -> '15', dates as YYYY-MM-DD."""
+    if value is None:
+        return ''
+    if isinstance(value, datetime):
+        value = value.date()
+    if isinstance(value, date):
+        return value.isoformat()
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return str(value).strip()
+
+
+# Writing
+def write_csv(out: TextIO, columns: Sequence[str], rows: Iterable[Sequence[Any]]) -> int:
+    """Write the header and rows to an open text file one row at a time; returns the number of rows."""
+    writer = csv.writer(out)
+    writer.writerow(columns)
+    count = 0
+    for row in rows:
+        writer.writerow(row)
+        count += 1
+    return count
+
+
+def write_xlsx(path: str, columns: Sequence[str], rows: Iterable[Sequence[Any]], title: str = 'Sheet') -> int:
+    """
+    Write the header and rows to an Excel workbook; returns the number of rows.
+
+    openpyxl is imported here, so it is only needed for Excel files. Its write-only mode
+    streams the rows out instead of building the sheet in memory.
+    """
+    try:
+        from openpyxl import Workbook
+    except ImportError:
+        raise ValueError("Excel files need the openpyxl package (pip install openpyxl)") from None
+    workbook = Workbook(write_only=True)
+    sheet = workbook.create_sheet(title[:31])  # Excel's limit on sheet names
+    sheet.append(list(columns))
+    count = 0
+    for row in rows:
+        sheet.append(list(row))
+        count += 1
+    workbook.save(path)
+    return count
+
+
+def write_rows(path: str, columns: Sequence[str], rows: Iterable[Sequence[Any]], file_type: Optional[str] = None,
+               title: str = 'Sheet') -> int:
+    """
+    Write rows to a CSV or Excel file (by extension unless file_type is given); returns the number of rows.
+
+    The file is written next to path and renamed over it when complete, so a failed or
+    cancelled export never leaves half a file behind.
+    """
+    file_type = file_type or file_format(path)
+    temp_path = path + '.tmp'
+    try:
+        if file_type == 'xlsx':
+            count = write_xlsx(temp_path, columns, rows, title)
+        else:
+            with open(temp_path, 'w', newline='', encoding='utf-8') as out:
+                count = write_csv(out, columns, rows)
+        os.replace(temp_path, path)
+    except BaseException:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
+    return count
+
+
+def record_rows(records: Dict[str, Any], category: str,
+                progress: Optional[Callable[[float], None]] = None, archive=None) -> Iterator[List[Any]]:
+    """
+    One [id, field...] row per record, generated as the file is written.
+
+    With a TaskArchive, the archived tasks follow the records a month at a time, and
+    progress counts the records as one step and each archived month as another.
+    """
+    fields = FIELDS[category]
+    total = len(records)
+    months = archive.months() if archive is not None else []
+    steps = len(months) + 1
+    for count, (record_id, record) in enumerate(records.items(), 1):
+        yield [record_id] + [record.get(field, '') for field in fields]
+        if progress is not None and count % PROGRESS_EVERY == 0:
+            progress(count / total / steps)
+    for done, month in enumerate(months, 2):
+        for record_id, record in archive.tasks([month], records):
+            yield [record_id] + [record.get(field, '') for field in fields]
+        if progress is not None:
+            progress(done / steps)
+
+
+def prepare_export(store: DataStore, category: str, path: str, file_type: Optional[str] = None,
+                   archived: bool = False) -> Callable[..., int]:
+    """The function writing a copy of a category (and, if archived, the archived tasks) to path; returns the count."""
+    records = dict(store.records(category))
+    archive = store.archive if archived and category == 'tasks' else None
+
+    def write(progress: Optional[Callable[[float], None]] = None) -> int:
+        with timed('export'):
+            return write_rows(path, record_columns(category), record_rows(records, category, progress, archive),
+                              file_type, title=category.capitalize())
+    return write
+
+
+def export_records(store: DataStore, category: str, path: str, file_type: Optional[str] = None,
+                   archived: bool = False) -> int:
+    return prepare_export(store, category, path, file_type, archived)()
+
+
+def payroll_rows(service, result: PayrollResult) -> Iterator[List[Any]]:
+    columns = payroll_columns(result.grouping)
+    for row in service.rows(result):
+        yield [row.get(column, '') for column in columns]
+
+
+def export_payroll(service, result: PayrollResult, path: str, file_type: Optional[str] = None) -> int:
+    """Write a payroll result as a CSV or Excel table, one row per employee (and group)."""
+    with timed('export'):
+        return write_rows(path, payroll_columns(result.grouping), payroll_rows(service, result), file_type,
+                          title='Payroll')
+
+
+# Reading
+def read_rows(path: str, category: str, file_type: Optional[str] = None) -> Iterator[Tuple[int, Dict[str, str]]]:
+    """
+    (line number, row) for every row of a CSV or Excel file of the category's records.
+
+    Rows are read one at a time. The file needs a column for each of the category's
+    fields; the id column is optional. Raises ValueError naming the missing columns.
+    """
+    if (file_type or file_format(path)) == 'xlsx':
+        yield from _read_xlsx(path, category)
+        return
+    with open(path, newline='', encoding='utf-8-sig') as f:
+        reader = csv.DictReader(f)
+        _check_columns(path, category, reader.fieldnames or ())
+        for row in reader:
+            yield reader.line_num, {column: (value or '').strip() for column, value in row.items() if column}
+
+
+def _read_xlsx(path: str, category: str) -> Iterator[Tuple[int, Dict[str, str]]]:
+    try:
+        from openpyxl import load_workbook
+    except ImportError:
+        raise ValueError("Excel files need the openpyxl package (pip install openpyxl)") from None
+    workbook = load_workbook(path, read_only=True, data_only=True)
+    try:
+        rows = workbook.active.iter_rows(values_only=True)
+        columns = [cell_text(value) for value in next(rows, ())]
+        _check_columns(path, category, columns)
+        for line, values in enumerate(rows, 2):
+            if any(value is not None for value in values):
+                yield line, {column: cell_text(value) for column, value in zip(columns, values) if column}
+    finally:
+        workbook.close()
+
+
+def _check_columns(path: str, category: str, columns: Sequence[str]) -> None:
+    missing = [field for field in FIELDS[category] if field not in columns]
+    if missing:
+        raise ValueError(f"{path} has no column for: {', '.join(missing)}")
+
+
+def prepare_import_rows(service: RecordService,
+                        rows: Iterable[Tuple[int, Dict[str, str]]]) -> Callable[[], Callable[[], BatchResult]]:
+    """
+    The function reading and checking (line number, row) pairs on a worker.
+
+    It returns the function that stores the valid rows as one batch with one save, to call
+    back on the thread that changes the store; errors are keyed by line number. Rows go
+    straight from rows into the check, so the file is never held in memory whole.
+    """
+    line_numbers: List[int] = []  # line of each row, by position in the batch
+
+    def records() -> Iterator[Dict[str, str]]:
+        for line, row in rows:
+            line_numbers.append(line)
+            yield row
+
+    check = service.prepare_import(records())
+
+    def run() -> Callable[[], BatchResult]:
+        checked = check()
+
+        def store() -> BatchResult:
+            result = service.finish_import(checked)
+            return BatchResult(result.ids, [(line_numbers[position], message) for position, message in result.errors])
+        return store
+    return run
+
+
+def import_rows(service: RecordService, rows: Iterable[Tuple[int, Dict[str, str]]]) -> BatchResult:
+    """Validate and store (line number, row) pairs as one batch; errors are keyed by line number."""
+    return prepare_import_rows(service, rows)()()
+
+
+def import_file(service: RecordService, path: str, file_type: Optional[str] = None) -> BatchResult:
+    return import_rows(service, read_rows(path, service.category, file_type))
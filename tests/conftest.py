@@ -0,0 +1,21 @@
+import os
+import sys
+from datetime import date
+
+import pytest
+
+# The app's modules sit at the top of the repository rather than in a package
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from ems_bench import generate_data  # noqa: E402
+from ems_store import DataStore, write_json_atomic  # noqa: E402
+
+
+@pytest.fixture
+def store(tmp_path):
+    """A JSON-mode store over a small generated data file."""
+    path = str(tmp_path / 'management_data.json')
+    write_json_atomic(generate_data(10, 5, 500, start=date(2024, 1, 1), days=90), path)
+    store = DataStore(path)
+    yield store
+    store.close()
@@ -0,0 +1,15 @@
+from datetime import date
+
+from ems_services import PayrollService
+
+
+def test_employee_payroll_after_week_breakdown_of_same_range(store):
+    service = PayrollService(store)
+    start, end = date(2024, 1, 1), date(2024, 1, 31)
+    week = service.calculate(start, end, 'week')
+    employee = service.calculate(start, end, 'employee')
+    assert employee.grouping == 'employee'
+    assert employee.groups == {}
+    assert employee.totals == week.totals
+    rows = sorted(service.rows(employee), key=lambda row: row['employee_id'])
+    assert rows and set(rows[0]) == {'employee_id', 'name', 'hours', 'pay'}
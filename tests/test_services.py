@@ -0,0 +1,36 @@
+from datetime import date
+
+import pytest
+
+from ems_services import EmployeeService, PayrollService, TaskService, ValidationError, validate_record
+
+EMPLOYEE = {'name': 'New Starter', 'phone_number': '5550001111', 'position': 'Cleaner', 'hourly_rate': '10'}
+
+
+@pytest.mark.parametrize('rate', ['nan', 'inf', '-inf', 'Infinity', '-1', 'ten'])
+def test_rejects_rates_that_are_not_finite_non_negative_numbers(store, rate):
+    with pytest.raises(ValidationError, match='Hourly rate'):
+        validate_record(store, 'employees', dict(EMPLOYEE, hourly_rate=rate))
+
+
+def test_accepts_a_finite_rate(store):
+    validate_record(store, 'employees', EMPLOYEE)
+
+
+def test_imported_ids_are_not_handed_out_again(store):
+    service = EmployeeService(store)
+    service.import_many([dict(EMPLOYEE, id='E000500')])
+    service.delete('E000500')
+    assert int(service.add(dict(EMPLOYEE, name='Later Starter', phone_number='5550002222'))[1:]) > 500
+
+
+def test_a_period_changed_while_it_is_closed_is_left_open(store):
+    service = PayrollService(store)
+    prepared = service.prepare_close_period('monthly', date(2024, 1, 15))()
+    task_id, task = next((task_id, task) for task_id, task in store.records('tasks').items() if task['date'] < '2024-02-01')
+    TaskService(store).update(task_id, dict(task, hours_worked=str(float(task['hours_worked']) + 1)))
+    with pytest.raises(ValueError, match='changed while'):
+        service.finish_close_period(prepared)
+    assert store.periods.get('monthly', date(2024, 1, 1)) is None
+    service.close_period('monthly', date(2024, 1, 15))
+    assert store.periods.get('monthly', date(2024, 1, 1)) is not None
@@ -0,0 +1,48 @@
+import ems_store
+from ems_store import DataStore, JsonBackend
+
+EMPLOYEE = {'name': 'New Starter', 'phone_number': '5550001111', 'position': 'Cleaner', 'hourly_rate': '10'}
+
+
+def test_concurrent_adds_of_the_same_employee_keep_the_first(store):
+    other = DataStore(store.path, backend=JsonBackend(store.path))
+    conflicts = []
+    other.conflict_handler = conflicts.extend
+    first = store.new_id('employees')
+    store.add('employees', first, EMPLOYEE)
+    store.save()
+    other.new_id('employees')
+    second = other.new_id('employees')
+    other.add('employees', second, dict(EMPLOYEE, phone_number='5550002222'))
+    task = other.new_id('tasks')
+    other.add('tasks', task, {'task_name': 'Deep clean', 'employee_id': second, 'client_id': 'C000001',
+                              'hours_worked': '2', 'date': '2024-01-03'})
+    other.save()
+
+    assert [conflict.record_id for conflict in conflicts] == [second]
+    saved = DataStore(store.path, backend=JsonBackend(store.path))
+    assert [employee.name for employee in saved.records('employees').values()].count('New Starter') == 1
+    assert saved.records('tasks')[task].employee_id == first
+    assert second not in other.records('employees')
+
+
+def test_a_failed_write_is_retried_after_another_copy_saves(store, monkeypatch):
+    other = DataStore(store.path, backend=JsonBackend(store.path))
+    conflicts = []
+    store.conflict_handler = conflicts.extend
+    store.update('employees', 'E000001', dict(store.get('employees', 'E000001'), position='Manager'))
+
+    def fail(data, path):
+        raise IOError('disk full')
+    monkeypatch.setattr(ems_store, 'write_json_atomic', fail)
+    store.save()
+    monkeypatch.undo()
+
+    other.update('employees', 'E000002', dict(other.get('employees', 'E000002'), position='Driver'))
+    other.save()
+    store.save()  # retries the failed change, merged with the other copy's
+
+    assert conflicts == []
+    saved = DataStore(store.path, backend=JsonBackend(store.path))
+    assert saved.get('employees', 'E000001').position == 'Manager'
+    assert saved.get('employees', 'E000002').position == 'Driver'